@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+'''Benchmark of messages passed through the controller, and of the encoding
+of these messages with pickle and with the wire protocol of the controller.
+Signatures are written to a temporary home directory.
+
+Usage:
+    python bench_controller.py [num_messages]
+'''
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+os.environ['HOME'] = tempfile.mkdtemp()
+
+from threading import Event
+
+import zmq
+
+from sos.controller import Controller, connect_controllers, disconnect_controllers
+from sos.messages import decode_msg, encode_msg, send_message
+from sos.targets import sos_targets
+from sos.utils import env
+
+step_output = sos_targets([f'result/sample_{i}.bam' for i in range(20)])
+
+messages = {
+    'progress': ['progress', 'substep_completed', 'a9c4e6f8a1c3e5f7'],
+    'signature': ['workflow', 'task', 'b1d3f5a7b2d4f6a8',
+                  {'ret_code': 0, 'task': 'b1d3f5a7b2d4f6a8', 'start_time': 1546300800.12,
+                   'end_time': 1546300900.65, 'peak_cpu': 100.0, 'peak_mem': 123456789}],
+    'step_output': step_output,
+}
+
+
+def bench_encoding(n):
+    for name, msg in messages.items():
+        start = time.time()
+        for i in range(n):
+            pickle.loads(pickle.dumps(msg))
+        pickle_rate = n / (time.time() - start)
+        start = time.time()
+        for i in range(n):
+            decode_msg(encode_msg(msg))
+        sos_rate = n / (time.time() - start)
+        print(f'{name:<12} {pickle_rate:>12.0f} msgs/sec (pickle) {sos_rate:>12.0f} msgs/sec (sos)')
+
+
+def bench_controller(n):
+    env.verbosity = 0
+    env.config['exec_mode'] = 'run'
+    env.config['run_mode'] = 'run'
+    env.config['master_id'] = 'benchmark'
+    ready = Event()
+    controller = Controller(ready)
+    controller.start()
+    ready.wait()
+    context = zmq.Context()
+    connect_controllers(context)
+    try:
+        start = time.time()
+        for i in range(n):
+            send_message(env.controller_push_socket, messages['progress'])
+        # the controller handles all pushed messages before replying
+        env.controller_req_socket.send_pyobj(['nprocs'])
+        env.controller_req_socket.recv_pyobj()
+        print(f'{"progress":<12} {n / (time.time() - start):>12.0f} msgs/sec through controller')
+        #
+        start = time.time()
+        for i in range(n):
+            send_message(env.signature_push_socket, messages['signature'])
+        # signatures are saved before signature requests are answered
+        env.signature_req_socket.send_pyobj(['workflow', 'placeholders', 'benchmark'])
+        env.signature_req_socket.recv_pyobj()
+        print(f'{"signature":<12} {n / (time.time() - start):>12.0f} msgs/sec through controller')
+        # latency of controller requests during bursts of signature writes,
+        # such as those from many substep workers
+        for burst in (100, 1000, 10000):
+            for i in range(burst):
+                send_message(env.signature_push_socket, messages['signature'])
+            start = time.time()
+            env.controller_req_socket.send_pyobj(['nprocs'])
+            env.controller_req_socket.recv_pyobj()
+            latency = time.time() - start
+            env.signature_req_socket.send_pyobj(['workflow', 'placeholders', 'benchmark'])
+            env.signature_req_socket.recv_pyobj()
+            print(f'{"latency":<12} {latency * 1000:>12.2f} ms after {burst} signature writes')
+        controller._completed_steps['step_10'] = step_output
+        start = time.time()
+        for i in range(n):
+            env.controller_req_socket.send_pyobj(['step_output', 'step_10'])
+            env.controller_req_socket.recv_pyobj()
+        print(f'{"step_output":<12} {n / (time.time() - start):>12.0f} requests/sec through controller')
+    finally:
+        env.controller_req_socket.send_pyobj(['done', True])
+        env.controller_req_socket.recv_pyobj()
+        disconnect_controllers(context)
+        controller.join()
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    bench_encoding(n)
+    bench_controller(n)
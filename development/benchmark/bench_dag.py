@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+'''Benchmark of the construction of DAGs with a chain of steps, each of which
+takes the output of its previous step as input, and of the incremental update
+of the DAG after more steps are added.
+
+Usage:
+    python bench_dag.py [num_steps] [num_targets_per_step]
+'''
+import sys
+import time
+
+from sos.dag import SoS_DAG
+from sos.targets import sos_targets
+
+
+def bench(n_steps, n_targets):
+    context = {'__signature_vars__': set(), '__environ_vars__': set(),
+               '__changed_vars__': set()}
+    outputs = [sos_targets([f'result/step_{i}/sample_{j}.bam' for j in range(n_targets)])
+               for i in range(n_steps + 10)]
+    dag = SoS_DAG(name='benchmark')
+    start = time.time()
+    for i in range(n_steps):
+        dag.add_step(f'uuid_{i}', f'step_{i}', i,
+                     outputs[i - 1] if i > 0 else sos_targets(), sos_targets(),
+                     outputs[i], context=context)
+    add_time = time.time() - start
+    start = time.time()
+    dag.build()
+    build_time = time.time() - start
+    print(f'{n_steps} steps with {n_steps * n_targets} targets: add_step {add_time:.2f} sec, build {build_time:.2f} sec')
+    assert dag.number_of_edges() == n_steps - 1
+    #
+    start = time.time()
+    for i in range(n_steps, n_steps + 10):
+        dag.add_step(f'uuid_{i}', f'step_{i}', i, outputs[i - 1], sos_targets(),
+                     outputs[i], context=context)
+        dag.build()
+    print(f'add_step and build for 10 more steps: {time.time() - start:.2f} sec')
+    assert dag.number_of_edges() == n_steps + 9
+
+
+if __name__ == '__main__':
+    n_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_targets = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    bench(n_steps, n_targets)
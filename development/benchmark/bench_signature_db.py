@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+'''Benchmark of concurrent writers to the step signature database, which
+simulates multiple "sos run" processes in the same project directory.
+
+Usage:
+    python bench_signature_db.py [num_writers] [num_records] [commit_every]
+'''
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+from sos.signatures import StepSignatures
+from sos.utils import env
+
+
+def writer(exec_dir, journal_mode, idx, n, commit_every):
+    env.exec_dir = exec_dir
+    StepSignatures._journal_mode = journal_mode
+    sigs = StepSignatures()
+    sig = {'input': {f'data/sample_{i}.txt': (1.0, 100, 'a' * 16) for i in range(10)}}
+    start = time.time()
+    for i in range(n):
+        sigs.set(f'{idx}_{i}', sig, 'step')
+        if commit_every and i % commit_every == 0:
+            sigs.commit()
+        # readers from the same process
+        if i % 10 == 0:
+            sigs.get(f'{idx}_{i // 2}')
+    sigs.close()
+    return time.time() - start
+
+
+def bench(journal_mode, n_writers, n, commit_every):
+    with tempfile.TemporaryDirectory() as exec_dir:
+        with mp.Pool(n_writers) as pool:
+            start = time.time()
+            times = pool.starmap(writer, [(exec_dir, journal_mode, i, n, commit_every)
+                                          for i in range(n_writers)])
+            total = time.time() - start
+    print(f'{journal_mode:<8} {n_writers} writers: {n * n_writers / total:>10.0f} records/s, '
+          f'slowest writer {max(times):.2f}s')
+
+
+if __name__ == '__main__':
+    n_writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    commit_every = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    for journal_mode in ('DELETE', 'WAL'):
+        bench(journal_mode, n_writers, n, commit_every)
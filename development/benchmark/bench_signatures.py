@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+'''Micro-benchmark of the encoding and decoding of step signatures, comparing
+signatures pickled and compressed by lzma (previous versions of sos), pickled
+and compressed by zlib, and saved in the compact schema of encode_signature.
+
+Usage:
+    python bench_signatures.py [num_files_per_substep] [num_substeps]
+'''
+import lzma
+import pickle
+import sys
+import time
+import zlib
+
+from sos.signatures import decode_signature, encode_signature
+from sos.targets import sos_targets
+
+
+def make_signature(n_files):
+    input_files = sos_targets([f'data/sample_{i}.fastq.gz' for i in range(n_files)],
+        group_by=2)
+    output_files = sos_targets([f'result/sample_{i}.bam' for i in range(n_files)])
+    depends_files = sos_targets('ref/hg38.fa')
+    return {
+        'input': {str(x): (1546300800.123456, 123456789, 'a2c4e6f8a1c3e5f7') for x in input_files},
+        'input_obj': input_files,
+        'output': {str(x): (1546300900.654321, 987654321, 'b1d3f5a7b2d4f6a8') for x in output_files},
+        'output_obj': output_files,
+        'depends': {str(x): (1546300000.0, 3000000000, 'c3e5a7b9c4e6a8b1') for x in depends_files},
+        'depends_obj': depends_files,
+        'init_context_sig': {'cutoff': 'd4f6a8b1d5f7a9b2'},
+        'end_context': {}
+    }
+
+
+def bench(name, encode, decode, sig, n):
+    start = time.time()
+    for i in range(n):
+        blob = encode(sig)
+    encode_time = (time.time() - start) / n
+    start = time.time()
+    for i in range(n):
+        decode(blob)
+    decode_time = (time.time() - start) / n
+    print(f'{name:<12} {len(blob):>8} bytes {encode_time * 1e6:>10.1f} us/encode {decode_time * 1e6:>10.1f} us/decode')
+
+
+if __name__ == '__main__':
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    sig = make_signature(n_files)
+    print(f'Signature with {n_files} input and output files, {n} substeps')
+    bench('lzma', lambda x: lzma.compress(pickle.dumps(x)),
+          lambda x: pickle.loads(lzma.decompress(x)), sig, n)
+    bench('zlib', lambda x: zlib.compress(pickle.dumps(x, protocol=4), 1),
+          lambda x: pickle.loads(zlib.decompress(x)), sig, n)
+    bench('compact', encode_signature, decode_signature, sig, n)
@@ -178,6 +178,7 @@ singularity_build = sos.singularity.actions:singularity_build
 
 [sos_taskengines]
 process = sos.tasks:BackgroundProcess_TaskEngine
+array = sos.task_engines:ArrayJob_TaskEngine
 
 [sos_previewers]
 *.pdf,1 = sos.preview:preview_pdf
@@ -208,6 +208,13 @@ def get_run_parser(interactive=False, with_workflow=True, desc_only=False):
             overrides option "max_running_jobs" of a task queue (option -q)
             so that you can, for example, submit one job at a time (with
             -J 1) to test the task queue.''')
+    parser.add_argument('--min-substep-workers', type=int, metavar='N',
+                        dest='__min_substep_workers__',
+                        help='''Number of substep workers that are started before the
+            execution of substeps and kept alive when they are idle, so that steps
+            with many small concurrent substeps do not wait for the start of
+            workers. This option overrides option "sos.min_substep_workers" in
+            the config file, and is capped by option -j. Default to 0.''')
     parser.add_argument('-c', dest='__config__', metavar='CONFIG_FILE',
                         help='''A configuration file in the format of YAML/JSON. The content
             of the configuration file will be available as a dictionary
@@ -365,6 +372,7 @@ def cmd_run(args, workflow_args):
             'default_queue': args.__queue__,
             'max_procs': args.__max_procs__,
             'max_running_jobs': args.__max_running_jobs__,
+            'min_substep_workers': args.__min_substep_workers__,
             'sig_mode': 'ignore' if args.dryrun else args.__sig_mode__,
             'run_mode': 'dryrun' if args.dryrun else 'run',
             'verbosity': args.verbosity,
@@ -470,6 +478,7 @@ def cmd_dryrun(args, workflow_args):
     args.__sig_mode__ = 'ignore'
     args.__max_procs__ = 1
     args.__max_running_jobs__ = 1
+    args.__min_substep_workers__ = None
     args.dryrun = True
     args.__bin_dirs__ = []
     args.__remote__ = None
@@ -1128,6 +1137,10 @@ def get_remove_parser(desc_only=False):
     group.add_argument('-p', '--placeholders', action='store_true', default=False,
                        help='''Remove placeholder files that might have been left
         uncleaned after an interrupted dryrun.''')
+    group.add_argument('-w', '--workflows', action='store_true', default=False,
+                       help='''Remove runtime information of workflows executed under the
+        current directory (used for reports and option --tracked), optionally
+        limited by option --age, and compact the workflow signature database.''')
     parser.add_argument('-e', '--external', action='store_true', default=False,
                         help='''By default the remove command will only remove files and
         signatures under the current project directory. This option allows
@@ -1193,6 +1206,22 @@ def cmd_remove(args, unknown_args):
     env.verbosity = args.verbosity
 
     workflow_signatures = WorkflowSignatures()
+    if args.workflows:
+        age = None
+        if args.age:
+            from .utils import expand_time
+            age = expand_time(args.age, default_unit='d')
+        if args.dryrun:
+            env.logger.info(f'{len(workflow_signatures.workflows())} workflows are recorded.')
+            return
+        removed = workflow_signatures.remove_workflows(age)
+        if removed:
+            env.logger.info(
+                f'Runtime information of {removed} workflow{"s are" if removed > 1 else " is"} removed.')
+        else:
+            env.logger.info('No workflow information is removed.')
+        return
+
     if args.placeholders:
         placeholder_files = workflow_signatures.placeholders()
         removed: int = 0
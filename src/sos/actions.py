@@ -26,6 +26,7 @@ from tqdm import tqdm as ProgressBar
 from concurrent.futures import ThreadPoolExecutor
 
 from .eval import interpolate
+from .messages import send_message
 from .parser import SoS_Script
 from .syntax import SOS_ACTION_OPTIONS
 from .targets import (UnknownTarget, executable, file_target, fileMD5, path,
@@ -382,8 +383,8 @@ class SoS_ExecuteScript:
                 # if not notebook, not task, signature database is avaialble.
                 if env.sos_dict['_index'] == 0 and env.config['run_mode'] != 'interactive' \
                     and '__std_out__' not in env.sos_dict and hasattr(env, 'signature_push_socket'):
-                    env.signature_push_socket.send_pyobj(['workflow', 'transcript', env.sos_dict['step_name'],
-                                              repr({'start_time': time.time(), 'command': transcript_cmd, 'script': self.script})])
+                    send_message(env.signature_push_socket, ['workflow', 'transcript', env.sos_dict['step_name'],
+                                              {'start_time': time.time(), 'command': transcript_cmd, 'script': self.script}])
 
                 if env.config['run_mode'] == 'interactive':
                     if 'stdout' in kwargs or 'stderr' in kwargs:
@@ -815,7 +816,7 @@ def downloadURL(URL, dest, decompress=False, index=None):
             prog.close()
             with open(dest + '.md5') as md5:
                 rec_md5 = md5.readline().split()[0].strip()
-                obs_md5 = fileMD5(dest, partial=False)
+                obs_md5 = fileMD5(dest, algorithm='md5', strategy='full')
                 if rec_md5 != obs_md5:
                     prog.set_description(
                         message + ':\033[91m MD5 signature mismatch\033[0m')
@@ -8,6 +8,7 @@ import zmq
 import time
 import threading
 from collections import defaultdict
+from .messages import recv_message
 from .utils import env
 from .signatures import StepSignatures, WorkflowSignatures
 
@@ -172,45 +173,24 @@ class DotProgressBar:
         self.update('done', msg)
         self.stop_event.set()
 
-class Controller(threading.Thread):
-    '''This controller is used by both sos and sos-notebook, and there
-    can be two controllers one as a slave (sos) and one as a master
-    (notebook). We shared the same code base because step executors need
-    need to talk to the same controller (signature, controller etc) when
-    they are executed in sos or sos notebook.
-    '''
-    LRU_READY = b"\x01"
+class SignatureWorker(threading.Thread):
+    '''A thread that handles all reads and writes of signatures so that
+    signature traffic does not delay the routing of messages by the
+    controller. It is controlled by the controller through an inproc socket,
+    which is unique to each worker so that more than one controller can be
+    started in the same process.'''
 
-    def __init__(self, ready, kernel=None):
+    def __init__(self, context, ready):
         threading.Thread.__init__(self)
-        #self.daemon = True
+        self.context = context
+        self.ready = ready
+        self.control_address = f'inproc://sos_signature_control_{id(self)}'
+        # error that prevents the worker from starting
+        self.error = None
 
         self.step_signatures = StepSignatures()
         self.workflow_signatures = WorkflowSignatures()
 
-        self.ready = ready
-        self.kernel = kernel
-        # number of active running master processes
-        self._nprocs = 0
-
-        self._completed = defaultdict(int)
-        self._ignored = defaultdict(int)
-
-        # completed steps
-        self._completed_steps = {}
-
-        # substgep workers
-        self._frontend_requests = []
-        self._substep_workers = []
-        self._n_working_workers = 0
-        self._worker_pending_time = []
-        # self.event_map = {}
-        # for name in dir(zmq):
-        #     if name.startswith('EVENT_'):
-        #         value = getattr(zmq, name)
-        #          self.event_map[value] = name
-        self.console_logger = None
-
     def handle_sig_push_msg(self, msg):
         try:
             if msg[0] == 'workflow':
@@ -225,14 +205,17 @@ class Controller(threading.Thread):
         except Exception as e:
             env.logger.warning(f'Failed to push signature {msg}: {e}')
 
+    def handle_pending_sig_push_msgs(self):
+        while True:
+            if self.sig_push_socket.poll(0):
+                self.handle_sig_push_msg(recv_message(self.sig_push_socket))
+            else:
+                break
+
     def handle_sig_req_msg(self, msg):
         try:
             # make sure all records have been saved before returning information
-            while True:
-                if self.sig_push_socket.poll(0):
-                    self.handle_sig_push_msg(self.sig_push_socket.recv_pyobj())
-                else:
-                    break
+            self.handle_pending_sig_push_msgs()
             if msg[0] == 'workflow':
                 if msg[1] == 'clear':
                     self.workflow_signatures.clear()
@@ -249,6 +232,9 @@ class Controller(threading.Thread):
                 if msg[1] == 'get':
                     self.sig_req_socket.send_pyobj(
                         self.step_signatures.get(*msg[2:]))
+                elif msg[1] == 'get_many':
+                    self.sig_req_socket.send_pyobj(
+                        self.step_signatures.get_many(msg[2]))
                 else:
                     env.logger.warning(f'Unknown signature request {msg}')
             else:
@@ -258,6 +244,124 @@ class Controller(threading.Thread):
                 f'Failed to respond to signature request {msg}: {e}')
             self.sig_req_socket.send_pyobj(None)
 
+    def handle_control_msg(self, msg):
+        # handle all pending signatures so that they are saved before the
+        # controller proceeds
+        self.handle_pending_sig_push_msgs()
+        if msg[0] == 'flush':
+            self.workflow_signatures.commit()
+            self.step_signatures.commit()
+        self.control_socket.send_pyobj('ok')
+        return msg[0] != 'stop'
+
+    def run(self):
+        # signature_push is used to write signatures. It is a single push operation with no reply.
+        # signature_req is used to query information. The sender would need to get an response.
+        sockets = []
+        try:
+            self.sig_push_socket = self.context.socket(zmq.PULL)
+            sockets.append(self.sig_push_socket)
+            env.config['sockets']['signature_push'] = self.sig_push_socket.bind_to_random_port(
+                'tcp://127.0.0.1')
+            self.sig_req_socket = self.context.socket(zmq.REP)
+            sockets.append(self.sig_req_socket)
+            env.config['sockets']['signature_req'] = self.sig_req_socket.bind_to_random_port(
+                'tcp://127.0.0.1')
+            self.control_socket = self.context.socket(zmq.REP)
+            sockets.append(self.control_socket)
+            self.control_socket.bind(self.control_address)
+        except Exception as e:
+            # pass the error to the controller, which is waiting for the worker
+            self.error = e
+            for socket in sockets:
+                socket.LINGER = 0
+                socket.close()
+            self.step_signatures.close()
+            self.workflow_signatures.close()
+            return
+        finally:
+            self.ready.set()
+
+        poller = zmq.Poller()
+        poller.register(self.sig_push_socket, zmq.POLLIN)
+        poller.register(self.sig_req_socket, zmq.POLLIN)
+        poller.register(self.control_socket, zmq.POLLIN)
+        try:
+            while True:
+                # wake up from time to time to commit pending signatures
+                socks = dict(poller.poll(1000))
+                if self.sig_push_socket in socks:
+                    self.handle_pending_sig_push_msgs()
+
+                if self.sig_req_socket in socks:
+                    self.handle_sig_req_msg(self.sig_req_socket.recv_pyobj())
+
+                if self.control_socket in socks:
+                    if not self.handle_control_msg(self.control_socket.recv_pyobj()):
+                        break
+
+                self.step_signatures.auto_commit()
+                self.workflow_signatures.auto_commit()
+        except Exception as e:
+            sys.stderr.write(f'{env.config["exec_mode"]} get an error {e}')
+        finally:
+            # close all databses
+            self.step_signatures.close()
+            self.workflow_signatures.close()
+
+            poller.unregister(self.sig_push_socket)
+            poller.unregister(self.sig_req_socket)
+            poller.unregister(self.control_socket)
+            self.sig_push_socket.LINGER = 0
+            self.sig_push_socket.close()
+            self.sig_req_socket.LINGER = 0
+            self.sig_req_socket.close()
+            self.control_socket.LINGER = 0
+            self.control_socket.close()
+
+
+class Controller(threading.Thread):
+    '''This controller is used by both sos and sos-notebook, and there
+    can be two controllers one as a slave (sos) and one as a master
+    (notebook). We shared the same code base because step executors need
+    need to talk to the same controller (signature, controller etc) when
+    they are executed in sos or sos notebook.
+    '''
+    LRU_READY = b"\x01"
+
+    def __init__(self, ready, kernel=None):
+        threading.Thread.__init__(self)
+        #self.daemon = True
+
+        self.ready = ready
+        self.kernel = kernel
+        # error that prevents the controller from starting
+        self.error = None
+        # number of active running master processes
+        self._nprocs = 0
+
+        self._completed = defaultdict(int)
+        self._ignored = defaultdict(int)
+
+        # completed steps
+        self._completed_steps = {}
+        # pickled contexts of concurrent substeps and number of steps using them
+        self._step_contexts = {}
+
+        # substgep workers
+        self._frontend_requests = []
+        self._substep_workers = []
+        self._n_working_workers = 0
+        self._worker_pending_time = []
+        # number of idle workers that are kept for the next substeps
+        self._min_substep_workers = 0
+        # self.event_map = {}
+        # for name in dir(zmq):
+        #     if name.startswith('EVENT_'):
+        #         value = getattr(zmq, name)
+        #          self.event_map[value] = name
+        self.console_logger = None
+
     def handle_ctl_push_msg(self, msg):
         try:
             if msg[0] == 'nprocs':
@@ -280,16 +384,10 @@ class Controller(threading.Thread):
 
     def handle_ctl_req_msg(self, msg):
         try:
-            # handle all sig_push_msg
-            while True:
-                if self.sig_push_socket.poll(0):
-                    self.handle_sig_push_msg(self.sig_push_socket.recv_pyobj())
-                else:
-                    break
-            # also handle ctrl push, which includes progress info
+            # handle ctrl push, which includes progress info
             while True:
                 if self.ctl_push_socket.poll(0):
-                    self.handle_ctl_push_msg(self.ctl_push_socket.recv_pyobj())
+                    self.handle_ctl_push_msg(recv_message(self.ctl_push_socket))
                 else:
                     break
             if msg[0] == 'nprocs':
@@ -300,6 +398,33 @@ class Controller(threading.Thread):
             elif msg[0] == 'step_output':
                 self.ctl_req_socket.send_pyobj(
                     self._completed_steps.get(msg[1], None))
+            elif msg[0] == 'step_context':
+                # register, release, or return to substep workers, variables
+                # shared by concurrent substeps of a step. Identical contexts
+                # of steps that are executed at the same time are counted so
+                # that a context is removed after it is released by all steps
+                if len(msg) > 2 and msg[2] is not None:
+                    if msg[1] in self._step_contexts:
+                        self._step_contexts[msg[1]][1] += 1
+                    else:
+                        self._step_contexts[msg[1]] = [msg[2], 1]
+                    self.ctl_req_socket.send_pyobj('ok')
+                elif len(msg) > 2:
+                    if msg[1] in self._step_contexts:
+                        self._step_contexts[msg[1]][1] -= 1
+                        if self._step_contexts[msg[1]][1] == 0:
+                            self._step_contexts.pop(msg[1])
+                    self.ctl_req_socket.send_pyobj('ok')
+                else:
+                    self.ctl_req_socket.send_pyobj(
+                        self._step_contexts.get(msg[1], [None])[0])
+            elif msg[0] == 'substep_workers':
+                # start a warm pool of substep workers so that substeps do not
+                # wait for the start of workers
+                self._min_substep_workers = min(msg[1], env.config['max_procs'])
+                while self._n_working_workers < self._min_substep_workers:
+                    self.start_substep_worker()
+                self.ctl_req_socket.send_pyobj(self._n_working_workers)
             elif msg[0] == 'named_output':
                 name = msg[1]
                 found = False
@@ -311,11 +436,13 @@ class Controller(threading.Thread):
                 if not found:
                     self.ctl_req_socket.send_pyobj(None)
             elif msg[0] == 'done':
+                # make sure that all signatures are saved
+                self.send_signature_control('flush')
                 # handle all ctl_push_msgs #1062
                 while True:
                     if self.ctl_push_socket.poll(0):
                         self.handle_ctl_push_msg(
-                            self.ctl_push_socket.recv_pyobj())
+                            recv_message(self.ctl_push_socket))
                     else:
                         break
 
@@ -367,13 +494,31 @@ class Controller(threading.Thread):
         self._frontend_requests.insert(0, msg)
 
         if self._n_working_workers == 0 or self._n_working_workers + self._nprocs < env.config['max_procs']:
-            from .workers import SoS_SubStep_Worker
-            worker = SoS_SubStep_Worker(env.config)
-            worker.start()
-            self._substep_workers.append(worker)
-            self._n_working_workers += 1
+            self.start_substep_worker()
+
+    def start_substep_worker(self):
+        # workers are forked after the sos modules needed for the execution
+        # of substeps are imported by .workers so they do not import them again
+        from .workers import SoS_SubStep_Worker
+        worker = SoS_SubStep_Worker(env.config)
+        worker.start()
+        self._substep_workers.append(worker)
+        self._n_working_workers += 1
+        env.logger.debug(
+            f'Start a substep worker, {self._n_working_workers} in total')
+
+    def kill_idle_substep_workers(self, now):
+        # kill workers that have been pending for more than 30 seconds, but
+        # keep at least min_substep_workers workers for the next substeps
+        n_kill = min(len([x for x in self._worker_pending_time if now - x >= 30]),
+                     self._n_working_workers - self._min_substep_workers)
+        if n_kill > 0:
+            for i in range(n_kill):
+                self.substep_backend_socket.send_pyobj(None)
+            self._n_working_workers -= n_kill
+            self._worker_pending_time = [now] * (len(self._worker_pending_time) - n_kill)
             env.logger.debug(
-                f'Start a substep worker, {self._n_working_workers} in total')
+                f'Kill {n_kill} substep worker. {self._n_working_workers} remains.')
 
     def handle_substep_backend_msg(self, msg):
         # Use worker address for LRU routing
@@ -421,12 +566,11 @@ class Controller(threading.Thread):
     def handle_tapping_controller_msg(self, msg):
         self.tapping_controller_socket.send(b'ok')
 
-    def run(self):
-        # there are two sockets
-        #
-        # signature_push is used to write signatures. It is a single push operation with no reply.
-        # signature_req is used to query information. The sender would need to get an response.
+    def send_signature_control(self, cmd):
+        self.sig_control_socket.send_pyobj([cmd])
+        self.sig_control_socket.recv_pyobj()
 
+    def run(self):
         self.context = zmq.Context.instance()
 
         env.logger.trace(f'controller started {os.getpid()}')
@@ -434,12 +578,20 @@ class Controller(threading.Thread):
         if 'sockets' not in env.config:
             env.config['sockets'] = {}
 
-        self.sig_push_socket = self.context.socket(zmq.PULL)
-        env.config['sockets']['signature_push'] = self.sig_push_socket.bind_to_random_port(
-            'tcp://127.0.0.1')
-        self.sig_req_socket = self.context.socket(zmq.REP)
-        env.config['sockets']['signature_req'] = self.sig_req_socket.bind_to_random_port(
-            'tcp://127.0.0.1')
+        # signatures are read and written by a separate thread, which binds
+        # the signature_push and signature_req sockets
+        sig_ready = threading.Event()
+        self.signature_worker = SignatureWorker(self.context, sig_ready)
+        self.signature_worker.start()
+        if not sig_ready.wait(60) or self.signature_worker.error is not None:
+            self.error = RuntimeError('Failed to start signature worker: ' +
+                (str(self.signature_worker.error) if sig_ready.is_set() else 'timed out'))
+            env.logger.error(str(self.error))
+            # release those who are waiting for the controller
+            self.ready.set()
+            return
+        self.sig_control_socket = self.context.socket(zmq.REQ)
+        self.sig_control_socket.connect(self.signature_worker.control_address)
 
         self.ctl_push_socket = self.context.socket(zmq.PULL)
         env.config['sockets']['controller_push'] = self.ctl_push_socket.bind_to_random_port(
@@ -481,8 +633,6 @@ class Controller(threading.Thread):
 
         # Process messages from receiver and controller
         poller = zmq.Poller()
-        poller.register(self.sig_push_socket, zmq.POLLIN)
-        poller.register(self.sig_req_socket, zmq.POLLIN)
         poller.register(self.ctl_push_socket, zmq.POLLIN)
         poller.register(self.ctl_req_socket, zmq.POLLIN)
         poller.register(self.substep_frontend_socket, zmq.POLLIN)
@@ -500,15 +650,14 @@ class Controller(threading.Thread):
 
         try:
             while True:
-                socks = dict(poller.poll())
-                if self.sig_push_socket in socks:
-                    self.handle_sig_push_msg(self.sig_push_socket.recv_pyobj())
-
-                if self.sig_req_socket in socks:
-                    self.handle_sig_req_msg(self.sig_req_socket.recv_pyobj())
-
+                # wake up from time to time to kill idle workers
+                socks = dict(poller.poll(1000))
                 if self.ctl_push_socket in socks:
-                    self.handle_ctl_push_msg(self.ctl_push_socket.recv_pyobj())
+                    # handle all pending messages before polling again
+                    while True:
+                        self.handle_ctl_push_msg(recv_message(self.ctl_push_socket))
+                        if not self.ctl_push_socket.poll(0):
+                            break
 
                 if self.ctl_req_socket in socks:
                     if not self.handle_ctl_req_msg(self.ctl_req_socket.recv_pyobj()):
@@ -543,19 +692,8 @@ class Controller(threading.Thread):
                         self.handle_tapping_controller_msg(
                             self.tapping_controller_socket.recv_pyobj())
 
-                # if the last worker has been pending for more than 5
-                # seconds, kill it
                 if self._worker_pending_time:
-                    now = time.time()
-                    kept = [x for x in self._worker_pending_time if now - x < 30]
-                    n_kill = len(self._worker_pending_time) - len(kept)
-                    if n_kill > 0:
-                        for i in range(n_kill):
-                            self.substep_backend_socket.send_pyobj(None)
-                        self._n_working_workers -= n_kill
-                        self._worker_pending_time = [now]*len(kept)
-                        env.logger.debug(
-                            f'Kill {n_kill} substep worker. {self._n_working_workers} remains.')
+                    self.kill_idle_substep_workers(time.time())
                 # if monitor_socket in socks:
                 #     evt = recv_monitor_message(monitor_socket)
                 #     if evt['event'] == zmq.EVENT_ACCEPTED:
@@ -570,12 +708,12 @@ class Controller(threading.Thread):
             for worker in self._worker_pending_time:
                 self.substep_backend_socket.send_pyobj(None)
 
-            # close all databses
-            self.step_signatures.close()
-            self.workflow_signatures.close()
+            # stop the signature worker, which closes all databases
+            self.send_signature_control('stop')
+            self.signature_worker.join()
+            self.sig_control_socket.LINGER = 0
+            self.sig_control_socket.close()
 
-            poller.unregister(self.sig_push_socket)
-            poller.unregister(self.sig_req_socket)
             poller.unregister(self.ctl_push_socket)
             poller.unregister(self.ctl_req_socket)
             poller.unregister(self.substep_frontend_socket)
@@ -586,10 +724,6 @@ class Controller(threading.Thread):
             if env.config['exec_mode'] == 'slave':
                 poller.unregister(self.tapping_controller_socket)
 
-            self.sig_push_socket.LINGER = 0
-            self.sig_push_socket.close()
-            self.sig_req_socket.LINGER = 0
-            self.sig_req_socket.close()
             self.ctl_push_socket.LINGER = 0
             self.ctl_push_socket.close()
             self.ctl_req_socket.LINGER = 0
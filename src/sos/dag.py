@@ -12,10 +12,10 @@ import networkx as nx
 
 
 from .targets import (sos_step, sos_targets, sos_variable, textMD5,
-                      BaseTarget)
+                      BaseTarget, file_target)
 from .utils import ActivityNotifier, env, short_repr
 
-from typing import Union
+from typing import Optional, Union
 #
 # DAG design:
 #
@@ -106,12 +106,29 @@ class SoS_Node(object):
             f'{self._node_id} ({self._node_index}, {self._status}): input {short_repr(self._input_targets)}, depends {short_repr(self._depends_targets)}, output {short_repr(self._output_targets)}, context {self._context}')
 
 
+def _target_key(target):
+    # file targets are equal if they point to the same file so they are
+    # indexed by absolute path
+    if isinstance(target, file_target):
+        return target.fullname()
+    return target
+
+
 class SoS_DAG(nx.DiGraph):
     def __init__(self, *args, **kwargs):
         nx.DiGraph.__init__(self, *args, **kwargs)
         # all_dependent files includes input and depends files
         self._all_dependent_files = defaultdict(list)
         self._all_output_files = defaultdict(list)
+        # nodes that depend on and produce targets, indexed by _target_key,
+        # and targets that have been added since the last build()
+        self._consumers = defaultdict(list)
+        self._producers = defaultdict(list)
+        self._updated_targets = set()
+        # targets that are depended upon but not produced by any step, in
+        # the order they are added (values are not used)
+        self._unproduced = {}
+        self._nodes_by_uuid = {x._node_uuid: x for x in self.nodes()}
         # index of mini
         self._forward_workflow_id = 0
 
@@ -125,37 +142,50 @@ class SoS_DAG(nx.DiGraph):
                  output_targets: sos_targets, context: dict={}):
         node = SoS_Node(step_uuid, node_name, None if node_index is None else self._forward_workflow_id, node_index, input_targets, depends_targets,
                         output_targets, context)
-        if node._node_uuid in [x._node_uuid for x in self.nodes()]:
+        if node._node_uuid in self._nodes_by_uuid:
             return
         # adding a step would add a sos_step target to met the depends on sos_step
         # requirement of some steps.
-        self._all_output_files[sos_step(node_name.split(' ')[0])].append(node)
+        self._add_output(sos_step(node_name.split(' ')[0]), node)
 
         for x in input_targets:
-            if node not in self._all_dependent_files[x]:
-                self._all_dependent_files[x].append(node)
+            self._add_dependent(x, node)
         for x in depends_targets:
-            if node not in self._all_dependent_files[x]:
-                self._all_dependent_files[x].append(node)
+            self._add_dependent(x, node)
         for x in output_targets:
-            if node not in self._all_output_files[x]:
-                self._all_output_files[x].append(node)
+            self._add_output(x, node)
         if context is not None:
             for x in context['__changed_vars__']:
-                if node not in self._all_output_files[sos_variable(x)]:
-                    self._all_output_files[sos_variable(x)].append(node)
+                self._add_output(sos_variable(x), node)
+        self._nodes_by_uuid[node._node_uuid] = node
         self.add_node(node)
 
     def update_step(self, node, input_targets: sos_targets, output_targets: sos_targets, depends_targets: sos_targets):
         for x in input_targets:
-            if node not in self._all_dependent_files[x]:
-                self._all_dependent_files[x].append(node)
+            self._add_dependent(x, node)
         for x in depends_targets:
-            if node not in self._all_dependent_files[x]:
-                self._all_dependent_files[x].append(node)
+            self._add_dependent(x, node)
         for x in output_targets:
-            if node not in self._all_output_files[x]:
-                self._all_output_files[x].append(node)
+            self._add_output(x, node)
+
+    def _add_dependent(self, target, node):
+        nodes = self._all_dependent_files[target]
+        if node not in nodes:
+            nodes.append(node)
+            if target not in self._all_output_files:
+                self._unproduced[target] = None
+            key = _target_key(target)
+            self._consumers[key].append(node)
+            self._updated_targets.add(key)
+
+    def _add_output(self, target, node):
+        nodes = self._all_output_files[target]
+        if node not in nodes:
+            nodes.append(node)
+            self._unproduced.pop(target, None)
+            key = _target_key(target)
+            self._producers[key].append(node)
+            self._updated_targets.add(key)
 
     def find_executable(self):
         '''Find an executable node, which means nodes that has not been completed
@@ -194,9 +224,8 @@ class SoS_DAG(nx.DiGraph):
         return None
 
     def node_by_id(self, node_uuid):
-        for node in self.nodes():
-            if node._node_uuid == node_uuid:
-                return node
+        if node_uuid in self._nodes_by_uuid:
+            return self._nodes_by_uuid[node_uuid]
         raise RuntimeError(f'Failed to locate node with UUID {node_uuid}')
 
     def show_nodes(self):
@@ -221,20 +250,22 @@ class SoS_DAG(nx.DiGraph):
     def pending(self):
         return [x for x in self.nodes() if x._status == 'failed'], [x for x in self.nodes() if x._status is None]
 
-    def dangling(self, targets: sos_targets):
+    def dangling(self, targets: sos_targets, exists: Optional[dict]=None):
+        '''Return targets that are depended upon by steps or are specified in
+        targets, but are not produced by any step, as lists of missing and
+        existing targets. Results of target_exists() are cached in exists so
+        that they can be reused within the same pass of target resolution.'''
+        if exists is None:
+            exists = {}
         missing = []
         existing = []
-        for x in self._all_dependent_files.keys():
-            if x.target_exists():
-                if x not in self._all_output_files:
-                    existing.append(x)
-            elif x not in self._all_output_files:
-                missing.append(x)
-        for x in targets:
-            if x.target_exists():
-                if x not in self._all_output_files:
-                    existing.append(x)
-            elif x not in self._all_output_files:
+        for x in list(self._unproduced) + [x for x in targets if x not in
+                                           self._all_output_files and x not in self._unproduced]:
+            if x not in exists:
+                exists[x] = x.target_exists()
+            if exists[x]:
+                existing.append(x)
+            else:
                 missing.append(x)
         return missing, existing
 
@@ -271,14 +302,12 @@ class SoS_DAG(nx.DiGraph):
         # right now we do not worry about status of nodes
         # connecting the output to the input of other nodes
         #
-        # NOTE: This is implemented in the least efficient way just for
-        # testing. It has to be re-implemented.
-        #
-        # refer to http://stackoverflow.com/questions/33494376/networkx-add-edges-to-graph-from-node-attributes
-        #
         # several cases triggers dependency.
+        workflows = defaultdict(list)
+        for node in self.nodes():
+            workflows[node._wf_index].append(node)
         for wf in range(self._forward_workflow_id + 1):
-            indexed = [x for x in self.nodes() if x._wf_index == wf]
+            indexed = workflows[wf]
             indexed.sort(key=lambda x: x._node_index)
 
             for idx, node in enumerate(indexed):
@@ -306,13 +335,17 @@ class SoS_DAG(nx.DiGraph):
                     else:
                         self.add_edge(indexed[idx - 1], node)
         #
-        # 3. if the input of a step depends on the output of another step
-        for target, in_node in self._all_dependent_files.items():
-            for out_node in [y for (x, y) in self._all_output_files.items() if x == target]:
-                for i in in_node:
-                    for j in out_node:
-                        if j != i:
-                            self.add_edge(j, i)
+        # 3. if the input of a step depends on the output of another step.
+        # Only targets that have been added since the last build can add
+        # new edges.
+        for key in self._updated_targets:
+            if key not in self._consumers or key not in self._producers:
+                continue
+            for i in self._consumers[key]:
+                for j in self._producers[key]:
+                    if j != i:
+                        self.add_edge(j, i)
+        self._updated_targets = set()
 
     def save(self, dest=None):
         if not dest:
@@ -2,8 +2,10 @@
 #
 # Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
 # Distributed under the terms of the 3-clause BSD License.
+import concurrent.futures
 import copy
 import glob
+import hashlib
 import multiprocessing as mp
 import os
 import shutil
@@ -11,7 +13,11 @@ import socket
 import stat
 import subprocess
 import sys
-from collections import Sequence
+import tarfile
+import tempfile
+import threading
+import time
+from collections import Sequence, defaultdict
 
 import pexpect
 import pkg_resources
@@ -21,7 +27,7 @@ from .syntax import SOS_LOGLINE
 from .targets import path, sos_targets
 from .task_engines import BackgroundProcess_TaskEngine
 from .tasks import TaskFile
-from .utils import (env, expand_size, expand_time,
+from .utils import (env, expand_size, expand_time, pretty_size,
                     format_HHMMSS, short_repr)
 
 #
@@ -42,6 +48,12 @@ from .utils import (env, expand_size, expand_time,
 #   * send_cmd (optional): alternative command to send files
 #   * receive_cmd (optional): alternative command to receive files
 #   * execute_cmd (optional): alternative command to execute commands
+#   * control_persist (optional): time for which a shared ssh connection to
+#     the remote host stays open after its last use (default to 10m), or 0
+#     to use a new connection for each command. Custom commands can use
+#     {ssh_opts} to share the connection.
+#   * transfer_workers (optional): number of concurrent commands to transfer
+#     files to and from the remote host (default to 4).
 #
 # 2. task properties, namely how to manage running jobs. These include
 #   direct execution, PBS and various cluster systems, and various task
@@ -252,6 +264,9 @@ class LocalHost:
             return {'ret_code': 1, 'output': {}, 'exception': e}
         return res
 
+    def receive_results(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {task_id: self.receive_result(task_id) for task_id in task_ids}
+
 
 class RemoteHost:
     '''A remote host class that manages how to communicate with remote host'''
@@ -265,6 +280,17 @@ class RemoteHost:
         self.shared_dirs = self._get_shared_dirs()
         self.path_map = self._get_path_map()
         self.execute_cmd = self._get_execute_cmd()
+        # all ssh, scp and rsync commands share a master connection that is
+        # kept alive by ssh for control_persist seconds after its last use
+        self.control_persist = self.config.get('control_persist', '10m')
+        self.control_path = os.path.join(os.path.expanduser('~'), '.sos', 'ssh',
+            hashlib.md5(f'{self.address}:{self.port}'.encode()).hexdigest()[:16])
+        self._last_control_check = 0
+        self._control_master = True
+        # tasks are submitted from multiple threads so the connection is
+        # checked by one thread at a time
+        self._control_lock = threading.Lock()
+        self.transfer_workers = self.config.get('transfer_workers', 4)
 
     def _get_shared_dirs(self) -> List[Any]:
         value = self.config.get('shared', [])
@@ -304,26 +330,71 @@ class RemoteHost:
 
     def _get_send_cmd(self, rename=False):
         if rename:
-            return '''ssh -q {host} -p {port} "mkdir -p {dest:dpq}" && ''' + \
-                '''rsync -a --no-g -e 'ssh -p {port}' {source:aep} "{host}:{dest:dep}" && ''' + \
-                '''ssh -q {host} -p {port} "mv {dest:dep}/{source:b} {dest:ep}" '''
+            return '''ssh {ssh_opts} -q {host} -p {port} "mkdir -p {dest:dpq}" && ''' + \
+                '''rsync -a --no-g -e 'ssh {ssh_opts} -p {port}' {source:aep} "{host}:{dest:dep}" && ''' + \
+                '''ssh {ssh_opts} -q {host} -p {port} "mv {dest:dep}/{source:b} {dest:ep}" '''
         else:
-            return '''ssh -q {host} -p {port} "mkdir -p {dest:dpq}" && rsync -a --no-g -e 'ssh -p {port}' {source:aep} "{host}:{dest:dep}"'''
+            return '''ssh {ssh_opts} -q {host} -p {port} "mkdir -p {dest:dpq}" && rsync -a --no-g -e 'ssh {ssh_opts} -p {port}' {source:aep} "{host}:{dest:dep}"'''
 
     def _get_receive_cmd(self, rename=False):
         if rename:
-            return '''rsync -a --no-g -e 'ssh -p {port}' {host}:{source:e} "{dest:adep}" && ''' + \
+            return '''rsync -a --no-g -e 'ssh {ssh_opts} -p {port}' {host}:{source:e} "{dest:adep}" && ''' + \
                 '''mv "{dest:adep}/{source:b}" "{dest:aep}"'''
         else:
-            return '''rsync -a --no-g -e 'ssh -p {port}' {host}:{source:e} "{dest:adep}"'''
+            return '''rsync -a --no-g -e 'ssh {ssh_opts} -p {port}' {host}:{source:e} "{dest:adep}"'''
+
+    def _get_batch_send_cmd(self):
+        return '''rsync -a -r --no-g -e 'ssh {ssh_opts} -p {port}' --files-from={files_from:ap} {source:adep} "{host}:{dest:dep}"'''
+
+    def _get_batch_receive_cmd(self):
+        return '''rsync -a -r --no-g -e 'ssh {ssh_opts} -p {port}' --files-from={files_from:ap} {host}:{source:dep} "{dest:adep}"'''
 
     def _get_execute_cmd(self) -> str:
         return self.config.get('execute_cmd',
-                               '''ssh -q {host} -p {port} "bash --login -c '[ -d {cur_dir} ] || mkdir -p {cur_dir}; cd {cur_dir} && {cmd}'" ''')
+                               '''ssh {ssh_opts} -q {host} -p {port} "bash --login -c '[ -d {cur_dir} ] || mkdir -p {cur_dir}; cd {cur_dir} && {cmd}'" ''')
 
     def _get_query_cmd(self):
         return self.config.get('query_cmd',
-                               '''ssh -q {host} -p {port} "bash --login -c 'sos status {task} -v 0'" ''')
+                               '''ssh {ssh_opts} -q {host} -p {port} "bash --login -c 'sos status {task} -v 0'" ''')
+
+    def _get_ssh_opts(self) -> str:
+        '''Options for ssh (also used by scp and rsync) to share a master
+        connection to the remote host. The master connection is checked at
+        most once a minute and is replaced if it is no longer usable. Plain
+        ssh options are used if the connection cannot be shared.'''
+        if not self.control_persist or sys.platform == 'win32':
+            return ''
+        with self._control_lock:
+            if time.time() - self._last_control_check > 60:
+                self._control_master = self._check_control_master()
+            control_master = self._control_master
+        if not control_master:
+            return ''
+        return f'-o ControlMaster=auto -o ControlPath={self.control_path} ' \
+            f'-o ControlPersist={int(expand_time(self.control_persist))}'
+
+    def _check_control_master(self) -> bool:
+        # return False if the connection cannot be shared, for example if
+        # ssh is not available or ~/.sos/ssh cannot be created
+        self._last_control_check = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.control_path), exist_ok=True)
+            if not os.path.exists(self.control_path):
+                return True
+            # a socket left by a master connection that was killed or lost
+            # would disable connection sharing so we remove it.
+            if subprocess.call(['ssh', '-O', 'check', '-o', f'ControlPath={self.control_path}',
+                    '-p', str(self.port), self.address],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0:
+                env.logger.debug(f'Removing stale ssh control socket {self.control_path} for {self.alias}')
+                try:
+                    os.remove(self.control_path)
+                except OSError as e:
+                    env.logger.debug(f'Failed to remove {self.control_path}: {e}')
+        except OSError as e:
+            env.logger.debug(f'Not sharing ssh connection to {self.alias}: {e}')
+            return False
+        return True
 
     def is_shared(self, path):
         fullpath = os.path.abspath(os.path.expanduser(path))
@@ -437,6 +508,10 @@ class RemoteHost:
             sending = items
 
         sent = {}
+        # files that are not renamed are grouped by source and destination
+        # directories and are sent by a single rsync command for each group
+        groups = defaultdict(list)
+        renamed = []
         for source in sorted(sending.keys()):
             dest = sending[source]
             if self.is_shared(source):
@@ -445,17 +520,73 @@ class RemoteHost:
             else:
                 env.logger.debug(
                     f'Sending ``{source}`` to {self.alias}:{dest}')
-                cmd = cfg_interpolate(self._get_send_cmd(rename=os.path.basename(source) != os.path.basename(dest)),
-                                      {'source': sos_targets(str(source).rstrip('/')), 'dest': sos_targets(dest), 'host': self.address, 'port': self.port})
-                env.logger.debug(cmd)
-                ret = subprocess.call(
-                    cmd, shell=True, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                if (ret != 0):
-                    raise RuntimeError(
-                        f'Failed to copy {source} to {self.alias} using command "{cmd}". The remote host might be unavailable.')
+                if os.path.basename(source) != os.path.basename(dest):
+                    renamed.append(source)
+                else:
+                    groups[(os.path.dirname(os.path.abspath(str(source).rstrip('/'))),
+                            os.path.dirname(dest))].append(source)
             sent[source] = dest
+        if not groups and not renamed:
+            return sent
+
+        start_time = time.time()
+        ssh_opts = self._get_ssh_opts()
+        cmds = [cfg_interpolate(self._get_send_cmd(rename=True),
+                                {'source': sos_targets(str(source).rstrip('/')), 'dest': sos_targets(sending[source]),
+                                 'host': self.address, 'port': self.port, 'ssh_opts': ssh_opts})
+                for source in renamed]
+        if groups:
+            # create all destination directories with one command
+            mkdir_cmd = cfg_interpolate('''ssh {ssh_opts} -q {host} -p {port} "mkdir -p {dest:dpq}"''',
+                                        {'dest': sos_targets([sending[x[0]] for x in groups.values()]),
+                                         'host': self.address, 'port': self.port, 'ssh_opts': ssh_opts})
+            if self._run_transfer_cmds([mkdir_cmd]):
+                raise RuntimeError(
+                    f'Failed to create destination directories on {self.alias} using command "{mkdir_cmd}". The remote host might be unavailable.')
+        with tempfile.TemporaryDirectory() as list_dir:
+            for idx, sources in enumerate(groups.values()):
+                files_from = os.path.join(list_dir, f'{idx}.lst')
+                with open(files_from, 'w') as lst:
+                    lst.write(''.join(os.path.basename(str(x).rstrip('/')) + '\n' for x in sources))
+                cmds.append(cfg_interpolate(self._get_batch_send_cmd(),
+                                            {'source': sos_targets(str(sources[0]).rstrip('/')), 'dest': sos_targets(sending[sources[0]]),
+                                             'files_from': sos_targets(files_from),
+                                             'host': self.address, 'port': self.port, 'ssh_opts': ssh_opts}))
+            failed = self._run_transfer_cmds(cmds)
+        if failed:
+            raise RuntimeError(
+                f'Failed to copy files to {self.alias} using command "{failed[0]}". The remote host might be unavailable.')
+        self._log_transfer('Sent', renamed + sum(groups.values(), []), time.time() - start_time)
         return sent
 
+    def _run_transfer_cmds(self, cmds):
+        '''Run commands with at most transfer_workers commands at a time and
+        return commands that failed'''
+        def run_cmd(cmd):
+            env.logger.debug(cmd)
+            return subprocess.call(
+                cmd, shell=True, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.transfer_workers)) as executor:
+            return [cmd for cmd, ret in zip(cmds, executor.map(run_cmd, cmds)) if ret != 0]
+
+    def _log_transfer(self, action, files, elapsed):
+        # report size and speed of transfer of local files
+        if env.verbosity <= 2:
+            return
+        size = 0
+        for item in files:
+            item = os.path.expanduser(str(item))
+            if os.path.isfile(item):
+                size += os.path.getsize(item)
+            else:
+                for root, _, names in os.walk(item):
+                    size += sum(os.path.getsize(os.path.join(root, x)) for x in names
+                        if os.path.isfile(os.path.join(root, x)))
+        env.logger.debug(
+            f'{action} {len(files)} item{"s" if len(files) > 1 else ""} ({pretty_size(size)}) '
+            f'{"to" if action == "Sent" else "from"} {self.alias} in {elapsed:.1f} seconds '
+            f'({pretty_size(size / elapsed if elapsed > 0 else size)}/s)')
+
     def receive_from_host(self, items):
         if isinstance(items, dict):
             # specify as local:remote
@@ -466,12 +597,16 @@ class RemoteHost:
             receiving = {y: str(x) for x, y in self._map_path(items).items()}
         #
         received = {}
+        # files that are not renamed are grouped by source and destination
+        # directories and are received by a single rsync command for each group
+        groups = defaultdict(list)
+        renamed = []
         for source in sorted(receiving.keys()):
             dest = receiving[source]
             dest_dir = os.path.dirname(dest)
             if dest_dir and not os.path.isdir(dest_dir):
                 try:
-                    os.path.makedirs(dest_dir)
+                    os.makedirs(dest_dir)
                 except Exception as e:
                     env.logger.error(
                         f'Failed to create destination directory {dest_dir}: {e}')
@@ -479,19 +614,37 @@ class RemoteHost:
                 env.logger.debug(
                     f'Skip retrieving ``{dest}`` from shared file system')
                 received[dest] = source
+            elif os.path.basename(source) != os.path.basename(dest):
+                renamed.append(source)
             else:
-                cmd = cfg_interpolate(self._get_receive_cmd(rename=os.path.basename(source) != os.path.basename(dest)),
-                                      {'source': sos_targets(str(source).rstrip('/')), 'dest': sos_targets(dest), 'host': self.address, 'port': self.port})
-                env.logger.debug(cmd)
-                try:
-                    ret = subprocess.call(
-                        cmd, shell=True, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-                    if (ret != 0):
-                        raise RuntimeError(f'command return {ret}')
-                    received[dest] = source
-                except Exception as e:
-                    raise RuntimeError(
-                        f'Failed to copy {source} from {self.alias} using command "{cmd}": {e}')
+                groups[(os.path.dirname(str(source).rstrip('/')),
+                        os.path.dirname(os.path.abspath(dest)))].append(source)
+        if not groups and not renamed:
+            return received
+
+        start_time = time.time()
+        ssh_opts = self._get_ssh_opts()
+        cmds = [cfg_interpolate(self._get_receive_cmd(rename=True),
+                                {'source': sos_targets(str(source).rstrip('/')), 'dest': sos_targets(receiving[source]),
+                                 'host': self.address, 'port': self.port, 'ssh_opts': ssh_opts})
+                for source in renamed]
+        with tempfile.TemporaryDirectory() as list_dir:
+            for idx, sources in enumerate(groups.values()):
+                files_from = os.path.join(list_dir, f'{idx}.lst')
+                with open(files_from, 'w') as lst:
+                    lst.write(''.join(os.path.basename(str(x).rstrip('/')) + '\n' for x in sources))
+                cmds.append(cfg_interpolate(self._get_batch_receive_cmd(),
+                                            {'source': sos_targets(str(sources[0]).rstrip('/')), 'dest': sos_targets(receiving[sources[0]]),
+                                             'files_from': sos_targets(files_from),
+                                             'host': self.address, 'port': self.port, 'ssh_opts': ssh_opts}))
+            failed = self._run_transfer_cmds(cmds)
+        if failed:
+            raise RuntimeError(
+                f'Failed to copy files from {self.alias} using command "{failed[0]}"')
+        transferred = renamed + sum(groups.values(), [])
+        received.update({receiving[x]: x for x in transferred})
+        self._log_transfer('Received', [receiving[x] for x in transferred],
+            time.time() - start_time)
         return received
 
     #
@@ -609,9 +762,10 @@ class RemoteHost:
         self.send_task_file(task_file)
 
     def send_task_file(self, task_file):
-        send_cmd = cfg_interpolate('ssh -q {address} -p {port} "[ -d ~/.sos/tasks ] || mkdir -p ~/.sos/tasks" && ' +
-                                   'rsync --ignore-existing -a --no-g -e "ssh -p {port}" {job_file:ap} {address}:.sos/tasks/',
-                                   {'job_file': sos_targets(task_file), 'address': self.address, 'port': self.port})
+        send_cmd = cfg_interpolate('ssh {ssh_opts} -q {address} -p {port} "[ -d ~/.sos/tasks ] || mkdir -p ~/.sos/tasks" && ' +
+                                   'rsync --ignore-existing -a --no-g -e "ssh {ssh_opts} -p {port}" {job_file:ap} {address}:.sos/tasks/',
+                                   {'job_file': sos_targets(task_file), 'address': self.address, 'port': self.port,
+                                    'ssh_opts': self._get_ssh_opts()})
         # use scp for this simple case
         try:
             subprocess.check_call(send_cmd, shell=True)
@@ -624,7 +778,7 @@ class RemoteHost:
             cmd = subprocess.list2cmdline(cmd)
         try:
             cmd = cfg_interpolate(self.execute_cmd, {
-                'host': self.address, 'port': self.port,
+                'host': self.address, 'port': self.port, 'ssh_opts': self._get_ssh_opts(),
                 'cmd': cmd, 'cur_dir': self._map_var(os.getcwd())})
         except Exception as e:
             raise ValueError(
@@ -641,7 +795,7 @@ class RemoteHost:
             cmd = subprocess.list2cmdline(cmd)
         try:
             cmd = cfg_interpolate(self.execute_cmd, {
-                'host': self.address, 'port': self.port,
+                'host': self.address, 'port': self.port, 'ssh_opts': self._get_ssh_opts(),
                 'cmd': cmd, 'cur_dir': self._map_var(os.getcwd())})
         except Exception as e:
             raise ValueError(f'Failed to run command {cmd}: {e}')
@@ -657,7 +811,7 @@ class RemoteHost:
             cmd = subprocess.list2cmdline(cmd)
         try:
             cmd = cfg_interpolate(self.execute_cmd, {
-                'host': self.address, 'port': self.port,
+                'host': self.address, 'port': self.port, 'ssh_opts': self._get_ssh_opts(),
                 'cmd': cmd, 'cur_dir': self._map_var(os.getcwd())})
         except Exception as e:
             raise ValueError(f'Failed to run command {cmd}: {e}')
@@ -673,19 +827,22 @@ class RemoteHost:
             p.start()
             p.join()
 
-    def receive_result(self, task_id: str) -> Dict[str, int]:
-        # for filetype in ('res', 'status', 'out', 'err'):
-        sys_task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
-        # use -p to preserve modification times so that we can keep the job status locally.
-        receive_cmd = cfg_interpolate("scp -P {port} -p -q {address}:.sos/tasks/{task}.* {sys_task_dir}",
-                                      {'port': self.port, 'address': self.address, 'task': task_id, 'sys_task_dir': sys_task_dir})
+    def _remove_local_task_files(self, task_ids: List[str]) -> None:
         # it is possible that local files are readonly (e.g. a pluse file) so we first need to
         # make sure the files are readable and remove them. Also, we do not want any file that is
         # obsolete to appear as new after copying
-        for lfile in glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.*')):
-            if not os.access(lfile, os.W_OK):
-                os.chmod(lfile, stat.S_IREAD | stat.S_IWRITE)
-            os.remove(lfile)
+        for task_id in task_ids:
+            for lfile in glob.glob(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.*')):
+                if not os.access(lfile, os.W_OK):
+                    os.chmod(lfile, stat.S_IREAD | stat.S_IWRITE)
+                os.remove(lfile)
+
+    def _receive_task_files(self, task_id: str) -> None:
+        sys_task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        # use -p to preserve modification times so that we can keep the job status locally.
+        receive_cmd = cfg_interpolate("scp {ssh_opts} -P {port} -p -q {address}:.sos/tasks/{task}.* {sys_task_dir}",
+                                      {'port': self.port, 'address': self.address, 'task': task_id, 'sys_task_dir': sys_task_dir,
+                                       'ssh_opts': self._get_ssh_opts()})
         env.logger.debug(receive_cmd)
         ret = subprocess.call(receive_cmd, shell=True,
                               stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
@@ -696,32 +853,94 @@ class RemoteHost:
                 raise RuntimeError('Failed to retrieve result of job {} from {} with cmd\n{}'.format(
                     task_id, self.alias, receive_cmd))
 
-        tf = TaskFile(task_id)
-        params = tf.params
-        res = tf.result
-
-        if not res:
+    def _receive_task_archive(self, task_ids: List[str]) -> List[str]:
+        '''Retrieve task files of multiple tasks in a single tar stream and
+        return the tasks for which files have been received. Files are
+        extracted to a temporary directory and moved to ~/.sos/tasks so that
+        no partially transferred task file is visible to other processes.'''
+        sys_task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        remote_cmd = 'cd .sos/tasks && ls -d {} 2>/dev/null | tar cf - -T -'.format(
+            ' '.join(f'{x}.*' for x in task_ids))
+        cmd = ['ssh'] + self._get_ssh_opts().split() + \
+            ['-q', self.address, '-p', str(self.port), remote_cmd]
+        env.logger.debug(subprocess.list2cmdline(cmd))
+        received = set()
+        tmp_dir = tempfile.mkdtemp(dir=sys_task_dir, prefix='.receiving_')
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                with tarfile.open(fileobj=proc.stdout, mode='r|') as archive:
+                    for member in archive:
+                        # accept only plain task files of requested tasks
+                        task_id = member.name.split('.', 1)[0]
+                        if not member.isfile() or os.path.basename(member.name) != member.name \
+                                or task_id not in task_ids:
+                            continue
+                        archive.extract(member, tmp_dir)
+                        received.add(task_id)
+            finally:
+                proc.stdout.close()
+                proc.wait()
+            for filename in os.listdir(tmp_dir):
+                os.replace(os.path.join(tmp_dir, filename),
+                           os.path.join(sys_task_dir, filename))
+        except Exception as e:
             env.logger.debug(
-                f'Result for {task_id} is not received (no result)')
-            return {'ret_code': 1, 'output': {}}
+                f'Failed to retrieve task files from {self.alias} in bulk: {e}')
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return [x for x in task_ids if x in received]
 
-        if ('ret_code' in res and res['ret_code'] != 0) or ('succ' in res and res['succ'] != 0):
-            _show_err_and_out(task_id, res)
-            env.logger.info(f'Ignore remote results for failed job {task_id}')
-        else:
+    def receive_result(self, task_id: str) -> Dict[str, int]:
+        return self.receive_results([task_id])[task_id]
+
+    def receive_results(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        '''Retrieve results of completed tasks. Task files are transferred in
+        chunks of tar streams (one scp per task is used as a fallback), and
+        output files of all successful tasks are received together.'''
+        self._remove_local_task_files(task_ids)
+        received_tasks = []
+        if len(task_ids) > 1:
+            for idx in range(0, len(task_ids), 500):
+                received_tasks.extend(
+                    self._receive_task_archive(task_ids[idx:idx + 500]))
+        for task_id in task_ids:
+            if task_id not in received_tasks:
+                self._receive_task_files(task_id)
+
+        results = {}
+        # files to be received, and files expected from each task
+        to_receive = []
+        from_host = {}
+        task_files = {}
+        for task_id in task_ids:
+            tf = TaskFile(task_id)
+            res = tf.result
+            results[task_id] = res
+
+            if not res:
+                env.logger.debug(
+                    f'Result for {task_id} is not received (no result)')
+                results[task_id] = {'ret_code': 1, 'output': {}}
+                continue
+
+            if ('ret_code' in res and res['ret_code'] != 0) or ('succ' in res and res['succ'] != 0):
+                _show_err_and_out(task_id, res)
+                env.logger.info(f'Ignore remote results for failed job {task_id}')
+                continue
             if env.verbosity >= 3:
                 _show_err_and_out(task_id, res)
+            if env.config['run_mode'] == 'dryrun':
+                continue
             # do we need to copy files? We need to consult original task file
-            # not the converted one
-            job_dict = params.sos_dict
-
-            if job_dict['_output'] and not isinstance(job_dict['_output'], Undetermined) and env.config['run_mode'] != 'dryrun':
-                received = self.receive_from_host(
-                    [x for x in job_dict['_output'] if isinstance(x, (str, path))])
-                if received:
-                    env.logger.info(
-                        f'{task_id} ``received`` {short_repr(list(received.keys()))}')
-            if 'from_host' in job_dict['_runtime'] and env.config['run_mode'] != 'dryrun':
+            # not the converted one, which is only loaded for successful tasks
+            job_dict = tf.params.sos_dict
+            files = []
+            if job_dict['_output'] and not isinstance(job_dict['_output'], Undetermined):
+                files.extend(x for x in job_dict['_output']
+                             if isinstance(x, (str, path)))
+                to_receive.extend(files)
+            if 'from_host' in job_dict['_runtime']:
                 if isinstance(job_dict['_runtime']['from_host'], dict):
                     fh = {}
                     for x, y in job_dict['_runtime']['from_host'].items():
@@ -733,14 +952,26 @@ class RemoteHost:
                         else:
                             fh[x] = self._map_var(
                                 job_dict['_runtime']['cur_dir']) + '/' + y
-                    received = self.receive_from_host(fh)
+                    from_host.update(fh)
+                    files.extend(fh.keys())
                 else:
-                    received = self.receive_from_host(
-                        job_dict['_runtime']['from_host'])
-                if received:
-                    env.logger.info(
-                        f'{task_id} ``received`` {short_repr(list(received.keys()))}')
-        return res
+                    fh = job_dict['_runtime']['from_host']
+                    fh = [fh] if isinstance(fh, (str, path)) else list(fh)
+                    to_receive.extend(fh)
+                    files.extend(fh)
+            task_files[task_id] = [str(x) for x in files]
+
+        received = {}
+        if to_receive:
+            received.update(self.receive_from_host(to_receive))
+        if from_host:
+            received.update(self.receive_from_host(from_host))
+        for task_id, files in task_files.items():
+            task_received = [x for x in files if x in received]
+            if task_received:
+                env.logger.info(
+                    f'{task_id} ``received`` {short_repr(task_received)}')
+        return results
 
 
 #
@@ -761,6 +992,8 @@ class Host:
     @classmethod
     def reset(cls) -> None:
         for host in cls.host_instances.values():
+            if host._task_engine is not None:
+                host._task_engine.stop()
             del host._task_engine
         cls.host_instances = {}
 
@@ -967,7 +1200,7 @@ class Host:
         return [self._task_engine.check_task_status(task) for task in tasks]
 
     def retrieve_results(self, tasks: List[str]) -> Dict[str, Union[Dict[str, Union[int, str, Dict[int, Dict[Any, Any]], float]], Dict[str, int], Dict[str, Union[int, str, Dict[file_target, str], Dict[int, Dict[Any, Any]], float]], Dict[str, Union[int, str, Dict[int, Dict[str, int]], float]]]]:
-        return {task: self._host_agent.receive_result(task) for task in tasks}
+        return self._host_agent.receive_results(tasks)
 
 
 def list_queues(cfg, hosts=[], verbosity=1):
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+'''Wire protocol of messages pushed to the controller.
+
+A message is usually a list of values that starts with tags such as
+['progress', 'substep_completed', step_id] or ['workflow', 'task', id, info].
+The tags are sent as text in a header frame that starts with the type of the
+message and the number of tags, so that messages that consist of tags only,
+such as progress updates, are decoded without unpickling, and a message can
+be routed by its tags without decoding the rest of it. Messages with other
+values, such as signatures, are pickled into a payload frame, which is sent
+and received without copying if it is large.
+
+The protocol is only used by the controller_push and signature_push sockets,
+which are read by the controller only, and from which the controller also
+accepts messages sent by send_pyobj. Requests and replies on the req sockets
+of the controller, and messages to and from substep workers, are sent with
+send_pyobj and recv_pyobj so that they can be read by task engines and
+executors of other modules.
+'''
+import pickle
+
+import zmq
+
+# first byte of the header frame, which tells if the message consists of
+# tags only, and if the payload frame is large enough to be sent and received
+# without copying
+_TAGS = b'T'
+_LIST = b'L'
+_LARGE_LIST = b'l'
+_VALUE = b'V'
+_LARGE_VALUE = b'v'
+LARGE_PAYLOAD_SIZE = 64 * 1024
+# separator of tags in the header frame
+_SEP = '\x1f'
+
+
+def encode_msg(msg):
+    '''Encode a message to a list of frames'''
+    if type(msg) is not list:
+        payload = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        return [_LARGE_VALUE if len(payload) >= LARGE_PAYLOAD_SIZE else _VALUE, payload]
+    # leading string values are sent as tags in the header frame
+    n = 0
+    for value in msg:
+        if type(value) is not str or _SEP in value or n == 255:
+            break
+        n += 1
+    if n == len(msg):
+        return [_TAGS + bytes((n,)) + _SEP.join(msg).encode()]
+    payload = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+    return [(_LARGE_LIST if len(payload) >= LARGE_PAYLOAD_SIZE else _LIST) + bytes((n,)) +
+            _SEP.join(msg[:n]).encode(), payload]
+
+
+def decode_tags(header):
+    '''Return tags of a message from its header frame, so that a message
+    can be routed without decoding its payload.'''
+    return header[2:].decode().split(_SEP) if header[1] else []
+
+
+def decode_msg(frames):
+    '''Decode a message from a list of frames, the second of which can be a
+    memoryview of a frame that is received without copying.'''
+    if frames[0][:1] == _TAGS:
+        return decode_tags(frames[0])
+    return pickle.loads(frames[1])
+
+
+def send_message(socket, msg):
+    '''Send a message through a zmq socket'''
+    frames = encode_msg(msg)
+    if len(frames) == 1:
+        socket.send(frames[0])
+    else:
+        socket.send(frames[0], zmq.SNDMORE)
+        socket.send(frames[1], copy=len(frames[1]) < LARGE_PAYLOAD_SIZE)
+
+
+def recv_message(socket):
+    '''Receive a message sent by send_message, or a single-frame message sent
+    by send_pyobj (e.g. by previous versions of sos), from a zmq socket'''
+    header = socket.recv()
+    code = header[:1]
+    if not socket.getsockopt(zmq.RCVMORE):
+        if code == _TAGS:
+            return decode_msg([header])
+        return pickle.loads(header)
+    if code == _LIST or code == _VALUE:
+        return decode_msg([header, socket.recv()])
+    return decode_msg([header, socket.recv(copy=False).buffer])
@@ -3,50 +3,429 @@
 # Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
 # Distributed under the terms of the 3-clause BSD License.
 
+import ast
+import json
 import os
 import pickle
 import lzma
 import sqlite3
+import threading
+import time
+import zlib
 
 from .utils import env
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#
+# Encoding of step signatures. Signatures used to be saved as
+# lzma.compress(pickle.dumps(signature)), which are recognized by the magic
+# number of lzma. New signatures are saved as a format byte followed by the
+# signature compressed with zlib (level 1) or zstd. Signatures with the
+# standard keys are saved in a compact schema (format 3 and 4) with paths of
+# file targets, signatures of targets, labels and groups of input, output and
+# dependent targets, and other signatures are pickled as they are (format 1
+# and 2).
+#
+_LZMA_MAGIC = b'\xfd7zXZ'
+_FORMAT_ZLIB = b'\x01'
+_FORMAT_ZSTD = b'\x02'
+_FORMAT_COMPACT_ZLIB = b'\x03'
+_FORMAT_COMPACT_ZSTD = b'\x04'
+
+_SIGNATURE_KEYS = {'input', 'input_obj', 'output', 'output_obj', 'depends',
+    'depends_obj', 'init_context_sig', 'end_context'}
+
+
+def _pack_targets(obj, sig: dict):
+    # file targets are saved as paths (with properties if any) and their
+    # signatures as a list in the order of targets. Labels are saved once if
+    # all targets have the same label, and labels of groups are saved only if
+    # they differ from labels of the targets.
+    from .targets import file_target
+    if list(sig.keys()) == [str(x) for x in obj._targets]:
+        sig = list(sig.values())
+    targets = [(str(x) if not x._dict else (str(x), x._dict))
+        if type(x) is file_target else x for x in obj._targets]
+    labels = obj._labels
+    if labels and labels.count(labels[0]) == len(labels):
+        labels = labels[0]
+    groups = [(g._indexes, None if g._labels == [obj._labels[i] for i in g._indexes]
+        else g._labels, g._dict) for g in obj._groups]
+    return (targets, sig, labels, obj._undetermined, groups, obj._dict)
+
+
+def _unpack_targets(packed):
+    from .targets import file_target, sos_targets, _sos_group
+    targets, sig, labels, undetermined, groups, properties = packed
+    obj = sos_targets()
+    names = []
+    for x in targets:
+        if isinstance(x, str):
+            obj._targets.append(file_target(x))
+            names.append(x)
+        elif isinstance(x, tuple):
+            obj._targets.append(file_target(x[0]))
+            obj._targets[-1]._dict = x[1]
+            names.append(x[0])
+        else:
+            obj._targets.append(x)
+            names.append(str(x))
+    obj._labels = [labels] * len(targets) if isinstance(labels, str) else labels
+    obj._undetermined = undetermined
+    for indexes, glabels, gdict in groups:
+        grp = _sos_group(indexes, labels=glabels, parent=obj)
+        grp._dict = gdict
+        obj._groups.append(grp)
+    obj._dict = properties
+    if isinstance(sig, list):
+        sig = dict(zip(names, sig))
+    return obj, sig
+
+
+def _expand_signature(sig: dict):
+    # signatures of targets saved as tuples by format 1 and 2
+    for key in ('input', 'output', 'depends'):
+        if isinstance(sig.get(key, None), tuple):
+            sig[key] = dict(zip([str(x) for x in sig[f'{key}_obj']], sig[key]))
+    return sig
+
+
+def encode_signature(signature: dict) -> bytes:
+    '''Encode step signature for storage in the signature database'''
+    if set(signature.keys()) == _SIGNATURE_KEYS:
+        data = pickle.dumps((1, ) + tuple(_pack_targets(signature[f'{key}_obj'], signature[key])
+            for key in ('input', 'output', 'depends')) +
+            (signature['init_context_sig'], signature['end_context']), protocol=4)
+        formats = (_FORMAT_COMPACT_ZSTD, _FORMAT_COMPACT_ZLIB)
+    else:
+        data = pickle.dumps(signature, protocol=4)
+        formats = (_FORMAT_ZSTD, _FORMAT_ZLIB)
+    if zstandard is not None:
+        return formats[0] + zstandard.ZstdCompressor(level=1).compress(data)
+    return formats[1] + zlib.compress(data, 1)
+
+
+def decode_signature(blob: bytes) -> dict:
+    '''Decode step signature saved by encode_signature or by previous
+    versions of sos'''
+    blob = bytes(blob)
+    if blob.startswith(_LZMA_MAGIC):
+        return pickle.loads(lzma.decompress(blob))
+    if blob[:1] in (_FORMAT_ZLIB, _FORMAT_COMPACT_ZLIB):
+        data = zlib.decompress(blob[1:])
+    elif blob[:1] in (_FORMAT_ZSTD, _FORMAT_COMPACT_ZSTD):
+        if zstandard is None:
+            raise ValueError('Module zstandard is required to read signatures compressed by zstd.')
+        data = zstandard.ZstdDecompressor().decompress(blob[1:])
+    else:
+        raise ValueError(f'Unrecognized signature format {blob[:1]}')
+    if blob[:1] in (_FORMAT_ZLIB, _FORMAT_ZSTD):
+        return _expand_signature(pickle.loads(data))
+    # compact schema, which starts with the version of the schema
+    version, *fields = pickle.loads(data)
+    if version != 1:
+        raise ValueError(f'Unsupported version {version} of signature schema')
+    sig = {}
+    for key, packed in zip(('input', 'output', 'depends'), fields[:3]):
+        sig[f'{key}_obj'], sig[key] = _unpack_targets(packed)
+    sig['init_context_sig'], sig['end_context'] = fields[3:]
+    return sig
+
 class SignatureDB:
-    '''Base class for signature DB using sqlite'''
+    '''Base class for signature DB using sqlite. The database is opened in
+    WAL mode so that readers do not block writers from other sos processes.
+    Records are written in groups, either when _commit_size records are
+    pending or when the last commit happened more than _commit_interval
+    seconds ago, or explicitly with commit().'''
+
+    _journal_mode = 'WAL'
+    _commit_size = 1000
+    _commit_interval = 0.5
 
     def __init__(self):
         self.db_file = os.path.join(
             env.exec_dir, '.sos', self._db_name)
         self._conn = None
         self._cache = []
+        self._last_commit = time.time()
 
     def _get_conn(self):
         # there is a possibility that the _conn is copied with a process
         # and we would better have a fresh conn
         if self._conn is None:
             self._conn = sqlite3.connect(self.db_file, timeout=60)
+            # WAL is not supported on some (e.g. network) file systems, in
+            # which case sqlite keeps using the default journal mode.
+            mode = self._conn.execute(f'PRAGMA journal_mode={self._journal_mode}').fetchone()[0]
+            if mode.lower() != self._journal_mode.lower():
+                env.logger.debug(f'Using journal mode {mode} for {self.db_file}')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
             self._conn.execute(self._db_structure)
-            self._conn.commit()
-        if self._cache:
-            self._conn.executemany(self._write_query, self._cache)
-            self._cache = []
+            self._upgrade(self._conn)
             self._conn.commit()
         return self._conn
 
     def _write(self, record):
         self._cache.append(record)
-        if len(self._cache) > 1000:
-            # this will tricky the action to clear cache
-            self._get_conn()
+        if len(self._cache) >= self._commit_size:
+            self.commit()
+        else:
+            self.auto_commit()
 
     conn = property(_get_conn)
 
+    def _upgrade(self, conn):
+        # upgrade database created by previous versions of sos
+        pass
+
     def commit(self):
-        # getting conn will commit all cached records
-        self._get_conn()
+        '''Write all pending records to the database'''
+        conn = self._get_conn()
+        if self._cache:
+            conn.executemany(self._write_query, self._cache)
+            self._cache = []
+            conn.commit()
+        self._last_commit = time.time()
+
+    def auto_commit(self):
+        '''Commit pending records if the last commit happened more than
+        _commit_interval seconds ago'''
+        if self._cache and time.time() - self._last_commit > self._commit_interval:
+            self.commit()
 
     def close(self):
+        self.commit()
         self.conn.close()
 
+class FileSignatures(SignatureDB):
+    '''Signatures (mtime, size, md5) of individual files, indexed by resolved
+    path. This replaces the .file_info files that used to be written under
+    .sos for each file.'''
+
+    _db_name = 'file_signatures.db'
+    _db_structure = '''CREATE TABLE IF NOT EXISTS files (
+        path text PRIMARY KEY,
+        mtime real,
+        size integer,
+        md5 text
+    )'''
+    _write_query = 'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)'
+    # sqlite limits the number of host parameters of a statement to 999
+    _batch_size = 500
+
+    def __init__(self):
+        super(FileSignatures, self).__init__()
+
+    def _legacy_sig_file(self, path: str):
+        from .targets import textMD5
+        return os.path.join(env.exec_dir, '.sos', f'{textMD5(path)}.file_info')
+
+    def _migrate(self, paths: list):
+        # import signatures saved by previous versions of sos in .file_info
+        # files, which are removed after they are imported
+        migrated = {}
+        for path in paths:
+            sig_file = self._legacy_sig_file(path)
+            if not os.path.isfile(sig_file):
+                continue
+            try:
+                with open(sig_file) as sig:
+                    mtime, size, md5 = sig.read().strip().split()
+                migrated[path] = (float(mtime), int(size), md5)
+                os.remove(sig_file)
+            except Exception as e:
+                env.logger.debug(f'Failed to import legacy signature file {sig_file}: {e}')
+        if migrated:
+            self.set_many(migrated)
+        return migrated
+
+    def get(self, path: str):
+        return self.get_many([path]).get(path, None)
+
+    def get_many(self, paths: list):
+        '''Return a dictionary of signatures (mtime, size, md5) for specified
+        paths. Paths without signatures are not included.'''
+        paths = list(paths)
+        res = {}
+        try:
+            cur = self.conn.cursor()
+            for i in range(0, len(paths), self._batch_size):
+                batch = paths[i:i + self._batch_size]
+                cur.execute(
+                    f'SELECT path, mtime, size, md5 FROM files WHERE path IN ({",".join("?" * len(batch))})',
+                    batch)
+                res.update({x[0]: tuple(x[1:]) for x in cur.fetchall()})
+        except sqlite3.DatabaseError as e:
+            env.logger.warning(f'Failed to get signatures of {len(paths)} files: {e}')
+            return res
+        missing = [x for x in paths if x not in res]
+        if missing:
+            res.update(self._migrate(missing))
+        return res
+
+    def set(self, path: str, mtime: float, size: int, md5: str):
+        self.set_many({path: (mtime, size, md5)})
+
+    def set_many(self, signatures: dict):
+        '''Write signatures of multiple files in a single transaction'''
+        try:
+            self._cache.extend((path, *sig) for path, sig in signatures.items())
+            self.commit()
+        except sqlite3.DatabaseError as e:
+            env.logger.warning(f'Failed to set signatures of {len(signatures)} files: {e}')
+
+    def remove_many(self, paths: list):
+        try:
+            self.commit()
+            cur = self.conn.cursor()
+            cur.executemany('DELETE FROM files WHERE path=?',
+                [(x,) for x in paths])
+            self.conn.commit()
+        except sqlite3.DatabaseError as e:
+            env.logger.warning(f'Failed to remove signatures of {len(paths)} files: {e}')
+
+    def clear(self):
+        try:
+            self.commit()
+            self.conn.execute('DELETE FROM files')
+            self.conn.commit()
+        except sqlite3.DatabaseError as e:
+            env.logger.warning(f'Failed to clear file signature database: {e}')
+
+
+_file_signatures = {}
+
+
+def file_signatures():
+    '''Return a FileSignatures object for current exec_dir that is shared
+    by all targets of the current process.'''
+    key = (os.getpid(), env.exec_dir)
+    if key not in _file_signatures:
+        _file_signatures[key] = FileSignatures()
+    return _file_signatures[key]
+
+
+class HashCache:
+    '''A cache of md5 of files indexed by the stat identity (device, inode,
+    mtime in ns, and size) of files, shared by all sos processes and tasks on
+    the same host so that unchanged files are not read again. The cache is
+    kept under the local temp directory and the least recently used entries
+    are removed when the number of entries exceeds max_size. Access times of
+    entries are kept in memory and written with the next insertion or
+    eviction so that reading the cache does not write to the database.'''
+
+    _db_structure = ['''CREATE TABLE IF NOT EXISTS hashes (
+            dev integer,
+            ino integer,
+            mtime_ns integer,
+            size integer,
+            method text,
+            md5 text,
+            accessed real,
+            PRIMARY KEY (dev, ino, mtime_ns, size, method)
+        )''',
+        'CREATE INDEX IF NOT EXISTS hashes_accessed ON hashes (accessed)']
+
+    def __init__(self, db_file: str=None, max_size: int=100000):
+        self.db_file = db_file if db_file else os.path.join(
+            env.temp_dir, 'hash_cache.db')
+        self.max_size = max_size
+        self._conn = None
+        self._pid = None
+        self._n_inserted = 0
+        # access time of entries that have not been written to the database
+        self._accessed = {}
+        # the cache can be used by multiple hashing threads
+        self._lock = threading.Lock()
+
+    def _get_conn(self):
+        # a connection copied from another process cannot be used
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_file, timeout=5,
+                check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            for stmt in self._db_structure:
+                self._conn.execute(stmt)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, st: os.stat_result, method: str):
+        '''Return cached md5 of a file with stat st, or None if not cached'''
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size, method)
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                res = conn.execute('''SELECT md5 FROM hashes WHERE dev=? AND ino=?
+                    AND mtime_ns=? AND size=? AND method=?''', key).fetchone()
+                if res:
+                    self._accessed[key] = time.time()
+                    if len(self._accessed) >= 1000:
+                        self._write_accessed(conn)
+                        conn.commit()
+                    return res[0]
+        except sqlite3.DatabaseError as e:
+            env.logger.debug(f'Failed to read hash cache {self.db_file}: {e}')
+        return None
+
+    def set(self, st: os.stat_result, method: str, md5: str):
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                conn.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size, method, md5, time.time()))
+                self._n_inserted += 1
+                # check the size of cache from time to time
+                if self._n_inserted % 1000 == 0:
+                    self._evict(conn)
+                else:
+                    self._write_accessed(conn)
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            env.logger.debug(f'Failed to write hash cache {self.db_file}: {e}')
+
+    def _write_accessed(self, conn):
+        if self._accessed:
+            conn.executemany('''UPDATE hashes SET accessed=? WHERE dev=? AND ino=?
+                AND mtime_ns=? AND size=? AND method=?''',
+                [(t, *key) for key, t in self._accessed.items()])
+            self._accessed = {}
+
+    def _evict(self, conn):
+        self._write_accessed(conn)
+        count = conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+        if count > self.max_size:
+            # remove least recently used entries, leaving some room for new ones
+            conn.execute('''DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes
+                ORDER BY accessed LIMIT ?)''', (count - int(self.max_size * 0.9),))
+
+    def evict(self):
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                self._evict(conn)
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            env.logger.debug(f'Failed to evict entries from hash cache {self.db_file}: {e}')
+
+
+_hash_cache = None
+
+
+def hash_cache():
+    '''Return a HashCache object shared by all threads of the current process'''
+    global _hash_cache
+    if _hash_cache is None:
+        _hash_cache = HashCache(max_size=env.sos_dict.get('CONFIG', {}).get(
+            'sos', {}).get('hash_cache_size', 100000))
+    return _hash_cache
+
+
 class StepSignatures(SignatureDB):
     '''Step signature that stores runtime signatures of substeps'''
 
@@ -55,12 +434,31 @@ class StepSignatures(SignatureDB):
         step_id text PRIMARY KEY,
         signature BLOB
     )'''
-    _write_query = 'INSERT OR REPLACE INTO steps VALUES (?, ?)'
+    _write_query = 'INSERT OR REPLACE INTO steps (step_id, signature) VALUES (?, ?)'
+    # sqlite limits the number of host parameters of a statement to 999
+    _batch_size = 500
 
     def __init__(self):
         super(StepSignatures, self).__init__()
+        # records that are not yet written to the database, which are used
+        # to answer queries without having to commit them
+        self._pending = {}
+
+    def commit(self):
+        super(StepSignatures, self).commit()
+        self._pending = {}
+
+    def _load(self, step_id: str, signature: bytes):
+        try:
+            return decode_signature(signature)
+        except Exception as e:
+            env.logger.warning(
+                f'Failed to load signature for step {step_id}: {e}')
+            return None
 
     def get(self, step_id: str):
+        if step_id in self._pending:
+            return self._load(step_id, self._pending[step_id][1])
         try:
             cur = self.conn.cursor()
             cur.execute(
@@ -70,18 +468,33 @@ class StepSignatures(SignatureDB):
             env.logger.warning(f'Failed to get step signature for step {step_id}: {e}')
             return None
         if res:
-            try:
-                return pickle.loads(lzma.decompress(res[0]))
-            except Exception as e:
-                env.logger.warning(
-                    f'Failed to load signature for step {step_id}: {e}')
-                return None
+            return self._load(step_id, res[0])
         else:
             return None
 
+    def get_many(self, step_ids: list):
+        '''Return a dictionary of signatures of specified substeps. Substeps
+        without signature are not included.'''
+        step_ids = list(step_ids)
+        res = {}
+        try:
+            cur = self.conn.cursor()
+            for i in range(0, len(step_ids), self._batch_size):
+                batch = step_ids[i:i + self._batch_size]
+                cur.execute(
+                    f'SELECT step_id, signature FROM steps WHERE step_id IN ({",".join("?" * len(batch))})',
+                    batch)
+                res.update({x[0]: self._load(*x) for x in cur.fetchall()})
+        except sqlite3.DatabaseError as e:
+            env.logger.warning(f'Failed to get step signatures of {len(step_ids)} substeps: {e}')
+        res.update({x: self._load(x, self._pending[x][1]) for x in step_ids if x in self._pending})
+        return {x: y for x, y in res.items() if y is not None}
+
     def set(self, step_id: str, signature: dict):
         try:
-            self._write((step_id, lzma.compress(pickle.dumps(signature))))
+            record = (step_id, encode_signature(signature))
+            self._pending[step_id] = record
+            self._write(record)
         except sqlite3.DatabaseError as e:
             env.logger.warning(f'Failed to set step signature for step {step_id}: {e}')
 
@@ -95,6 +508,7 @@ class StepSignatures(SignatureDB):
 
     def remove_many(self, steps: list):
         try:
+            self.commit()
             cur = self.conn.cursor()
             cnt = self._num_records(cur)
             cur.executemany(
@@ -108,6 +522,8 @@ class StepSignatures(SignatureDB):
 
     def clear(self):
         try:
+            self._pending = {}
+            self._cache = []
             self.conn.execute('DELETE FROM steps')
             self.conn.commit()
         except sqlite3.DatabaseError as e:
@@ -115,38 +531,71 @@ class StepSignatures(SignatureDB):
 
 
 class WorkflowSignatures(SignatureDB):
-    '''Workflow signature to store runtime information for workflows'''
+    '''Workflow signature to store runtime information for workflows. Items
+    are saved in JSON format.'''
     _db_name = 'workflow_signatures.db'
     _db_structure = '''CREATE TABLE IF NOT EXISTS workflows (
             master_id text,
             entry_type text,
             id text,
-            item text
+            item text,
+            time real
     )'''
-    _write_query = 'INSERT INTO workflows VALUES (?, ?, ?, ?)'
+    _write_query = 'INSERT INTO workflows VALUES (?, ?, ?, ?, ?)'
+    # version of the database recorded as user_version
+    _db_version = 1
 
     def __init__(self):
         super(WorkflowSignatures, self).__init__()
 
-    def write(self, entry_type: str, id: str, item: str):
+    @staticmethod
+    def _decode_item(entry_type: str, item):
+        # items used to be saved as repr of dictionaries
+        if isinstance(item, str) and entry_type != 'placeholder':
+            try:
+                return ast.literal_eval(item)
+            except Exception:
+                pass
+        return item
+
+    def _upgrade(self, conn):
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= self._db_version:
+            return
+        if 'time' not in [x[1] for x in conn.execute('PRAGMA table_info(workflows)')]:
+            # convert records written by previous versions of sos to JSON
+            env.logger.debug(f'Upgrading {self.db_file}')
+            conn.execute('ALTER TABLE workflows ADD COLUMN time real')
+            now = time.time()
+            conn.executemany('UPDATE workflows SET item=?, time=? WHERE rowid=?',
+                [(json.dumps(self._decode_item(entry_type, item), default=str), now, rowid)
+                    for rowid, entry_type, item in conn.execute(
+                        'SELECT rowid, entry_type, item FROM workflows').fetchall()])
+        conn.execute('CREATE INDEX IF NOT EXISTS workflows_master_id ON workflows (master_id, entry_type)')
+        conn.execute('CREATE INDEX IF NOT EXISTS workflows_entry_type ON workflows (entry_type, id)')
+        conn.execute(f'PRAGMA user_version={self._db_version}')
+
+    def write(self, entry_type: str, id: str, item):
         try:
-            self._write((env.config["master_id"], entry_type, id, item))
-        except sqlite3.DatabaseError as e:
+            self._write((env.config["master_id"], entry_type, id,
+                json.dumps(self._decode_item(entry_type, item), default=str), time.time()))
+        except (sqlite3.DatabaseError, TypeError, ValueError) as e:
             env.logger.warning(f'Failed to write workflow signature of type {entry_type} and id {id}: {e}')
             return None
 
     def records(self, workflow_id):
         try:
+            self.commit()
             cur = self.conn.cursor()
             cur.execute(
                 'SELECT entry_type, id, item FROM workflows WHERE master_id = ?', (workflow_id,))
-            return cur.fetchall() if cur else []
-        except sqlite3.DatabaseError as e:
+            return [(x[0], x[1], json.loads(x[2])) for x in cur.fetchall()]
+        except (sqlite3.DatabaseError, ValueError) as e:
             env.logger.warning(f'Failed to get records of workflow {workflow_id}: {e}')
             return []
 
     def workflows(self):
         try:
+            self.commit()
             cur = self.conn.cursor()
             cur.execute('SELECT DISTINCT master_id FROM workflows')
             return [x[0] for x in cur.fetchall()]
@@ -156,8 +605,9 @@ class WorkflowSignatures(SignatureDB):
 
     def tasks(self):
         try:
+            self.commit()
             cur = self.conn.cursor()
-            cur.execute('SELECT DISTINCT id FROM workflows WHERE entry_type = "task"')
+            cur.execute('SELECT DISTINCT id FROM workflows WHERE entry_type = ?', ('task',))
             return [x[0] for x in cur.fetchall()]
         except sqlite3.DatabaseError as e:
             env.logger.warning(f'Failed to get tasks from signature database: {e}')
@@ -166,27 +616,57 @@ class WorkflowSignatures(SignatureDB):
     def files(self):
         '''Listing files related to workflows related to current directory'''
         try:
+            self.commit()
             cur = self.conn.cursor()
-            cur.execute('SELECT id, item FROM workflows WHERE entry_type = "tracked_files"')
-            return [(x[0], eval(x[1])) for x in cur.fetchall()]
-        except sqlite3.DatabaseError as e:
+            cur.execute('SELECT id, item FROM workflows WHERE entry_type = ?', ('tracked_files',))
+            return [(x[0], json.loads(x[1])) for x in cur.fetchall()]
+        except (sqlite3.DatabaseError, ValueError) as e:
             env.logger.warning(f'Failed to get files from signature database: {e}')
             return []
 
     def placeholders(self, workflow_id = None):
         try:
+            self.commit()
             cur = self.conn.cursor()
             if workflow_id is None:
-                cur.execute('SELECT item FROM workflows WHERE entry_type = "placeholder"')
+                cur.execute('SELECT item FROM workflows WHERE entry_type = ?', ('placeholder',))
             else:
-                cur.execute(f'SELECT item FROM workflows WHERE entry_type = "placeholder" AND master_id = "{workflow_id}"')
-            return [x[0] for x in cur.fetchall()]
-        except sqlite3.DatabaseError as e:
+                cur.execute('SELECT item FROM workflows WHERE entry_type = ? AND master_id = ?',
+                    ('placeholder', workflow_id))
+            return [json.loads(x[0]) for x in cur.fetchall()]
+        except (sqlite3.DatabaseError, ValueError) as e:
             env.logger.warning(f'Failed to get placeholders from signature database: {e}')
             return []
 
+    def remove_workflows(self, age: float=None):
+        '''Remove records of workflows that were last updated more than age
+        seconds ago (or within -age seconds if age is negative), or all
+        workflows if age is None, and compact the database. Return the
+        number of removed workflows.'''
+        try:
+            self.commit()
+            cur = self.conn.cursor()
+            if not age:
+                cur.execute('SELECT DISTINCT master_id FROM workflows')
+            elif age > 0:
+                cur.execute('SELECT master_id FROM workflows GROUP BY master_id HAVING MAX(time) < ?',
+                    (time.time() - age,))
+            else:
+                cur.execute('SELECT master_id FROM workflows GROUP BY master_id HAVING MAX(time) >= ?',
+                    (time.time() + age,))
+            workflows = [x[0] for x in cur.fetchall()]
+            cur.executemany('DELETE FROM workflows WHERE master_id = ?',
+                [(x,) for x in workflows])
+            self.conn.commit()
+            self.conn.execute('VACUUM')
+            return len(workflows)
+        except sqlite3.DatabaseError as e:
+            env.logger.warning(f'Failed to remove workflows from signature database: {e}')
+            return 0
+
     def clear(self):
         try:
+            self.commit()
             self.conn.execute(
                 f'DELETE FROM workflows WHERE master_id = ?', (env.config["master_id"],))
             self.conn.commit()
@@ -4,7 +4,9 @@
 # Distributed under the terms of the 3-clause BSD License.
 
 import copy
+import hashlib
 import os
+import pickle
 import subprocess
 import sys
 import time
@@ -15,6 +17,7 @@ from collections import Iterable, Mapping, Sequence, defaultdict
 from typing import List, Union
 
 from .eval import SoS_eval, SoS_exec, accessed_vars
+from .messages import send_message
 from .syntax import (SOS_DEPENDS_OPTIONS, SOS_INPUT_OPTIONS, SOS_TARGETS_OPTIONS,
                      SOS_OUTPUT_OPTIONS)
 from .targets import (RemovedTarget, RuntimeInfo, UnavailableLock,
@@ -108,8 +111,8 @@ class TaskManager:
                 master.push(task_id, taskdef)
             ids.append(master.ID)
             TaskFile(master.ID).save(master)
-            env.signature_push_socket.send_pyobj(['workflow', 'task', master.ID,
-                                  f"{{'creation_time': {time.time()}}}"])
+            send_message(env.signature_push_socket, ['workflow', 'task', master.ID,
+                                  {'creation_time': time.time()}])
         self._unsubmitted_slots = []
 
         # individual tasks...
@@ -129,8 +132,8 @@ class TaskManager:
                 # if the task file, perhaps it is already running, we do not change
                 # the task file. Otherwise we are changing the status of the task
                 TaskFile(task_id).save(taskdef)
-                env.signature_push_socket.send_pyobj(['workflow', 'task', task_id,
-                                          f"{{'creation_time': {time.time()}}}"])
+                send_message(env.signature_push_socket, ['workflow', 'task', task_id,
+                                          {'creation_time': time.time()}])
                 ids.append(task_id)
         else:
             master = None
@@ -138,8 +141,8 @@ class TaskManager:
                 if master is not None and master.num_tasks() == self.trunk_size:
                     ids.append(master.ID)
                     TaskFile(master.ID).save(master)
-                    env.signature_push_socket.send_pyobj(['workflow', 'task', master.ID,
-                                              f"{{'creation_time': {time.time()}}}"])
+                    send_message(env.signature_push_socket, ['workflow', 'task', master.ID,
+                                              {'creation_time': time.time()}])
                     master = None
                 if master is None:
                     master = MasterTaskParams(self.trunk_workers)
@@ -147,8 +150,8 @@ class TaskManager:
             # the last piece
             if master is not None:
                 TaskFile(master.ID).save(master)
-                env.signature_push_socket.send_pyobj(['workflow', 'task', master.ID,
-                                          f"{{'creation_time': {time.time()}}}"])
+                send_message(env.signature_push_socket, ['workflow', 'task', master.ID,
+                                          {'creation_time': time.time()}])
                 ids.append(master.ID)
 
         if not ids:
@@ -287,6 +290,10 @@ class Base_Step_Executor:
     # This base class defines how steps are executed. The derived classes will reimplement
     # some function to behave differently in different modes.
     #
+
+    # variables that are different for each substep
+    SUBSTEP_VARS = {'_input', '_output', '_depends', '_index', 'step_output', '_runtime'}
+
     def __init__(self, step):
         self.step = step
         self.task_manager = None
@@ -407,6 +414,29 @@ class Base_Step_Executor:
         return var
 
     def process_output_args(self, ofiles: sos_targets, **kwargs):
+        ofiles = self.get_substep_output(ofiles, **kwargs)
+
+        # create directory
+        if ofiles.valid():
+            for ofile in ofiles:
+                if isinstance(ofile, file_target):
+                    parent_dir = ofile.parent
+                    if parent_dir and not parent_dir.is_dir():
+                        parent_dir.mkdir(parents=True, exist_ok=True)
+
+        # set variables
+        env.sos_dict.set('_output', ofiles)
+        env.sos_dict.set('step_output', ofiles)
+        #
+        for ofile in ofiles:
+            oname = ofile.target_name()
+            if oname in self._all_outputs:
+                raise ValueError(
+                    f'Output {ofile} from substep {env.sos_dict["_index"]} overlaps with output from a previous substep')
+            self._all_outputs.add(oname)
+
+    def get_substep_output(self, ofiles: sos_targets, **kwargs):
+        # output of the current substep from output files of the step
         for k in kwargs.keys():
             if k not in SOS_OUTPUT_OPTIONS:
                 raise RuntimeError(f'Unrecognized output option {k}')
@@ -427,25 +457,66 @@ class Base_Step_Executor:
                     ofiles.set(**vars)
             except Exception as e:
                 raise RuntimeError(f'Failed to apply option "group_with" to input with {env.sos_dict["__num_groups__"]} groups: {e}')
-
-        # create directory
-        if ofiles.valid():
-            for ofile in ofiles:
-                if isinstance(ofile, file_target):
-                    parent_dir = ofile.parent
-                    if parent_dir and not parent_dir.is_dir():
-                        parent_dir.mkdir(parents=True, exist_ok=True)
-
-        # set variables
-        env.sos_dict.set('_output', ofiles)
-        env.sos_dict.set('step_output', ofiles)
-        #
-        for ofile in ofiles:
-            oname = ofile.target_name()
-            if oname in self._all_outputs:
-                raise ValueError(
-                    f'Output {ofile} from substep {env.sos_dict["_index"]} overlaps with output from a previous substep')
-            self._all_outputs.add(oname)
+        return ofiles
+
+    def prefetch_substep_signatures(self, statements):
+        '''Retrieve signatures of sequentially executed substeps in one request.
+        The signatures can only be identified before the execution of substeps
+        for steps with an output directive followed by a single statement, and
+        a substep with a different signature at the time of execution will
+        query its signature individually.'''
+        if len(statements) != 2 or statements[0][0] != ':' or statements[0][1] != 'output' \
+            or statements[1][0] != '!':
+            return
+        saved_dict = dict(env.sos_dict._dict)
+        sig_ids = []
+        try:
+            for idx, g in enumerate(self._substeps):
+                self.set_group_vars(g)
+                env.sos_dict.set('_input', g)
+                env.sos_dict.set('_index', idx)
+                args, kwargs = SoS_eval(f'__null_func__({statements[0][2]})',
+                    extra_dict={
+                        '__null_func__': __null_func__,
+                        'output_from': __output_from__,
+                        'named_output': __named_output__
+                        })
+                ofiles = self.get_substep_output(
+                    expand_output_files(statements[0][2], *args,
+                        **{k:v for k,v in kwargs.items() if k not in SOS_OUTPUT_OPTIONS}),
+                    **{k:v for k,v in kwargs.items() if k in SOS_OUTPUT_OPTIONS})
+                if ofiles.unspecified():
+                    continue
+                env.sos_dict.set('_output', ofiles)
+                sig_ids.append(RuntimeInfo(
+                    statementMD5([statements[1][1], self.step.task]),
+                    g, ofiles,
+                    env.sos_dict['_depends'],
+                    env.sos_dict['__signature_vars__'],
+                    shared_vars=self.vars_to_be_shared).sig_id)
+        except Exception as e:
+            env.logger.debug(f'Failed to identify signatures of substeps: {e}')
+        finally:
+            env.sos_dict._dict.clear()
+            env.sos_dict._dict.update(saved_dict)
+        if sig_ids:
+            RuntimeInfo.prefetch(env.sos_dict['step_id'], sig_ids)
+
+    def set_group_vars(self, g):
+        # expose target level variables as lists
+        _vars = {}
+        if len(g) > 1:
+            names = set.union(*[set(x._dict.keys()) for x in g._targets])
+        elif len(g) == 1:
+            names = set(g._targets[0]._dict.keys())
+        else:
+            names = set()
+        for name in names:
+            _vars[name] = [x.get(name) for x in g._targets]
+        # then we expose all group level variables
+        _vars.update(g._dict)
+        _vars.update(env.sos_dict['step_input']._dict)
+        env.sos_dict.update(_vars)
 
     def submit_task(self, task_info):
         if self.task_manager is None:
@@ -537,7 +608,7 @@ class Base_Step_Executor:
                 y)) for x, y in result.items()}
             rep_result['tags'] = ' '.join(self.task_manager.tags(id))
             rep_result['queue'] = queue
-            env.signature_push_socket.send_pyobj(['workflow', 'task', id, repr(rep_result)])
+            send_message(env.signature_push_socket, ['workflow', 'task', id, rep_result])
         self.task_manager.clear_submitted()
 
         # if in dryrun mode, we display the output of the dryrun task
@@ -570,10 +641,10 @@ class Base_Step_Executor:
             if 'skipped' in res and res['skipped']:
                 self.completed['__task_skipped__'] += 1
                 # complete case: task skipped
-                env.controller_push_socket.send_pyobj(['progress', 'substep_completed', env.sos_dict['step_id']])
+                send_message(env.controller_push_socket, ['progress', 'substep_completed', env.sos_dict['step_id']])
             else:
                 # complete case: task completed
-                env.controller_push_socket.send_pyobj(['progress', 'substep_ignored', env.sos_dict['step_id']])
+                send_message(env.controller_push_socket, ['progress', 'substep_ignored', env.sos_dict['step_id']])
                 self.completed['__task_completed__'] += 1
             if 'shared' in res:
                 self.shared_vars[idx].update(res['shared'])
@@ -621,9 +692,68 @@ class Base_Step_Executor:
         self.result_pull_socket = env.zmq_context.socket(zmq.PULL)
         port = self.result_pull_socket.bind_to_random_port('tcp://127.0.0.1')
         env.config['sockets']['result_push_socket'] = port
+        # substeps are sent to substep workers in chunks, the size of which
+        # is adjusted so that a chunk takes about half a second to execute
+        self._substep_chunk = []
+        self._substep_chunk_size = 1
+        self._substep_duration = 0
+        self._n_timed_substeps = 0
+        self._substep_context_id = None
+
+    def get_substep_vars(self, step_vars):
+        # step_vars are variables that are usually the same for all substeps.
+        # They are registered to the controller as a step context, from which
+        # substep workers retrieve them once, so that substeps only carry
+        # variables that are not in, or have been changed from, the context
+        if self._substep_context_id is None:
+            context = env.sos_dict.clone_selected_vars(step_vars - self.SUBSTEP_VARS)
+            self._substep_context = {x: (env.sos_dict[x], self.get_value_md5(env.sos_dict[x]))
+                for x in context}
+            payload = pickle.dumps(context, pickle.HIGHEST_PROTOCOL)
+            self._substep_context_id = hashlib.md5(payload).hexdigest()
+            env.controller_req_socket.send_pyobj(['step_context', self._substep_context_id, payload])
+            env.controller_req_socket.recv_pyobj()
+        changed = {x for x in step_vars if x in env.sos_dict and self.is_context_var_changed(x)}
+        return env.sos_dict.clone_selected_vars(changed | self.SUBSTEP_VARS)
+
+    def get_value_md5(self, value):
+        # md5 of variables that can be changed in place
+        if isinstance(value, (str, bytes, int, float, bool, type(None))):
+            return None
+        return hashlib.md5(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def is_context_var_changed(self, name):
+        # a variable is changed if it is reassigned, or if it is changed in
+        # place, in which case it has the same identity but a different value
+        if name not in self._substep_context:
+            return True
+        value, value_md5 = self._substep_context[name]
+        return env.sos_dict[name] is not value or \
+            (value_md5 is not None and value_md5 != self.get_value_md5(value))
 
     def submit_substep(self, substep):
-        env.substep_frontend_socket.send_pyobj(substep)
+        # substeps of a step differ only in proc_vars, so other parameters
+        # are sent only once for a chunk of substeps
+        self._substep_chunk.append(substep.pop('proc_vars'))
+        self._substep_params = substep
+        if len(self._substep_chunk) >= self._substep_chunk_size:
+            self.submit_substep_chunk()
+
+    def submit_substep_chunk(self):
+        if not self._substep_chunk:
+            return
+        env.substep_frontend_socket.send_pyobj(dict(substeps=self._substep_chunk,
+            **self._substep_params))
+        self._substep_chunk = []
+
+    def adjust_substep_chunk_size(self, duration):
+        self._substep_duration += duration
+        self._n_timed_substeps += 1
+        avg_duration = self._substep_duration / self._n_timed_substeps
+        # but keep enough chunks for all workers
+        self._substep_chunk_size = max(1, min(
+            1000 if avg_duration == 0 else int(0.5 / avg_duration),
+            len(self._substeps) // max(env.config['max_procs'], 1)))
 
     def process_returned_substep_result(self, till=None, wait=True):
         while True:
@@ -636,6 +766,8 @@ class Base_Step_Executor:
             #
             if "index" not in res:
                 raise RuntimeError("Result received from substep does not have key index")
+            if 'duration' in res:
+                self.adjust_substep_chunk_size(res.pop('duration'))
             if 'task_id' in res:
                 task = self.submit_task(res)
                 # if substep returns tasks, ...
@@ -650,6 +782,7 @@ class Base_Step_Executor:
             self._completed_concurrent_substeps += 1
 
     def wait_for_substep(self):
+        self.submit_substep_chunk()
         while self._completed_concurrent_substeps < len(self.proc_results):
             self.process_returned_substep_result(till=len(self.proc_results),
                 wait=True)
@@ -672,7 +805,7 @@ class Base_Step_Executor:
         result['__shared__'] = {}
         if 'shared' in self.step.options:
             result['__shared__'] = self.shared_vars
-        env.controller_push_socket.send_pyobj(['progress', 'step_completed',
+        send_message(env.controller_push_socket, ['progress', 'step_completed',
             -1 if 'sos_run' in env.sos_dict['__signature_vars__'] else self.completed['__step_completed__'],
             env.sos_dict['step_name'], env.sos_dict['step_output']])
         return result
@@ -856,6 +989,9 @@ class Base_Step_Executor:
             self.vars_to_be_shared = parse_shared_vars(self.step.options['shared'])
         self.vars_to_be_shared = sorted([x[5:] if x.startswith('step_') else x for x in self.vars_to_be_shared if x not in ('step_', 'step_input', 'step_output', 'step_depends')])
         self.shared_vars = [{} for x in self._substeps]
+        # hash algorithm and strategy used for signatures of files of this step
+        env.sos_dict.set('__signature_policy__', self.step.options['signature']
+            if 'signature' in self.step.options else None)
         # run steps after input statement, which will be run multiple times for each input
         # group.
         env.sos_dict.set('__num_groups__', len(self._substeps))
@@ -892,6 +1028,13 @@ class Base_Step_Executor:
             else:
                 self.prepare_substep()
 
+        # retrieve signatures of all substeps in one request if they are
+        # validated by this executor
+        if not self.concurrent_substep and len(self._substeps) > 1 and \
+            env.config['sig_mode'] in ('default', 'assert') and \
+            'sos_run' not in env.sos_dict['__signature_vars__']:
+            self.prefetch_substep_signatures(self.step.statements[input_statement_idx:])
+
         try:
             self.completed['__substep_skipped__'] = 0
             self.completed['__substep_completed__'] = len(self._substeps)
@@ -900,21 +1043,7 @@ class Base_Step_Executor:
             pending_signatures = [None for x in self._substeps]
             for idx, g in enumerate(self._substeps):
                 # other variables
-                #
-                _vars = {}
-                # now, let us expose target level variables as lists
-                if len(g) > 1:
-                    names = set.union(*[set(x._dict.keys()) for x in g._targets])
-                elif len(g) == 1:
-                    names = set(g._targets[0]._dict.keys())
-                else:
-                    names = set()
-                for name in names:
-                    _vars[name] = [x.get(name) for x in g._targets]
-                # then we expose all group level variables
-                _vars.update(g._dict)
-                _vars.update(env.sos_dict['step_input']._dict)
-                env.sos_dict.update(_vars)
+                self.set_group_vars(g)
 
                 env.sos_dict.set('_input', copy.deepcopy(g))
                 # set vars to _input
@@ -949,7 +1078,7 @@ class Base_Step_Executor:
                         post_statement = [['!', '']]
                     else:
                         # complete case: no step, no statement
-                        env.controller_push_socket.send_pyobj(['progress', 'substep_completed', env.sos_dict['step_id']])
+                        send_message(env.controller_push_socket, ['progress', 'substep_completed', env.sos_dict['step_id']])
 
                 for statement in pre_statement + self.step.statements[input_statement_idx:] + post_statement:
                     # if input is undertermined, we can only process output:
@@ -1032,18 +1161,17 @@ class Base_Step_Executor:
                                 #
                                 # __step_context__ is not needed because substep
                                 # executor does not support nested workflow
-                                proc_vars = env.sos_dict.clone_selected_vars(
+                                proc_vars = self.get_substep_vars(
                                     env.sos_dict['__signature_vars__']
-                                    | {'_input', '_output', '_depends', '_index',
-                                     'step_output', '__args__', 'step_name',
-                                      '_runtime', 'step_id', 'workflow_id', '__num_groups__',
-                                      '__signature_vars__'})
+                                    | {'__args__', 'step_name', 'step_id', 'workflow_id',
+                                      '__num_groups__', '__signature_vars__', '__signature_policy__'})
 
                                 self.proc_results.append({})
                                 self.submit_substep(dict(stmt=statement[1],
                                     global_def=self.step.global_def,
                                     task=self.step.task,
                                     task_params=self.step.task_params,
+                                    context_id=self._substep_context_id,
                                     proc_vars=proc_vars,
                                     shared_vars=self.vars_to_be_shared,
                                     config=env.config))
@@ -1065,7 +1193,7 @@ class Base_Step_Executor:
                                         if not self.step.task:
                                             # if no task, this step is __completed
                                             # complete case: local skip without task
-                                            env.controller_push_socket.send_pyobj(['progress', 'substep_completed', env.sos_dict['step_id']])
+                                            send_message(env.controller_push_socket, ['progress', 'substep_completed', env.sos_dict['step_id']])
                                     if 'shared' in self.step.options:
                                         try:
                                             self.shared_vars[env.sos_dict['_index']].update({
@@ -1092,7 +1220,7 @@ class Base_Step_Executor:
                                         if 'vars' in matched:
                                             self.shared_vars[env.sos_dict['_index']].update(matched["vars"])
                                         # complete case: local skip without task
-                                        env.controller_push_socket.send_pyobj(['progress', 'substep_ignored', env.sos_dict['step_id']])
+                                        send_message(env.controller_push_socket, ['progress', 'substep_ignored', env.sos_dict['step_id']])
                                     else:
                                         sig.lock()
                                         try:
@@ -1120,7 +1248,7 @@ class Base_Step_Executor:
                                                     sig.set_output(output)
                                                 sig.write()
                                                 # complete case : local execution without task
-                                                env.controller_push_socket.send_pyobj(['progress', 'substep_completed', env.sos_dict['step_id']])
+                                                send_message(env.controller_push_socket, ['progress', 'substep_completed', env.sos_dict['step_id']])
                                             else:
                                                 pending_signatures[idx] = sig
                                             sig.release()
@@ -1157,7 +1285,7 @@ class Base_Step_Executor:
                             self.output_groups[env.sos_dict['_index']] = matched["output"]
                         self.shared_vars[env.sos_dict['_index']].update(matched["vars"])
                         # complete case: step with task ignored
-                        env.controller_push_socket.send_pyobj(['progress', 'substep_ignored', env.sos_dict['step_id']])
+                        send_message(env.controller_push_socket, ['progress', 'substep_ignored', env.sos_dict['step_id']])
                     pending_signatures[idx] = sig
 
                 # if this index is skipped, go directly to the next one
@@ -1314,11 +1442,16 @@ class Base_Step_Executor:
                 'completed': dict(self.completed),
                 'end_time': time.time()
             }
-            env.signature_push_socket.send_pyobj([
-                'workflow', 'step', env.sos_dict["workflow_id"], repr(step_info)])
+            send_message(env.signature_push_socket, [
+                'workflow', 'step', env.sos_dict["workflow_id"], step_info])
             return self.collect_result()
         finally:
+            RuntimeInfo.clear_prefetched(env.sos_dict.get('step_id', None))
             if self.concurrent_substep:
+                if self._substep_context_id is not None:
+                    # release the step context kept by the controller
+                    env.controller_req_socket.send_pyobj(['step_context', self._substep_context_id, None])
+                    env.controller_req_socket.recv_pyobj()
                 self.result_pull_socket.close()
 
 
@@ -1351,7 +1484,7 @@ class Step_Executor(Base_Step_Executor):
             return {}
         # when we wait, the "outsiders" also need to see the tags etc
         # of the tasks so we have to write to the database. #156
-        env.signature_push_socket.send_pyobj(['commit'])
+        send_message(env.signature_push_socket, ['commit'])
         # wait till the executor responde
         results = {}
         while True:
@@ -3,14 +3,18 @@
 # Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
 # Distributed under the terms of the 3-clause BSD License.
 
+import copy
+import pickle
 import subprocess
 import sys
+import time
 import contextlib
 import zmq
 
 from io import StringIO
 
 from .eval import SoS_exec
+from .messages import send_message
 from .targets import (RemovedTarget, RuntimeInfo, UnavailableLock,
                       UnknownTarget, sos_targets)
 from .executor_utils import (prepare_env, clear_output, verify_input, kill_all_subprocesses,
@@ -19,6 +23,15 @@ from .executor_utils import (prepare_env, clear_output, verify_input, kill_all_s
 from .utils import (StopInputGroup, TerminateExecution, ArgumentError, env)
 
 
+# step contexts cached by substep workers
+_step_contexts = {}
+# step and global definition of the last working environment prepared by
+# the substep worker, and a snapshot of variables defined by the global
+# definition
+_prepared_env = None
+_prepared_vars = {}
+
+
 @contextlib.contextmanager
 def stdoutIO():
     oldout = sys.stdout
@@ -75,35 +88,147 @@ def execute_substep(stmt, global_def='', task='', task_params='', proc_vars={},
     stderr: (optional) if in interactive mode
     exception: (optional) if an exception occures
     '''
+    execute_substeps(stmt=stmt, global_def=global_def, task=task,
+        task_params=task_params, substeps=[proc_vars], shared_vars=shared_vars,
+        config=config)
+
+
+def get_step_context(context_id):
+    '''Return pickled variables shared by substeps of a step, which are
+    retrieved from the controller once and cached by the worker'''
+    if context_id not in _step_contexts:
+        env.controller_req_socket.send_pyobj(['step_context', context_id])
+        context = env.controller_req_socket.recv_pyobj()
+        if context is None:
+            raise RuntimeError(f'Failed to retrieve step context {context_id}')
+        if len(_step_contexts) >= 10:
+            _step_contexts.clear()
+        _step_contexts[context_id] = context
+    return _step_contexts[context_id]
+
+
+def _copy_vars(vars):
+    res = {}
+    for k, v in vars.items():
+        try:
+            res[k] = copy.deepcopy(v)
+        except Exception:
+            # modules etc
+            res[k] = v
+    return res
+
+
+def prepare_substep_env(global_def, proc_vars):
+    '''Prepare a working environment with sos symbols, functions and global
+    definitions. The global definition is executed only once for the substeps
+    of a step executed by the worker, and variables defined by it are restored
+    from a snapshot for each of the other substeps so that changes made by a
+    substep are not seen by the next one.'''
+    global _prepared_env, _prepared_vars
+    key = (proc_vars.get('step_id', None), global_def)
+    if key[0] is not None and key == _prepared_env:
+        env.sos_dict.quick_update(_copy_vars(_prepared_vars))
+        return
+    before = {k: id(v) for k, v in env.sos_dict._dict.items()}
+    prepare_env(global_def, proc_vars)
+    _prepared_env = key
+    _prepared_vars = _copy_vars({k: v for k, v in env.sos_dict._dict.items()
+        if k not in proc_vars and before.get(k, None) != id(v)})
+
+
+def prefetch_signatures(stmt, global_def, task, substeps, shared_vars):
+    '''Retrieve saved signatures of a chunk of substeps in one request. The
+    signatures are identified before the substeps are executed so a substep
+    with a different signature at the time of execution will query its
+    signature individually.'''
+    sig_ids = []
+    prepare_substep_env(global_def, substeps[0])
+    for proc_vars in substeps:
+        env.sos_dict.quick_update(proc_vars)
+        if env.sos_dict['_output'].unspecified() or 'sos_run' in env.sos_dict['__signature_vars__']:
+            continue
+        sig_ids.append(RuntimeInfo(
+            statementMD5([stmt, task]),
+            env.sos_dict['_input'],
+            env.sos_dict['_output'],
+            env.sos_dict['_depends'],
+            env.sos_dict['__signature_vars__'],
+            shared_vars=shared_vars).sig_id)
+    if sig_ids:
+        RuntimeInfo.prefetch(env.sos_dict['step_id'], sig_ids)
+
+
+def execute_substeps(stmt, global_def='', task='', task_params='', context_id=None, substeps=[],
+    shared_vars=[], config={}):
+    '''Execute a chunk of substeps of a step in sequence
+
+    context_id:
+        ID of a step context with variables shared by the substeps, if any
+
+    substeps:
+        A list of proc_vars of substeps, which share the rest of the parameters
+        of execute_substep. proc_vars of the substeps contain only variables that
+        are not in, or differ from those in, the step context.
+
+    The result of each substep is sent back as soon as the substep is completed,
+    with an additional key duration for the time used to execute the substep.
+    '''
     assert not env.zmq_context.closed
     assert not env.controller_push_socket.closed
     assert not env.controller_req_socket.closed
     assert not env.signature_push_socket.closed
     assert not env.signature_req_socket.closed
-    assert 'workflow_id' in proc_vars
-    assert 'step_id' in proc_vars
-    assert '_input' in proc_vars
-    assert '_output' in proc_vars
-    assert '_depends' in proc_vars
-    assert 'step_output' in proc_vars
-    assert '_index' in proc_vars
     assert 'result_push_socket' in config["sockets"]
 
+    res_socket = env.zmq_context.socket(zmq.PUSH)
+    step_id = None
     try:
-        res_socket = env.zmq_context.socket(zmq.PUSH)
         res_socket.connect(f'tcp://127.0.0.1:{config["sockets"]["result_push_socket"]}')
-        res = _execute_substep(stmt=stmt, global_def=global_def, task=task,
-            task_params=task_params, proc_vars=proc_vars,
-            shared_vars=shared_vars, config=config)
-        res_socket.send_pyobj(res)
+        try:
+            context = None if context_id is None else get_step_context(context_id)
+        except Exception as e:
+            # return the error as the results of all substeps so that the step
+            # does not wait for them
+            for proc_vars in substeps:
+                res_socket.send_pyobj({'index': proc_vars['_index'], 'ret_code': 1,
+                    'exception': e})
+            return
+        env.config.update(config)
+        if len(substeps) > 1 and env.config['sig_mode'] in ('default', 'assert'):
+            step_vars = {} if context is None else pickle.loads(context)
+            step_id = dict(step_vars, **substeps[0])['step_id']
+            try:
+                prefetch_signatures(stmt, global_def, task,
+                    [dict(step_vars, **x) for x in substeps], shared_vars)
+            except Exception as e:
+                env.logger.debug(f'Failed to prefetch signatures of substeps: {e}')
+        for proc_vars in substeps:
+            if context is not None:
+                # a fresh copy of the context for each substep
+                proc_vars = dict(pickle.loads(context), **proc_vars)
+            assert 'workflow_id' in proc_vars
+            assert 'step_id' in proc_vars
+            assert '_input' in proc_vars
+            assert '_output' in proc_vars
+            assert '_depends' in proc_vars
+            assert 'step_output' in proc_vars
+            assert '_index' in proc_vars
+            start_time = time.time()
+            res = _execute_substep(stmt=stmt, global_def=global_def, task=task,
+                task_params=task_params, proc_vars=proc_vars,
+                shared_vars=shared_vars, config=config)
+            res['duration'] = time.time() - start_time
+            res_socket.send_pyobj(res)
     finally:
+        if step_id is not None:
+            RuntimeInfo.clear_prefetched(step_id)
         res_socket.close()
 
 def _execute_substep(stmt, global_def, task, task_params, proc_vars, shared_vars, config):
     # passing configuration and port numbers to the subprocess
     env.config.update(config)
     # prepare a working environment with sos symbols and functions
-    prepare_env(global_def, proc_vars)
+    prepare_substep_env(global_def, proc_vars)
     # update it with variables passed from master process
     env.sos_dict.quick_update(proc_vars)
     if env.config['sig_mode'] == 'ignore' or env.sos_dict['_output'].unspecified():
@@ -126,7 +251,7 @@ def _execute_substep(stmt, global_def, task, task_params, proc_vars, shared_vars
                 # avoid sig being released in the final statement
                 sig = None
                 # complete case: concurrent ignore without task
-                env.controller_push_socket.send_pyobj(['progress', 'substep_ignored', env.sos_dict['step_id']])
+                send_message(env.controller_push_socket, ['progress', 'substep_ignored', env.sos_dict['step_id']])
                 res = {'index': env.sos_dict['_index'], 'ret_code': 0, 'sig_skipped': 1,
                     'output': matched['output'], 'shared': matched['vars']}
                 if task:
@@ -172,7 +297,7 @@ def _execute_substep(stmt, global_def, task, task_params, proc_vars, shared_vars
             if capture_output:
                 res.update({'stdout': outmsg, 'stderr': errmsg})
             # complete case: concurrent execution without task
-            env.controller_push_socket.send_pyobj(['progress', 'substep_completed', env.sos_dict['step_id']])
+            send_message(env.controller_push_socket, ['progress', 'substep_completed', env.sos_dict['step_id']])
         return res
     except (StopInputGroup, TerminateExecution, UnknownTarget, RemovedTarget, UnavailableLock) as e:
         # stop_if is not considered as an error
@@ -24,12 +24,28 @@ import pkg_resources
 from .utils import (Error, env, pickleable, short_repr, stable_repr)
 from .pattern import extract_pattern
 from .eval import interpolate
+from .messages import send_message
+from .signatures import file_signatures, hash_cache
 
 try:
     from xxhash import xxh64 as hash_md5
 except ImportError:
     from hashlib import md5 as hash_md5
 
+import hashlib
+hash_algorithms = {'md5': hashlib.md5, 'blake2b': hashlib.blake2b}
+try:
+    import xxhash
+    hash_algorithms['xxh64'] = xxhash.xxh64
+    if hasattr(xxhash, 'xxh3_128'):
+        hash_algorithms['xxh3_128'] = xxhash.xxh3_128
+except ImportError:
+    pass
+default_hash_algorithm = 'xxh64' if 'xxh64' in hash_algorithms else 'md5'
+# full: the entire file, partial: first and last 8M, sampled: 16 blocks of 1M
+# evenly distributed in the file, stat: mtime and size without reading the file
+signature_strategies = ('full', 'partial', 'sampled', 'stat')
+
 
 __all__ = ['dynamic', 'executable', 'env_variable', 'sos_variable']
 
@@ -98,42 +114,128 @@ def objectMD5(obj):
         return ''
 
 
-def fileMD5(filename, partial=True):
+def _update_md5(md5, f, view, size):
+    # read up to size bytes from f into a reused buffer and update md5
+    block_size = len(view)
+    while size > 0:
+        n = f.readinto(view[:min(block_size, size)])
+        if not n:
+            break
+        md5.update(view[:n])
+        size -= n
+
+
+def fileMD5(filename, partial=True, algorithm=None, strategy=None):
     '''Calculate partial MD5, basically the first and last 8M
     of the file for large files. This should signicicantly reduce
     the time spent on the creation and comparison of file signature
-    when dealing with large bioinformat ics datasets. '''
-    filesize = os.path.getsize(filename)
+    when dealing with large bioinformat ics datasets. A hash algorithm
+    other than the default one, and a strategy (full, partial, or sampled)
+    that overrides partial can be specified.'''
+    if strategy is None:
+        strategy = 'partial' if partial else 'full'
+    if strategy not in ('full', 'partial', 'sampled'):
+        raise ValueError(f'Cannot calculate md5 of {filename} with strategy {strategy}')
+    if algorithm is None:
+        algorithm = default_hash_algorithm
+    elif algorithm not in hash_algorithms:
+        raise ValueError(f'Unsupported hash algorithm {algorithm}: {", ".join(hash_algorithms.keys())} expected.')
+    st = os.stat(filename)
+    filesize = st.st_size
+    method = f'{algorithm}-{strategy}'
+    cached = hash_cache().get(st, method)
+    if cached:
+        return cached
     # calculate md5 for specified file
-    md5 = hash_md5()
-    block_size = 2**20  # buffer of 1M
+    md5 = hash_algorithms[algorithm]()
+    # data is read into a buffer of 1M that is reused for all blocks
+    view = memoryview(bytearray(2**20))
     try:
-        # 2**24 = 16M
-        if (not partial) or filesize < 2**24:
-            with open(filename, 'rb') as f:
-                while True:
-                    data = f.read(block_size)
-                    if not data:
-                        break
-                    md5.update(data)
-        else:
-            count = 16
-            # otherwise, use the first and last 8M
-            with open(filename, 'rb') as f:
-                while True:
-                    data = f.read(block_size)
-                    count -= 1
-                    if count == 8:
-                        # 2**23 = 8M
-                        f.seek(-2**23, 2)
-                    if not data or count == 0:
-                        break
-                    md5.update(data)
+        with open(filename, 'rb', buffering=0) as f:
+            # 2**24 = 16M
+            if strategy == 'full' or filesize < 2**24:
+                _update_md5(md5, f, view, filesize)
+            elif strategy == 'partial':
+                # otherwise, use the first 8M and 7M starting from the last 8M,
+                # which is what previous versions of SoS have been using
+                _update_md5(md5, f, view, 2**23)
+                f.seek(-2**23, 2)
+                _update_md5(md5, f, view, 2**23 - 2**20)
+            else:
+                # 16 blocks of 1M from the beginning to the end of the file
+                md5.update(str(filesize).encode())
+                for i in range(16):
+                    f.seek(i * (filesize - 2**20) // 15)
+                    _update_md5(md5, f, view, 2**20)
     except IOError as e:
-        sys.exit(f'Failed to read {filename}: {e}')
+        # not sys.exit because files are also hashed by threads of filesMD5
+        raise IOError(f'Failed to read {filename}: {e}')
+    hash_cache().set(st, method, md5.hexdigest())
     return md5.hexdigest()
 
 
+def filesMD5(filenames, partial=True, algorithm=None, strategy=None, max_workers=8):
+    '''Calculate MD5 of multiple files concurrently. hashlib and xxhash
+    release the GIL while hashing so files can be processed by a pool of
+    threads. Return a list of md5 in the order of filenames.'''
+    filenames = list(filenames)
+    if len(filenames) <= 1 or max_workers <= 1:
+        return [fileMD5(x, partial, algorithm, strategy) for x in filenames]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(filenames))) as executor:
+        return list(executor.map(lambda x: fileMD5(x, partial, algorithm, strategy), filenames))
+
+
+def signature_policy(policy=None):
+    '''Return hash algorithm and strategy for file signatures from a policy,
+    which can be a dictionary with keys algorithm and strategy, or a string
+    in the format of "algorithm", "strategy", or "algorithm:strategy". If
+    no policy is specified, the policy defined by option sos.signature
+    in the config file (~/.sos/config.yml) is used.'''
+    if policy is None:
+        policy = env.sos_dict.get('CONFIG', {}).get('sos', {}).get('signature', None)
+    algorithm = default_hash_algorithm
+    strategy = 'partial'
+    if policy is None:
+        return algorithm, strategy
+    if isinstance(policy, dict):
+        algorithm = policy.get('algorithm', algorithm)
+        strategy = policy.get('strategy', strategy)
+    elif isinstance(policy, str):
+        for item in policy.split(':'):
+            if item in signature_strategies:
+                strategy = item
+            else:
+                algorithm = item
+    else:
+        raise ValueError(f'Invalid signature policy {policy}: a string or dictionary is expected.')
+    if algorithm not in hash_algorithms:
+        raise ValueError(f'Unsupported hash algorithm {algorithm}: {", ".join(hash_algorithms.keys())} expected.')
+    if strategy not in signature_strategies:
+        raise ValueError(f'Unsupported signature strategy {strategy}: {", ".join(signature_strategies)} expected.')
+    return algorithm, strategy
+
+
+def encode_md5(md5, algorithm, strategy):
+    '''md5 saved in signatures, which records the algorithm and strategy
+    if they differ from the default ones.'''
+    if strategy == 'stat':
+        return 'stat'
+    if algorithm == default_hash_algorithm and strategy == 'partial':
+        return md5
+    return f'{algorithm}:{strategy}:{md5}'
+
+
+def decode_md5(md5):
+    '''Return md5, algorithm and strategy from md5 saved in signatures'''
+    if md5 == 'stat':
+        return None, None, 'stat'
+    if md5.count(':') == 2:
+        algorithm, strategy, md5 = md5.split(':')
+        return md5, algorithm, strategy
+    return md5, default_hash_algorithm, 'partial'
+
+
 class BaseTarget(object):
     '''A base class for all targets (e.g. a file)'''
 
@@ -612,7 +714,7 @@ class file_target(path, BaseTarget):
         # create an empty placeholder file
         env.logger.debug(f'Create placeholder target {self}')
         self.touch()
-        env.signature_push_socket.send_pyobj(['workflow', 'placeholder', 'file_target', str(self)])
+        send_message(env.signature_push_socket, ['workflow', 'placeholder', 'file_target', str(self)])
 
     def target_exists(self, mode='any'):
         try:
@@ -645,7 +747,12 @@ class file_target(path, BaseTarget):
         '''Return file signature'''
         if self.exists():
             if not self._md5:
-                self._md5 = fileMD5(self)
+                algorithm, strategy = self.signature_policy()
+                if strategy == 'stat':
+                    self._md5 = 'stat'
+                else:
+                    self._md5 = encode_md5(fileMD5(self, algorithm=algorithm, strategy=strategy),
+                        algorithm, strategy)
             return (os.path.getmtime(self), os.path.getsize(self), self._md5)
         elif (self + '.zapped').is_file():
             with open(self + '.zapped') as sig:
@@ -656,19 +763,22 @@ class file_target(path, BaseTarget):
         else:
             raise ValueError(f'{self} does not exist.')
 
-    def sig_file(self):
-        return os.path.join(env.exec_dir, '.sos', f'{textMD5(str(self.resolve()))}.file_info')
+    def signature_policy(self):
+        '''Hash algorithm and strategy used to create signature of this
+        target, which can be specified as property "signature" of the target,
+        as option "signature" of the step, or in the config file.'''
+        policy = self.get('signature', None)
+        if policy is None:
+            policy = env.sos_dict.get('__signature_policy__', None)
+        return signature_policy(policy)
 
     def validate(self, sig=None):
         '''Check if file matches its signature'''
-        if sig is not None:
-            sig_mtime, sig_size, sig_md5 = sig
-        else:
-            try:
-                with open(self.sig_file()) as sig:
-                    sig_mtime, sig_size, sig_md5 = sig.read().strip().split()
-            except:
+        if sig is None:
+            sig = file_signatures().get(str(self.resolve()))
+            if sig is None:
                 return False
+        sig_mtime, sig_size, sig_md5 = sig
         if not self.exists():
             if (self + '.zapped').is_file():
                 with open(self + '.zapped') as sig:
@@ -679,14 +789,15 @@ class file_target(path, BaseTarget):
                 return False
         if sig_mtime == os.path.getmtime(self) and sig_size == os.path.getsize(self):
             return True
-        return fileMD5(self) == sig_md5
+        # signature might have been created with a different policy
+        md5, algorithm, strategy = decode_md5(sig_md5)
+        if strategy == 'stat':
+            return False
+        return fileMD5(self, algorithm=algorithm, strategy=strategy) == md5
 
     def write_sig(self):
         '''Write signature to sig store'''
-        if not self._md5:
-            self._md5 = fileMD5(self)
-        with open(self.sig_file(), 'w') as sig:
-            sig.write(f'{os.path.getmtime(self)}\t{os.path.getsize(self)}\t{self._md5}')
+        file_signatures().set(str(self.resolve()), *self.target_signature())
 
     def __hash__(self):
         return hash(repr(self))
@@ -1054,6 +1165,11 @@ class sos_targets(BaseTarget, Sequence, os.PathLike):
             else:
                 env.logger.debug(f'Ignore non-file target {target}')
 
+    def write_sig(self):
+        '''Write signatures of all file targets in a single transaction'''
+        file_signatures().set_many({str(x.resolve()): x.target_signature()
+            for x in self._targets if isinstance(x, file_target)})
+
     def __getstate__(self):
         return (self._targets, self._labels, self._undetermined, self._groups,
             self._dict)
@@ -1729,6 +1845,25 @@ class InMemorySignature:
             self.output_files = env.sos_dict['_output']
             env.logger.trace(
                 f'Set undetermined output files to {env.sos_dict["_output"]}')
+        # calculate md5 of all files in one batch so that they can be
+        # hashed concurrently
+        unhashed = {}
+        for f in self.input_files._targets + self.output_files._targets + self.dependent_files._targets:
+            if isinstance(f, file_target) and not f._md5 and f.exists():
+                policy = f.signature_policy()
+                if policy[1] != 'stat':
+                    unhashed.setdefault(policy, {}).setdefault(str(f.resolve()), []).append(f)
+        for (algorithm, strategy), files in unhashed.items():
+            try:
+                md5s = filesMD5(files.keys(), algorithm=algorithm, strategy=strategy)
+            except Exception as e:
+                # files can be removed by another process after they are checked,
+                # in which case signatures of the files are created one by one below
+                env.logger.debug(f'Failed to calculate md5 of {short_repr(list(files.keys()))}: {e}')
+                continue
+            for md5, targets in zip(md5s, files.values()):
+                for f in targets:
+                    f._md5 = encode_md5(md5, algorithm, strategy)
         input_sig = {}
         for f in self.input_files:
             try:
@@ -1856,6 +1991,10 @@ class RuntimeInfo(InMemorySignature):
     .exe_info files are used.
     '''
 
+    # signatures retrieved by prefetch(), indexed by step_id and sig_id, with
+    # None for substeps without saved signature
+    _prefetched = {}
+
     def __init__(self, step_md5: str, input_files: sos_targets, output_files: sos_targets,
                  dependent_files: sos_targets, signature_vars: set=set(), sdict: dict={},
                  shared_vars: list=[]):
@@ -1889,6 +2028,24 @@ class RuntimeInfo(InMemorySignature):
         self.init_signature = sdict['init_signature']
         self.sig_id = sdict['sig_id']
 
+    @classmethod
+    def prefetch(cls, step_id: str, sig_ids: list):
+        '''Retrieve signatures of substeps of step step_id with specified
+        sig_ids in one request so that validate() does not have to query the
+        signature database for each substep. Prefetched signatures should be
+        removed with clear_prefetched() after the substeps are executed.'''
+        env.signature_req_socket.send_pyobj(['step', 'get_many', sig_ids])
+        sigs = env.signature_req_socket.recv_pyobj()
+        # if the request failed, validate() will query signatures one by one
+        if sigs is not None:
+            cls._prefetched.setdefault(step_id, {}).update(
+                {x: sigs.get(x, None) for x in sig_ids})
+            env.logger.trace(f'{len(sigs)} of {len(sig_ids)} substep signatures prefetched')
+
+    @classmethod
+    def clear_prefetched(cls, step_id: str):
+        cls._prefetched.pop(step_id, None)
+
     def lock(self):
         # we will need to lock on a file that we do not really write to
         # otherwise the lock will be broken when we write to it.
@@ -1937,12 +2094,12 @@ class RuntimeInfo(InMemorySignature):
         if ret is False:
             env.logger.debug(f'Failed to write signature {self.sig_id}')
             return ret
-        env.signature_push_socket.send_pyobj(['step', self.sig_id, ret])
-        env.signature_push_socket.send_pyobj(['workflow', 'tracked_files', self.sig_id, repr({
+        send_message(env.signature_push_socket, ['step', self.sig_id, ret])
+        send_message(env.signature_push_socket, ['workflow', 'tracked_files', self.sig_id, {
             'input_files': [str(f.resolve()) for f in self.input_files if isinstance(f, file_target)],
             'dependent_files': [str(f.resolve()) for f in self.dependent_files if isinstance(f, file_target)],
             'output_files': [str(f.resolve()) for f in self.output_files if isinstance(f, file_target)]
-            })])
+            }])
         return True
 
     def validate(self):
@@ -1956,8 +2113,12 @@ class RuntimeInfo(InMemorySignature):
             if not x.target_exists('any'):
                 return f'Missing target {x}'
         #
-        env.signature_req_socket.send_pyobj(['step', 'get', self.sig_id])
-        sig = env.signature_req_socket.recv_pyobj()
+        prefetched = RuntimeInfo._prefetched.get(env.sos_dict.get('step_id', None), {})
+        if self.sig_id in prefetched:
+            sig = prefetched.pop(self.sig_id)
+        else:
+            env.signature_req_socket.send_pyobj(['step', 'get', self.sig_id])
+            sig = env.signature_req_socket.recv_pyobj()
         if not sig:
             return f"No signature found for {self.sig_id}"
         return super(RuntimeInfo, self).validate(sig)
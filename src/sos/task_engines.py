@@ -6,14 +6,116 @@ import concurrent.futures
 import copy
 import os
 import random
+import re
+import select
+import statistics
+import struct
 import subprocess
 import threading
 import time
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, deque
 
 from .eval import cfg_interpolate
 from .utils import env, expand_time
-from .tasks import TaskFile
+from .tasks import TaskFile, TaskStatus
+
+
+class TaskStatusWatcher(threading.Thread):
+    '''Watch changes to .task and .pulse files under ~/.sos/tasks with inotify
+    and pass IDs of changed tasks to a callback function. inotify is accessed
+    directly from libc so the watcher is only available under Linux, and
+    create() returns None if inotify cannot be used. The inotify file
+    descriptor is closed when the watcher is stopped with stop().'''
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    # struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+    event_fmt = 'iIII'
+    event_size = struct.calcsize(event_fmt)
+
+    def __init__(self, fd, callback):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._fd = fd
+        self.callback = callback
+        # a pipe to wake up the watcher when it is stopped
+        self._stop_fds = os.pipe()
+        self._fd_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, callback, task_dir=None):
+        if task_dir is None:
+            task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1')
+            if libc.inotify_add_watch(fd, task_dir.encode(),
+                    cls.IN_CLOSE_WRITE | cls.IN_MOVED_TO | cls.IN_CREATE | cls.IN_DELETE) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch')
+        except Exception as e:
+            env.logger.debug(f'Changes to task files will not be watched: {e}')
+            return None
+        return cls(fd, callback)
+
+    def stop(self):
+        '''Stop watching task files. The file descriptors are closed by the
+        watcher thread, or here if the thread is not running.'''
+        with self._fd_lock:
+            if self._fd is None:
+                return
+            if self.is_alive():
+                os.write(self._stop_fds[1], b'\0')
+                return
+        self._close()
+
+    def _close(self):
+        with self._fd_lock:
+            if self._fd is None:
+                return
+            for fd in (self._fd, *self._stop_fds):
+                os.close(fd)
+            self._fd = None
+
+    def __del__(self):
+        if hasattr(self, '_fd_lock'):
+            self._close()
+
+    def run(self):
+        try:
+            self._watch()
+        except OSError as e:
+            env.logger.debug(f'Stop watching task files: {e}')
+        finally:
+            self._close()
+
+    def _watch(self):
+        while True:
+            readable, _, _ = select.select([self._fd, self._stop_fds[0]], [], [])
+            if self._stop_fds[0] in readable:
+                return
+            data = os.read(self._fd, 65536)
+            tasks = set()
+            offset = 0
+            while offset + self.event_size <= len(data):
+                _, _, _, length = struct.unpack_from(self.event_fmt, data, offset)
+                offset += self.event_size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors='ignore')
+                offset += length
+                task_id, ext = os.path.splitext(name)
+                if ext in ('.task', '.pulse'):
+                    tasks.add(task_id)
+            if tasks:
+                try:
+                    self.callback(tasks)
+                except Exception as e:
+                    env.logger.debug(f'Failed to check status of changed tasks {tasks}: {e}')
+
 
 class TaskEngine(threading.Thread):
     def __init__(self, agent):
@@ -44,6 +146,17 @@ class TaskEngine(threading.Thread):
             self.status_check_interval = 10
         else:
             self.status_check_interval = self.config['status_check_interval']
+        # the interval is doubled after each status check that does not see
+        # any change, up to max_status_check_interval, and is reset when the
+        # status of any task changes.
+        self.max_status_check_interval = self.config.get('max_status_check_interval',
+            8 * self.status_check_interval)
+        self._status_check_interval = self.status_check_interval
+        # durations of recently completed tasks, used to check sooner if
+        # running tasks are expected to complete before the next check
+        self._task_durations = deque(maxlen=100)
+        # number of tasks queried by each status query
+        self.status_query_size = self.config.get('status_query_size', 200)
         #
         if env.config['max_running_jobs'] is not None:
             # override from command line
@@ -55,15 +168,24 @@ class TaskEngine(threading.Thread):
             # default
             self.max_running_jobs = max(os.cpu_count() // 2, 1)
         #
-        # multiple thread job submission does not work because the threads share the
-        # same namespace with variables such as sos_dict. Variables changed by
-        # one thread can be changed again by another thread, which makes it unsafe
-        # to submit jobs this way. Multi-processing is possible but that can be done
-        # later.
+        # task preparation and submission only read task files and the host
+        # configuration so tasks can be submitted from multiple threads.
+        # Status checks use their own worker so that they are not delayed by
+        # a long queue of tasks being submitted.
         #
+        self.submission_workers = self.config.get('submission_workers',
+            min(self.max_running_jobs, 8))
+        self._submission_workers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(self.submission_workers, 1))
         self._thread_workers = concurrent.futures.ThreadPoolExecutor(
             max_workers=1)
+        self._lock = threading.RLock()
         self._status_checker = None
+        self._status_watcher = None
+        self._stopped = False
+        # set when there is something for the engine to do, namely new or
+        # killed tasks, completion of task submission or status check.
+        self._wakeup_event = threading.Event()
         #
         if 'wait_for_task' in self.config:
             self.wait_for_task = self.config['wait_for_task']
@@ -75,6 +197,9 @@ class TaskEngine(threading.Thread):
         # allows stacking of up to 1000 tasks, but PBS queue does not
         # allow stacking.
         self.batch_size = 1
+        # if tasks are spread to max_running_jobs batches (default), or are
+        # submitted in batches of batch_size tasks
+        self.fill_batches = False
 
     def notify_controller(self, msg):
         if env.config['exec_mode']:
@@ -94,11 +219,12 @@ class TaskEngine(threading.Thread):
             tasks = [x for x in tasks if x in self.task_status]
 
         # we only monitor running tasks
-        with threading.Lock():
+        with self._lock:
             for task in tasks:
                 if self.task_status[task] in ('submitted', 'running') and task not in self.running_tasks:
                     # these tasks will be actively monitored
                     self.running_tasks.append(task)
+        self._wakeup_event.set()
         #
         if age is not None:
             age = expand_time(age, default_unit='d')
@@ -110,7 +236,7 @@ class TaskEngine(threading.Thread):
                       key=lambda x: -x[2][0])
 
     def get_tasks(self):
-        with threading.Lock():
+        with self._lock:
             pending = copy.deepcopy(
                 self.pending_tasks + list(self.submitting_tasks.keys()))
             running = copy.deepcopy(self.running_tasks)
@@ -121,7 +247,7 @@ class TaskEngine(threading.Thread):
         # this will be run only once when the task engine starts
         status_output = self.query_tasks(
             check_all=True, verbosity=3, numeric_times=True)
-        with threading.Lock():
+        with self._lock:
             for line in status_output.split('\n'):
                 if not line.strip():
                     continue
@@ -137,21 +263,47 @@ class TaskEngine(threading.Thread):
                     env.logger.warning(
                         f'Unrecognized response "{line}" ({e.__class__.__name__}): {e}')
         self._last_status_check = time.time()
+        # if tasks are executed with the local ~/.sos/tasks, changes to task
+        # files are pushed to the engine so tasks are updated as soon as their
+        # status changes. Polling continues at status_check_interval for
+        # tasks that stop without changing their task files.
+        from .hosts import LocalHost
+        if self.config.get('watch_task_files', isinstance(self.agent, LocalHost)):
+            self._status_watcher = TaskStatusWatcher.create(self._task_files_changed)
+            if self._status_watcher is not None:
+                self._status_watcher.start()
         self.engine_ready.set()
-        while True:
-            # if no new task, does not do anything.
-            if self.running_tasks and time.time() - self._last_status_check > self.status_check_interval:
-                if self._status_checker is None:
-                    self._status_checker = self._thread_workers.submit(
-                        self.query_tasks, self.running_tasks, check_all=False,
-                        verbosity=3, numeric_times=True)
-                    continue
-                elif self._status_checker.running():
-                    time.sleep(0.01)
-                    continue
-                else:
-                    status_output = self._status_checker.result()
-                    self._status_checker = None
+        try:
+            self._run()
+        finally:
+            if self._status_watcher is not None:
+                self._status_watcher.stop()
+            self._submission_workers.shutdown(wait=False)
+            self._thread_workers.shutdown(wait=False)
+
+    def stop(self):
+        '''Stop the engine, which stops watching task files and stops the
+        threads that submit tasks and check status of tasks.'''
+        self._stopped = True
+        self._wakeup_event.set()
+
+    def __del__(self):
+        if getattr(self, '_status_watcher', None) is not None:
+            self._status_watcher.stop()
+
+    def _run(self):
+        while not self._stopped:
+            # sleep until there is something to do, or until the next status
+            # check is due, so that an idle engine does not use any CPU.
+            self._wakeup_event.wait(self._time_to_next_status_check())
+            self._wakeup_event.clear()
+            if self._stopped:
+                break
+
+            if self._status_checker is not None and self._status_checker.done():
+                status_output = self._status_checker.result()
+                self._status_checker = None
+                old_status = {x: self.task_status.get(x, None) for x in self.running_tasks}
                 #
                 for line in status_output.splitlines():
                     if not line.strip():
@@ -172,16 +324,23 @@ class TaskEngine(threading.Thread):
                             f'Unrecognized response "{line}" ({e.__class__.__name__}): {e}')
                 self.summarize_status()
                 self._last_status_check = time.time()
-            else:
-                # if nothing to do, sleep to avoid empty loop. This will reduce CPU usage from 100% to 0.3%
-                # sleeping longer will slightly reduce CPU usage but decrease responsiveness by a bit
-                time.sleep(0.01)
+                if any(self.task_status.get(x, None) != y for x, y in old_status.items()):
+                    self._status_check_interval = self.status_check_interval
+                else:
+                    self._status_check_interval = min(self.max_status_check_interval,
+                        2 * self._status_check_interval)
+            elif self._status_checker is None and self.running_tasks and \
+                    time.time() - self._last_status_check >= self._next_status_check_interval():
+                self._status_checker = self._thread_workers.submit(
+                    self.query_tasks, self.running_tasks, check_all=False,
+                    verbosity=3, numeric_times=True)
+                self._status_checker.add_done_callback(self._wakeup)
 
             if self.submitting_tasks:
-                with threading.Lock():
+                with self._lock:
                     submitted = []
                     for k in self.submitting_tasks:
-                        if not self.submitting_tasks[k].running():
+                        if self.submitting_tasks[k].done():
                             submitted.append(k)
                             if self.submitting_tasks[k].result():
                                 for tid in k:
@@ -196,6 +355,8 @@ class TaskEngine(threading.Thread):
                                         })
                                     else:
                                         self.running_tasks.append(tid)
+                                        # check new tasks more frequently
+                                        self._status_check_interval = self.status_check_interval
                                         self.notify_controller(
                                             {
                                                 'queue': self.agent.alias,
@@ -241,16 +402,24 @@ class TaskEngine(threading.Thread):
                         # randomly spread to tasks, but at most one.
                         slots[sample_slots[i %
                                            self.max_running_jobs]].append(tid)
+                if self.fill_batches:
+                    # submit tasks in as few batches as possible, in the order
+                    # they are queued
+                    assigned = {tid for slot in slots for tid in slot}
+                    tids = [x for x in self.pending_tasks if x in assigned]
+                    slots = [tids[i:i + self.batch_size]
+                             for i in range(0, len(tids), self.batch_size)]
                 for slot in slots:
                     if not slot:
                         continue
                     for tid in slot:
                         env.logger.trace(
                             f'Start submitting {tid} (status: {self.task_status.get(tid, "unknown")})')
-                    self.submitting_tasks[tuple(slot)] = self._thread_workers.submit(
+                    self.submitting_tasks[tuple(slot)] = self._submission_workers.submit(
                         self.execute_tasks, slot)
+                    self.submitting_tasks[tuple(slot)].add_done_callback(self._wakeup)
                 #
-                with threading.Lock():
+                with self._lock:
                     for slot in slots:
                         for tid in slot:
                             self.pending_tasks.remove(tid)
@@ -260,7 +429,7 @@ class TaskEngine(threading.Thread):
         self.engine_ready.wait()
 
         # submit tasks simply add task_id to pending task list
-        with threading.Lock():
+        with self._lock:
             # if already in
             # if task_id in self.running_tasks or task_id in self.pending_tasks:
             #    self.notify_controller('{} ``{}``'.format(task_id, self.task_status[task_id]))
@@ -270,6 +439,7 @@ class TaskEngine(threading.Thread):
             if task_id in self.task_status and self.task_status[task_id]:
                 if self.task_status[task_id] == 'running':
                     self.running_tasks.append(task_id)
+                    self._wakeup_event.set()
                     env.logger.info(f'{task_id} ``already runnng``')
                     self.notify_controller({
                         'queue': self.agent.alias,
@@ -303,6 +473,7 @@ class TaskEngine(threading.Thread):
             if task_id in self.canceled_tasks:
                 self.canceled_tasks.remove(task_id)
             self.task_status[task_id] = 'pending'
+            self._wakeup_event.set()
             try:
                 self.task_info['tid']['tags'] = TaskFile(task_id).tags
             except:
@@ -317,6 +488,58 @@ class TaskEngine(threading.Thread):
             })
             return 'pending'
 
+    def _wakeup(self, future=None):
+        # wake up the engine, also used as callback of futures
+        self._wakeup_event.set()
+
+    def _task_files_changed(self, tasks):
+        # called by the status watcher with IDs of tasks with changed files.
+        # Only status written by task executors are taken from the task
+        # files. Other status such as aborted tasks without pulse are still
+        # determined by regular status checks.
+        with self._lock:
+            tasks = [x for x in tasks if x in self.running_tasks]
+        if not tasks:
+            return
+        for tid, header in TaskFile.read_headers(tasks).items():
+            if header is None:
+                continue
+            status = TaskStatus(header.status).name
+            if status not in ('running', 'completed', 'failed', 'aborted'):
+                continue
+            tags, ct, st, dr = TaskFile(tid).tags_created_start_and_duration(header=header)
+            with self._lock:
+                # the task might have been updated by a status check
+                if tid not in self.running_tasks:
+                    continue
+                self.task_info[tid]['date'] = [None if x == '' else x for x in (ct, st, dr)]
+                self.task_info[tid]['tags'] = tags
+                self.update_task_status(tid, status)
+
+    def _time_to_next_status_check(self):
+        # wait indefinitely if no status check is needed or if a status check
+        # is underway, which will wake up the engine when it is completed
+        if not self.running_tasks or self._status_checker is not None:
+            return None
+        return max(0, self._last_status_check + self._next_status_check_interval() - time.time())
+
+    def _next_status_check_interval(self):
+        interval = self._status_check_interval
+        if interval <= self.status_check_interval or not self._task_durations:
+            return interval
+        # check sooner if a running task is expected to complete, judging from
+        # the median duration of completed tasks, before the next check
+        expected = statistics.median(self._task_durations)
+        now = time.time()
+        for tid in self.running_tasks:
+            start = self.task_info[tid].get('date', [None, None, None])[1]
+            if not start:
+                continue
+            remaining = start + expected - now
+            if remaining >= 0:
+                interval = min(interval, max(self.status_check_interval, remaining))
+        return interval
+
     def summarize_status(self):
         from collections import Counter
         statuses = Counter(self.task_status.values())
@@ -327,7 +550,7 @@ class TaskEngine(threading.Thread):
         # we wait for the engine to start
         self.engine_ready.wait()
         try:
-            with threading.Lock():
+            with self._lock:
                 return self.task_status[task_id]
         except Exception:
             # job not yet submitted
@@ -337,7 +560,7 @@ class TaskEngine(threading.Thread):
         #
         env.logger.trace(f'STATUS {task_id}\t{status}\n')
         #
-        with threading.Lock():
+        with self._lock:
             if task_id in self.canceled_tasks and status != 'aborted':
                 env.logger.debug(
                     f'Task {task_id} is still not killed (status {status})')
@@ -379,6 +602,10 @@ class TaskEngine(threading.Thread):
             # terminal states, remove tasks from task list
             if status in ('completed', 'failed', 'aborted') and task_id in self.running_tasks:
                 self.running_tasks.remove(task_id)
+                duration = self.task_info[task_id].get('date', [None, None, None])[2]
+                if status == 'completed' and duration:
+                    self._task_durations.append(duration)
+        self._wakeup_event.set()
 
     def query_tasks(self, tasks=None, check_all=False, verbosity=1, html=False, numeric_times=False, age=None, tags=None, status=None):
         try:
@@ -387,15 +614,21 @@ class TaskEngine(threading.Thread):
                 workflow_signatures = WorkflowSignatures()
                 tasks = [x for x in workflow_signatures.tasks() if os.path.isfile(
                     os.path.join(os.path.expanduser('~'), '.sos', 'tasks', x + '.task'))]
-            return self.agent.check_output("sos status {} -v {} {} {} {} {} {} {}".format(
-                '' if tasks is None else ' '.join(tasks), verbosity,
+            options = "-v {} {} {} {} {} {} {}".format(verbosity,
                 '--all' if check_all else '',
                 '--html' if html else '',
                 '--numeric-times' if numeric_times else '',
                 f'--age {age}' if age else '',
                 f'--tags {" ".join(tags)}' if tags else '',
                 f'--status {" ".join(status)}' if status else '',
-            ))
+            )
+            if tasks is None or html or len(tasks) <= self.status_query_size:
+                return self.agent.check_output("sos status {} {}".format(
+                    '' if tasks is None else ' '.join(tasks), options))
+            # query a limited number of tasks at a time to avoid long command lines
+            return '\n'.join(self.agent.check_output("sos status {} {}".format(
+                ' '.join(tasks[i:i + self.status_query_size]), options)).rstrip('\n')
+                for i in range(0, len(tasks), self.status_query_size))
         except subprocess.CalledProcessError as e:
             if verbosity >= 3:
                 env.logger.warning(
@@ -410,10 +643,10 @@ class TaskEngine(threading.Thread):
                 list(self.submitting_tasks.keys()) + self.running_tasks
 
         for task in tasks:
-            with threading.Lock():
+            with self._lock:
                 self.task_status[task] = 'aborted'
         for task in tasks:
-            with threading.Lock():
+            with self._lock:
                 if task in self.pending_tasks:
                     self.pending_tasks.remove(task)
                     env.logger.debug(f'Cancel pending task {task}')
@@ -431,6 +664,7 @@ class TaskEngine(threading.Thread):
                     pass
 
         self.canceled_tasks.extend(tasks)
+        self._wakeup_event.set()
         #
         # verbosity cannot be send to underlying command because task engines
         # rely on the output of certain verbosity (-v1) to post kill the jobs
@@ -511,24 +745,28 @@ class BackgroundProcess_TaskEngine(TaskEngine):
 
     def _submit_task_with_template(self, task_ids):
         '''Submit tasks by interpolating a shell script defined in job_template'''
-        runtime = self.config
-        runtime.update({
+        # tasks can be submitted from multiple threads so the host configuration
+        # is copied, and resource options are read from the task files instead
+        # of the shared env.sos_dict
+        config = copy.deepcopy(self.config)
+        config.update({
             'cur_dir': os.getcwd(),
             'verbosity': env.verbosity,
             'sig_mode': env.config.get('sig_mode', 'default'),
             'run_mode': env.config.get('run_mode', 'run'),
             'home_dir': os.path.expanduser('~')})
-        if '_runtime' in env.sos_dict:
-            runtime.update({x: env.sos_dict['_runtime'][x] for x in (
-                'nodes', 'cores', 'mem', 'walltime') if x in env.sos_dict['_runtime']})
-        if 'nodes' not in runtime:
-            runtime['nodes'] = 1
-        if 'cores' not in runtime:
-            runtime['cores'] = 1
 
         # let us first prepare a task file
         job_text = ''
         for task_id in task_ids:
+            runtime = copy.copy(config)
+            task_runtime = TaskFile(task_id).params.sos_dict['_runtime']
+            runtime.update({x: task_runtime[x] for x in (
+                'nodes', 'cores', 'mem', 'walltime') if x in task_runtime})
+            if 'nodes' not in runtime:
+                runtime['nodes'] = 1
+            if 'cores' not in runtime:
+                runtime['cores'] = 1
             runtime['task'] = task_id
             try:
                 job_text += cfg_interpolate(self.job_template, runtime)
@@ -556,3 +794,170 @@ class BackgroundProcess_TaskEngine(TaskEngine):
         except Exception as e:
             raise RuntimeError(f'Failed to submit task {task_ids}: {e}')
         return True
+
+
+class ArrayJob_TaskEngine(TaskEngine):
+    '''A task engine that submits batches of tasks as array jobs of cluster
+    schedulers (e.g. --array of Slurm and -t of PBS/Torque). The job_template
+    is interpolated once for each batch with variables tasks (IDs of tasks
+    separated by space), num_tasks, and the largest nodes, cores, mem and
+    walltime requested by the tasks, and should execute the task at the
+    index of the array element, e.g.
+
+        #SBATCH --array=0-{num_tasks - 1}
+        TASKS=({tasks})
+        sos execute ${{TASKS[$SLURM_ARRAY_TASK_ID]}} -v {verbosity} -s {sig_mode}
+
+    The default submit_cmd, submit_cmd_output, status_cmd, kill_cmd and
+    array_element are for Slurm.
+    '''
+
+    def __init__(self, agent):
+        super(ArrayJob_TaskEngine, self).__init__(agent)
+        if 'job_template' not in self.config:
+            raise ValueError(
+                f'A job_template is required to submit array jobs to {self.alias}')
+        self.job_template = self.config['job_template'].replace('\r\n', '\n')
+        self.submit_cmd = self.config.get('submit_cmd', 'sbatch {job_file}')
+        self.submit_cmd_output = self.config.get(
+            'submit_cmd_output', 'Submitted batch job {job_id}')
+        self.status_cmd = self.config.get(
+            'status_cmd', 'squeue -h -r -o "%i %T" -j {job_ids}')
+        self.kill_cmd = self.config.get('kill_cmd', 'scancel {elements}')
+        # how array elements are named in the output of status_cmd
+        self.array_element = self.config.get('array_element', '{job_id}_{index}')
+        self.batch_size = self.config.get('batch_size', 100)
+        self.fill_batches = True
+        # task_id -> (job_id, array element)
+        self._array_elements = {}
+
+    def execute_tasks(self, task_ids):
+        if not super(ArrayJob_TaskEngine, self).execute_tasks(task_ids):
+            env.logger.trace(f'Failed to prepare task {task_ids}')
+            return False
+        try:
+            job_id = self._submit_array_job(task_ids)
+        except Exception as e:
+            env.logger.error(e)
+            return False
+        with self._lock:
+            for idx, task_id in enumerate(task_ids):
+                self._array_elements[task_id] = (job_id,
+                    self.array_element.format(job_id=job_id, index=idx))
+        env.logger.debug(
+            f'{len(task_ids)} tasks are submitted as array job {job_id}')
+        return True
+
+    def _submit_array_job(self, task_ids):
+        runtime = copy.deepcopy(self.config)
+        runtime.update({
+            'cur_dir': os.getcwd(),
+            'verbosity': env.verbosity,
+            'sig_mode': env.config.get('sig_mode', 'default'),
+            'run_mode': env.config.get('run_mode', 'run'),
+            'home_dir': os.path.expanduser('~'),
+            'tasks': ' '.join(task_ids),
+            'num_tasks': len(task_ids),
+            'nodes': 1,
+            'cores': 1})
+        # all elements of an array job request the same resources
+        for task_id in task_ids:
+            task_runtime = TaskFile(task_id).params.sos_dict['_runtime']
+            for key in ('nodes', 'cores', 'mem'):
+                if task_runtime.get(key, None) is not None and \
+                        (key not in runtime or runtime[key] < task_runtime[key]):
+                    runtime[key] = task_runtime[key]
+            if task_runtime.get('walltime', None) is not None and ('walltime' not in runtime or
+                    expand_time(runtime['walltime']) < expand_time(task_runtime['walltime'])):
+                runtime['walltime'] = task_runtime['walltime']
+        try:
+            job_text = cfg_interpolate(self.job_template, runtime)
+        except Exception as e:
+            raise ValueError(
+                f'Failed to generate job file for tasks {task_ids}: {e}')
+
+        filename = task_ids[0] + ('.sh' if len(task_ids)
+                                  == 1 else f'-{task_ids[-1]}.sh')
+        job_file = os.path.join(os.path.expanduser(
+            '~'), '.sos', 'tasks', filename)
+        with open(job_file, 'w', newline='') as job:
+            job.write(job_text)
+        self.agent.send_task_file(job_file)
+
+        cmd = cfg_interpolate(self.submit_cmd, {'job_file': f'~/.sos/tasks/{filename}',
+            'num_tasks': len(task_ids)})
+        try:
+            output = self.agent.check_output(cmd)
+        except Exception as e:
+            raise RuntimeError(f'Failed to submit tasks {task_ids}: {e}')
+        pattern = re.escape(self.submit_cmd_output).replace(
+            re.escape('{job_id}'), r'(?P<job_id>\S+)')
+        matched = re.search(pattern, output)
+        if not matched:
+            raise RuntimeError(
+                f'Failed to obtain job id of tasks {task_ids} from output "{output.strip()}" of command "{cmd}"')
+        return matched.group('job_id')
+
+    def update_task_status(self, task_id, status):
+        super(ArrayJob_TaskEngine, self).update_task_status(task_id, status)
+        # array elements of tasks that are no longer active are not queried
+        # or canceled, so they are removed to keep the map from growing with
+        # all tasks ever submitted by the engine
+        if status in ('completed', 'failed', 'aborted'):
+            with self._lock:
+                self._array_elements.pop(task_id, None)
+
+    def _query_array_elements(self, tasks):
+        # returns array elements known to the scheduler, or None if the
+        # scheduler cannot be queried
+        job_ids = sorted({self._array_elements[x][0] for x in tasks if x in self._array_elements})
+        if not job_ids:
+            return None
+        cmd = cfg_interpolate(self.status_cmd, {'job_ids': ','.join(job_ids)})
+        try:
+            output = self.agent.check_output(cmd)
+        except Exception as e:
+            env.logger.debug(f'Failed to query status of array jobs {job_ids}: {e}')
+            return None
+        elements = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if fields:
+                elements[fields[0]] = fields[1] if len(fields) > 1 else ''
+        return elements
+
+    def query_tasks(self, tasks=None, check_all=False, verbosity=1, html=False, numeric_times=False, age=None, tags=None, status=None):
+        # the scheduler is queried before the task files so that a task that
+        # is still waiting after its array element disappeared is known to have
+        # been removed from the scheduler without being executed.
+        elements = None if html or not tasks else self._query_array_elements(tasks)
+        output = super(ArrayJob_TaskEngine, self).query_tasks(tasks, check_all=check_all,
+            verbosity=verbosity, html=html, numeric_times=numeric_times, age=age,
+            tags=tags, status=status)
+        if elements is None:
+            return output
+        lines = []
+        for line in output.splitlines():
+            fields = line.split('\t')
+            if len(fields) > 1 and fields[0] in self._array_elements and \
+                    fields[-1].strip() in ('pending', 'submitted') and \
+                    self._array_elements[fields[0]][1] not in elements:
+                env.logger.debug(
+                    f'{fields[0]} is aborted because array element {self._array_elements[fields[0]][1]} no longer exists')
+                fields[-1] = 'aborted'
+            lines.append('\t'.join(fields))
+        return '\n'.join(lines)
+
+    def kill_tasks(self, tasks, tags=None, all_tasks=False):
+        # cancel array elements of tasks that are not yet completed before
+        # killing the tasks that are being executed
+        elements = [self._array_elements[x][1] for x in (self._array_elements if all_tasks else tasks)
+                    if x in self._array_elements and
+                    self.task_status.get(x, None) not in ('completed', 'failed', 'aborted')]
+        if elements:
+            cmd = cfg_interpolate(self.kill_cmd, {'elements': ' '.join(elements)})
+            try:
+                self.agent.check_output(cmd)
+            except Exception as e:
+                env.logger.warning(f'Failed to cancel array elements {" ".join(elements)}: {e}')
+        return super(ArrayJob_TaskEngine, self).kill_tasks(tasks, tags=tags, all_tasks=all_tasks)
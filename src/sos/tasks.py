@@ -3,18 +3,21 @@
 # Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
 # Distributed under the terms of the 3-clause BSD License.
 import copy
+import json
 import os
 import fasteners
 import pickle
 import time
 import lzma
 import stat
+import sqlite3
 import struct
+import threading
 from enum import Enum
 from collections import namedtuple
 from datetime import datetime
 
-from typing import Union, Dict
+from typing import Union, Dict, Optional, List
 
 from .utils import (env, expand_time, linecount_of_file, sample_lines,
                     short_repr, tail_of_file, expand_size, format_HHMMSS,
@@ -297,24 +300,51 @@ class TaskFile(object):
             with open(self.task_file, 'r+b') as fh:
                 self._reset(fh)
 
-    def _read_header(self, fh):
-        fh.seek(0, 0)
-        data = fh.read(self.header_size)
+    @classmethod
+    def _parse_header(cls, data, task_file):
         if struct.unpack('!h', data[:2])[0] == 1:
-            header = self.TaskHeader_v1._make(struct.unpack(
-                self.header_fmt_v1, data))
+            header = cls.TaskHeader_v1._make(struct.unpack(
+                cls.header_fmt_v1, data))
             if header.version not in (1, 2):
                 raise RuntimeError(
-                    f'Corrupted task file {self.task_file}. Please report a bug if you can reproduce the generation of this file.')
-            return self.TaskHeader(shell_size=0, **header._asdict())._replace(version=2)
+                    f'Corrupted task file {task_file}. Please report a bug if you can reproduce the generation of this file.')
+            return cls.TaskHeader(shell_size=0, **header._asdict())._replace(version=2)
         else:
-            header = self.TaskHeader._make(struct.unpack(
-                self.header_fmt_v2, data))
+            header = cls.TaskHeader._make(struct.unpack(
+                cls.header_fmt_v2, data))
             if header.version not in (1, 2):
                 raise RuntimeError(
-                    f'Corrupted task file {self.task_file}. Please report a bug if you can reproduce the generation of this file.')
+                    f'Corrupted task file {task_file}. Please report a bug if you can reproduce the generation of this file.')
             return header
 
+    def _read_header(self, fh):
+        fh.seek(0, 0)
+        return self._parse_header(fh.read(self.header_size), self.task_file)
+
+    @classmethod
+    def read_headers(cls, task_ids) -> Dict[str, Optional[tuple]]:
+        '''Read headers of specified tasks with a single read of the beginning
+        of each task file. The returned dictionary maps task ids to their
+        headers, or None if the task file does not exist or is corrupted.'''
+        headers = {}
+        task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        for task_id in task_ids:
+            task_file = os.path.join(task_dir, task_id + '.task')
+            try:
+                fd = os.open(task_file, os.O_RDONLY)
+            except OSError:
+                headers[task_id] = None
+                continue
+            try:
+                headers[task_id] = cls._parse_header(
+                    os.read(fd, cls.header_size), task_file)
+            except Exception as e:
+                env.logger.debug(f'Failed to read header of {task_file}: {e}')
+                headers[task_id] = None
+            finally:
+                os.close(fd)
+        return headers
+
     def _write_header(self, fh, header):
         fh.seek(0, 0)
         fh.write(struct.pack(self.header_fmt_v2, *header))
@@ -604,10 +634,11 @@ class TaskFile(object):
 
     signature = property(_get_signature)
 
-    def tags_created_start_and_duration(self, formatted=False):
+    def tags_created_start_and_duration(self, formatted=False, header=None):
         try:
-            with open(self.task_file, 'rb') as fh:
-                header = self._read_header(fh)
+            if header is None:
+                with open(self.task_file, 'rb') as fh:
+                    header = self._read_header(fh)
             try:
                 tags = header.tags.decode().strip()
             except:
@@ -657,6 +688,126 @@ def remove_task_files(task: str, exts: list):
                     pass
 
 
+class TaskStatusIndex:
+    '''An index of the status of tasks under ~/.sos/tasks, which is updated
+    by check_tasks when the status of tasks is checked. Each record consists
+    of the status of the task and time stamps of files used to determine the
+    status.
+
+    Because ~/.sos/tasks is usually shared by the nodes of a cluster through
+    a network filesystem, the index uses a rollback journal instead of WAL,
+    writes to the index are serialized by a file lock as the pickled status
+    cache used to be, and tasks running on compute nodes only write to their
+    task files.'''
+
+    _db_structure = ['''CREATE TABLE IF NOT EXISTS task_status (
+            task_id text PRIMARY KEY,
+            status text,
+            files text
+        )''']
+
+    # maximum number of variables in a sqlite query
+    _chunk_size = 500
+
+    def __init__(self, db_file: str=None):
+        self.db_file = db_file if db_file else os.path.join(
+            os.path.expanduser('~'), '.sos', 'tasks', 'task_status.db')
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_conn(self):
+        # a connection copied from another process cannot be used
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_file, timeout=60,
+                check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=DELETE')
+            for stmt in self._db_structure:
+                self._conn.execute(stmt)
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, task_ids: List[str]) -> Dict[str, dict]:
+        '''Return indexed status of specified tasks in the format of
+        {task_id: {'status': status, 'files': {filename: mtime}}}'''
+        res = {}
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                for i in range(0, len(task_ids), self._chunk_size):
+                    ids = task_ids[i:i + self._chunk_size]
+                    for task_id, status, files in conn.execute(
+                            f'SELECT task_id, status, files FROM task_status WHERE task_id IN ({",".join("?" * len(ids))})', ids):
+                        res[task_id] = dict(status=status, files=json.loads(files))
+        except (sqlite3.DatabaseError, ValueError) as e:
+            env.logger.debug(f'Failed to read task status from {self.db_file}: {e}')
+        return res
+
+    def update(self, status: Dict[str, dict]):
+        '''Update status of tasks with a dictionary in the format of
+        {task_id: {'status': status, 'files': {filename: mtime}}}'''
+        if not status:
+            return
+        try:
+            with self._lock, fasteners.InterProcessLock(self.db_file + '_'):
+                conn = self._get_conn()
+                conn.executemany('INSERT OR REPLACE INTO task_status (task_id, status, files) VALUES (?, ?, ?)',
+                    [(k, v['status'], json.dumps(v['files'])) for k, v in status.items()])
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            env.logger.debug(f'Failed to write task status to {self.db_file}: {e}')
+
+    def remove(self, task_ids: List[str]=None, keep: List[str]=None):
+        '''Remove specified tasks, or all tasks not in keep, from the index'''
+        try:
+            with self._lock, fasteners.InterProcessLock(self.db_file + '_'):
+                conn = self._get_conn()
+                if keep is not None:
+                    keep = set(keep)
+                    task_ids = [x[0] for x in conn.execute('SELECT task_id FROM task_status')
+                                if x[0] not in keep]
+                conn.executemany('DELETE FROM task_status WHERE task_id = ?',
+                    [(x,) for x in task_ids])
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            env.logger.debug(f'Failed to remove task status from {self.db_file}: {e}')
+
+    def migrate_status_cache(self, cache_file: str=None):
+        '''Import the status of tasks from status_cache.pickle, which was used
+        by previous versions of sos, and remove the file'''
+        cache_file = cache_file if cache_file else os.path.join(
+            os.path.dirname(self.db_file), 'status_cache.pickle')
+        if not os.path.isfile(cache_file):
+            return
+        try:
+            with fasteners.InterProcessLock(cache_file + '_'):
+                with open(cache_file, 'rb') as cache:
+                    status_cache = pickle.load(cache)
+            self.update({k: v for k, v in status_cache.items()
+                if isinstance(v, dict) and 'status' in v and 'files' in v})
+        except Exception as e:
+            env.logger.debug(f'Failed to import task status from {cache_file}: {e}')
+        for f in (cache_file, cache_file + '_'):
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+
+_task_status_index = None
+
+
+def task_status_index():
+    '''Return a TaskStatusIndex object shared by all threads of the current
+    process, with the status cache of previous versions of sos migrated'''
+    global _task_status_index
+    if _task_status_index is None:
+        _task_status_index = TaskStatusIndex()
+        _task_status_index.migrate_status_cache()
+    return _task_status_index
+
+
 def check_task(task, hint={}) -> Dict[str, Union[str, Dict[str, float]]]:
     # when testing. if the timestamp is 0, the file does not exist originally, it should
     # still does not exist. Otherwise the file should exist and has the same timestamp
@@ -771,33 +922,22 @@ def check_task(task, hint={}) -> Dict[str, Union[str, Dict[str, float]]]:
 def check_tasks(tasks, is_all: bool):
     if not tasks:
         return {}
-    cache_file: str = os.path.join(
-        os.path.expanduser('~'), '.sos', 'tasks', 'status_cache.pickle')
-    #
-    status_cache = {}
-    if os.path.isfile(cache_file):
-        with fasteners.InterProcessLock(cache_file + '_'):
-            with open(cache_file, 'rb') as cache:
-                status_cache = pickle.load(cache)
+    status_index = task_status_index()
+    status_cache = status_index.get(tasks)
     # at most 20 threads
     from multiprocessing.pool import ThreadPool as Pool
-    p = Pool(min(20, len(tasks)))
-    # the result can be {} for unchanged, or real results
-    raw_status = p.starmap(
-        check_task, [(x, status_cache.get(x, {})) for x in tasks])
-
-    # if check all, we clear the cache and record all existing tasks
-    has_changes: bool = any(x for x in raw_status)
-    if has_changes:
-        if is_all:
-            status_cache = {k: v if v else status_cache[k]
-                            for k, v in zip(tasks, raw_status)}
-        else:
-            status_cache.update(
-                {k: v for k, v in zip(tasks, raw_status) if v})
-        with fasteners.InterProcessLock(cache_file + '_'):
-            with open(cache_file, 'wb') as cache:
-                pickle.dump(status_cache, cache)
+    with Pool(min(20, len(tasks))) as p:
+        # the result can be {} for unchanged, or real results
+        raw_status = p.starmap(
+            check_task, [(x, status_cache.get(x, {})) for x in tasks])
+
+    # only tasks with changed status are written to the index
+    changed = {k: v for k, v in zip(tasks, raw_status) if v}
+    status_index.update(changed)
+    status_cache.update(changed)
+    # if check all, we remove tasks that no longer exist from the index
+    if is_all:
+        status_index.remove(keep=tasks)
     return status_cache
 
 
@@ -838,8 +978,9 @@ def print_task_status(tasks, check_all=False, verbosity: int=1, html: bool=False
                        key=lambda x: 0 if x[1] is None else x[1])
 
     if tags:
-        all_tasks = [x for x in all_tasks if TaskFile(x[0]).exists() and any(
-            y in tags for y in TaskFile(x[0]).tags.split())]
+        headers = TaskFile.read_headers([x[0] for x in all_tasks])
+        all_tasks = [x for x in all_tasks if headers[x[0]] is not None and any(
+            y in tags for y in headers[x[0]].tags.decode().split())]
 
     if not all_tasks:
         env.logger.info('No matching tasks are identified.')
@@ -1105,17 +1246,19 @@ showResourceFigure_''' + t + '''()
         for s, (t, d) in zip(obtained_status, all_tasks):
             print(f'{t}\t{s}')
     elif verbosity == 2:
+        headers = TaskFile.read_headers([x[0] for x in all_tasks])
         tsize = 20
         for s, (t, d) in zip(obtained_status, all_tasks):
             ts, _, _, dr = TaskFile(t).tags_created_start_and_duration(
-                formatted=not numeric_times)
+                formatted=not numeric_times, header=headers[t])
             tsize = max(tsize, len(ts))
             print(f'{t}\t{ts.ljust(tsize)}\t{dr:<14}\t{s}')
     elif verbosity == 3:
+        headers = TaskFile.read_headers([x[0] for x in all_tasks])
         tsize = 20
         for s, (t, d) in zip(obtained_status, all_tasks):
             ts, ct, st, dr = TaskFile(t).tags_created_start_and_duration(
-                formatted=not numeric_times)
+                formatted=not numeric_times, header=headers[t])
             tsize = max(tsize, len(ts))
             print(f'{t}\t{ts.ljust(tsize)}\t{ct:<14}\t{st:<14}\t{dr:<14}\t{s}')
     elif verbosity == 4:
@@ -1290,8 +1433,9 @@ def purge_tasks(tasks, purge_all=False, age=None, status=None, tags=None, verbos
                      in status]
 
     if tags:
-        all_tasks = [x for x in all_tasks if any(
-            x in tags for x in TaskFile(x[0]).tags.split())]
+        headers = TaskFile.read_headers([x[0] for x in all_tasks])
+        all_tasks = [x for x in all_tasks if headers[x[0]] is not None and any(
+            y in tags for y in headers[x[0]].tags.decode().split())]
     #
     # remoe all task files
     all_tasks = set([x[0] for x in all_tasks])
@@ -1305,16 +1449,6 @@ def purge_tasks(tasks, purge_all=False, age=None, status=None, tags=None, verbos
                 ID = os.path.basename(f).split('.', 1)[0]
                 if ID in all_tasks:
                     to_be_removed[ID].append(os.path.join(dirname, f))
-        #
-        cache_file: str = os.path.join(
-            os.path.expanduser('~'), '.sos', 'tasks', 'status_cache.pickle')
-
-        if os.path.isfile(cache_file):
-            with fasteners.InterProcessLock(cache_file + '_'):
-                with open(cache_file, 'rb') as cache:
-                    status_cache = pickle.load(cache)
-        else:
-            status_cache = {}
         for task in all_tasks:
             removed = True
             for f in to_be_removed[task]:
@@ -1326,17 +1460,16 @@ def purge_tasks(tasks, purge_all=False, age=None, status=None, tags=None, verbos
                     removed = False
                     if verbosity > 0:
                         env.logger.warning(f'Failed to purge task {task[0]}: {e}')
-            status_cache.pop(task, None)
             if removed and verbosity > 1:
                 print(f'{task}\tpurged')
-        with fasteners.InterProcessLock(cache_file + '_'):
-            with open(cache_file, 'wb') as cache:
-                pickle.dump(status_cache, cache)
+        task_status_index().remove(list(all_tasks))
     elif verbosity > 1:
         env.logger.debug('No matching tasks')
     if purge_all and age is None and status is None and tags is None:
         matched = glob.glob(os.path.join(
             os.path.expanduser('~'), '.sos', 'tasks', '*'))
+        # the task status index is still in use
+        matched = [x for x in matched if not os.path.basename(x).startswith('task_status.db')]
         count = 0
         for f in matched:
             if os.path.isdir(f):
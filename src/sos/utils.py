@@ -339,6 +339,7 @@ class RuntimeEnvironments(object):
             'resume_mode': False,
             'default_queue': '',
             'max_procs': 4,
+            'min_substep_workers': None,
             'max_running_jobs': None,
             'sig_mode': 'default',
             'run_mode': 'run',
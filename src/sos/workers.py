@@ -19,6 +19,7 @@ from .controller import connect_controllers, disconnect_controllers
 from .targets import sos_targets
 from .utils import WorkflowDict, env, get_traceback, load_config_files, short_repr
 from .executor_utils import kill_all_subprocesses
+from .substep_executor import execute_substeps
 
 class ProcessKilled(Exception):
     pass
@@ -191,7 +192,6 @@ class SoS_SubStep_Worker(mp.Process):
     def run(self):
         env.config.update(self.config)
         env.zmq_context = connect_controllers()
-        from .substep_executor import execute_substep
         env.master_socket = env.zmq_context.socket(zmq.REQ)
         env.master_socket.connect(f'tcp://127.0.0.1:{self.config["sockets"]["substep_backend"]}')
         env.logger.trace(f'Substep worker {os.getpid()} started')
@@ -204,7 +204,7 @@ class SoS_SubStep_Worker(mp.Process):
                 break
 
             env.logger.debug(f'Substep worker {os.getpid()} receives request {short_repr(msg)}')
-            execute_substep(**msg)
+            execute_substeps(**msg)
 
         env.master_socket.LINGER = 0
         env.master_socket.close()
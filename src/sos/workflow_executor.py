@@ -20,6 +20,7 @@ from ._version import __version__
 from .dag import SoS_DAG, SoS_Node
 from .eval import SoS_exec
 from .hosts import Host
+from .messages import send_message
 from .parser import SoS_Step, SoS_Workflow
 from .pattern import extract_pattern
 from .workflow_report import render_report
@@ -127,7 +128,7 @@ class ExecutionManager(object):
             socket = pi.socket
 
         # we need to report number of active works, plus master process itself
-        env.controller_push_socket.send_pyobj(
+        send_message(env.controller_push_socket,
             ['nprocs', self.num_active() + 1])
 
         socket.send_pyobj(spec)
@@ -231,8 +232,8 @@ class Base_Executor:
         workflow_info['master_id'] = env.config['master_id']
         env.signature_req_socket.send_pyobj(['workflow', 'clear'])
         env.signature_req_socket.recv_pyobj()
-        env.signature_push_socket.send_pyobj(
-            ['workflow', 'workflow', self.md5, repr(workflow_info)])
+        send_message(env.signature_push_socket,
+            ['workflow', 'workflow', self.md5, workflow_info])
         if env.config['exec_mode'] == 'slave':
             env.tapping_listener_socket.send_pyobj(
                 {'msg_type': 'workflow_status',
@@ -259,6 +260,8 @@ class Base_Executor:
         self.controller.start()
         # wait for the thread to start with a signature_req saved to env.config
         ready.wait()
+        if self.controller.error is not None:
+            raise self.controller.error
 
         connect_controllers(env.zmq_context)
 
@@ -390,9 +393,12 @@ class Base_Executor:
         '''Feed dangling targets with their dependncies from auxiliary steps,
         optionally add other targets'''
         resolved = 0
+        # existence of targets does not change during resolution
+        target_exists = {}
         while True:
             added_node = 0
-            dangling_targets, existing_targets = dag.dangling(targets)
+            dangling_targets, existing_targets = dag.dangling(
+                targets, target_exists)
             if dangling_targets:
                 env.logger.debug(
                     f'Resolving {dangling_targets} objects from {dag.number_of_nodes()} nodes')
@@ -400,7 +406,7 @@ class Base_Executor:
             # check auxiliary steps and see if any steps provides it
             for target in dangling_targets:
                 # target might no longer be dangling after a section is added.
-                if target not in dag.dangling(targets)[0]:
+                if target in dag._all_output_files:
                     continue
                 mo = [(x, self.match(target, x))
                       for x in self.workflow.auxiliary_sections]
@@ -411,7 +417,7 @@ class Base_Executor:
                     # so the execution of its previous steps would solves the dependency
                     #
                     # find all the nodes that depends on target
-                    nodes = dag._all_dependent_files[target]
+                    nodes = dag._all_dependent_files.get(target, [])
                     for node in nodes:
                         # if this is an index step... simply let it depends on previous steps
                         if node._node_index is not None:
@@ -569,13 +575,10 @@ class Base_Executor:
 
             # for existing targets... we should check if it actually exists. If
             # not it would still need to be regenerated
-            node_added = False
-            existing_targets = set(dag.dangling(targets)[1])
+            existing_targets = dag.dangling(targets, target_exists)[1]
             for target in existing_targets:
-                if node_added:
-                    existing_targets = set(dag.dangling(targets)[1])
-                    node_added = False
-                if target not in existing_targets:
+                # target might no longer be dangling after a section is added.
+                if target in dag._all_output_files:
                     continue
                 if file_target(target).target_exists('target') if isinstance(target, str) else target.target_exists('target'):
                     continue
@@ -632,7 +635,6 @@ class Base_Executor:
                 dag.add_step(section.uuid, node_name,
                              None, res['step_input'],
                              res['step_depends'], res['step_output'], context=context)
-                node_added = True
                 added_node += 1
                 # this case do not count as resolved
                 # resolved += 1
@@ -799,9 +801,8 @@ class Base_Executor:
                     f'Failed to regenerate or resolve {target}{dag.steps_depending_on(target, self.workflow)}.')
             if runnable._depends_targets.valid():
                 runnable._depends_targets.extend(target)
-            if runnable not in dag._all_dependent_files[target]:
-                dag._all_dependent_files[target].append(
-                    runnable)
+            dag.update_step(runnable, input_targets=sos_targets(), output_targets=sos_targets(),
+                depends_targets=sos_targets(target))
             dag.build()
             #
             cycle = dag.circular_dependencies()
@@ -859,8 +860,8 @@ class Base_Executor:
         }
         if env.config['output_dag'] and env.config['master_id'] == self.md5:
             workflow_info['dag'] = env.config['output_dag']
-        env.signature_push_socket.send_pyobj(
-            ['workflow', 'workflow', self.md5, repr(workflow_info)])
+        send_message(env.signature_push_socket,
+            ['workflow', 'workflow', self.md5, workflow_info])
         if env.config['master_id'] == env.sos_dict['workflow_id'] and env.config['output_report']:
             # if this is the outter most workflow
             render_report(env.config['output_report'],
@@ -887,6 +888,16 @@ class Base_Executor:
 
         self.reset_dict()
 
+        # option min_substep_workers from command line overrides option
+        # sos.min_substep_workers in the config file
+        min_substep_workers = env.config.get('min_substep_workers', None)
+        if min_substep_workers is None:
+            min_substep_workers = env.sos_dict['CONFIG'].get('sos', {}).get(
+                'min_substep_workers', 0)
+        if min_substep_workers:
+            env.controller_req_socket.send_pyobj(['substep_workers', min_substep_workers])
+            env.controller_req_socket.recv_pyobj()
+
         env.config['run_mode'] = env.config.get(
             'run_mode', 'run') if mode is None else mode
         # passing run_mode to SoS dict so that users can execute blocks of
@@ -18,7 +18,7 @@ class WorkflowSig(object):
         env.signature_req_socket.send_pyobj(['workflow', 'records', workflow_id])
         for entry_type, id, item in env.signature_req_socket.recv_pyobj():
             try:
-                self.data[entry_type][id].append(item.strip())
+                self.data[entry_type][id].append(item)
             except Exception as e:
                 env.logger.debug(f'Failed to read report line: {e}')
 
@@ -40,7 +40,7 @@ class WorkflowSig(object):
             workflows = defaultdict(dict)
             for id, values in self.data['workflow'].items():
                 for val in values:
-                    workflows[id].update(eval(val))
+                    workflows[id].update(val)
             for v in workflows.values():
                 self.convert_time(v)
                 if 'dag' in v:
@@ -61,7 +61,7 @@ class WorkflowSig(object):
         def merge_dict(items):
             ret = {}
             for item in items:
-                ret.update(eval(item))
+                ret.update(item)
             return ret
         try:
             # there can be multiple task status for each id
@@ -78,14 +78,14 @@ class WorkflowSig(object):
 
     def steps(self):
         try:
-            return {wf: [self.convert_time(eval(x)) for x in steps] for wf, steps in self.data['step'].items()}
+            return {wf: [self.convert_time(x) for x in steps] for wf, steps in self.data['step'].items()}
         except Exception as e:
             env.logger.warning(e)
             return {}
 
     def transcripts(self):
         try:
-            return {step: [self.convert_time(eval(x)) for x in items] for step, items in self.data['transcript'].items()}
+            return {step: [self.convert_time(x) for x in items] for step, items in self.data['transcript'].items()}
         except Exception as e:
             env.logger.warning(e)
             return {}
@@ -0,0 +1 @@
+temp_cmd
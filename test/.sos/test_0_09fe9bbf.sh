@@ -0,0 +1,2 @@
+something_wrong
+
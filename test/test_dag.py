@@ -1191,6 +1191,78 @@ default;
 }
 ''')
 
+    def testIncrementalBuild(self):
+        '''Test connecting nodes added after a DAG is built'''
+        from sos.dag import SoS_DAG, SoS_Node
+        from sos.targets import sos_targets
+        context = {'__signature_vars__': set(), '__environ_vars__': set(),
+                   '__changed_vars__': set()}
+        dag = SoS_DAG(name='test')
+        dag.add_step('uuid_a', 'A', None, sos_targets(), sos_targets(),
+                     sos_targets('a.txt'), context=context)
+        dag.add_step('uuid_b', 'B', None, sos_targets(os.path.abspath('a.txt')),
+                     sos_targets(), sos_targets('b.txt'), context=context)
+        dag.build()
+        self.assertDAG(dag, '''
+strict digraph "" {
+A;
+B;
+A -> B;
+}
+''')
+        # nodes are connected to existing nodes by their input and output
+        dag.add_step('uuid_c', 'C', None, sos_targets('b.txt'), sos_targets(),
+                     sos_targets('c.txt'), context=context)
+        node_d = SoS_Node('uuid_d', 'D', None, None, sos_targets(), sos_targets(),
+                     sos_targets('d.txt'), context)
+        dag.add_step('uuid_d', 'D', None, sos_targets(), sos_targets(),
+                     sos_targets('d.txt'), context=context)
+        dag.update_step(dag.node_by_id(node_d._node_uuid), input_targets=sos_targets(),
+                        output_targets=sos_targets('a.txt'), depends_targets=sos_targets())
+        dag.build()
+        self.assertDAG(dag, '''
+strict digraph "" {
+A;
+B;
+C;
+D;
+A -> B;
+B -> C;
+D -> B;
+}
+''')
+
+    def testDanglingTargets(self):
+        '''Test dangling targets of a DAG as steps are added'''
+        from sos.dag import SoS_DAG
+        from sos.targets import sos_targets
+        context = {'__signature_vars__': set(), '__environ_vars__': set(),
+                   '__changed_vars__': set()}
+        for f in ('missing.txt', 'produced.txt', 'other.txt'):
+            if file_target(f).exists():
+                file_target(f).unlink()
+        with open('existing.txt', 'w') as ef:
+            ef.write('existing')
+        dag = SoS_DAG(name='test')
+        dag.add_step('uuid_a', 'A', None, sos_targets('missing.txt', 'existing.txt'),
+                     sos_targets('produced.txt'), sos_targets('a.txt'), context=context)
+        exists = {}
+        missing, existing = dag.dangling(sos_targets('a.txt', 'other.txt'), exists)
+        self.assertEqual(missing, [file_target('missing.txt'),
+                                   file_target('produced.txt'), file_target('other.txt')])
+        self.assertEqual(existing, [file_target('existing.txt')])
+        self.assertEqual(len(exists), 4)
+        # target produced by a new step is no longer dangling
+        dag.add_step('uuid_b', 'B', None, sos_targets(), sos_targets(),
+                     sos_targets('produced.txt'), context=context)
+        missing, existing = dag.dangling(sos_targets('a.txt', 'other.txt'), exists)
+        self.assertEqual(missing, [file_target('missing.txt'), file_target('other.txt')])
+        # existence of targets is cached
+        exists[file_target('missing.txt')] = True
+        missing, existing = dag.dangling(sos_targets(), exists)
+        self.assertEqual(missing, [])
+        self.assertEqual(existing, [file_target('missing.txt'), file_target('existing.txt')])
+        file_target('existing.txt').unlink()
 
 
 if __name__ == '__main__':
@@ -2035,6 +2035,206 @@ sos_run('nested')
         wf = script.workflow()
         Base_Executor(wf).run()
 
+    def testSubstepChunks(self):
+        '''Test sending substeps to workers in chunks'''
+        from sos.step_executor import Base_Step_Executor
+        script = SoS_Script('''
+input: for_each={'i': range(200)}, concurrent=True
+output: f'chunk_{i}.txt'
+_output.touch()
+''')
+        wf = script.workflow()
+        Base_Executor(wf, config={'max_procs': 4}).run()
+        for i in range(200):
+            self.assertTrue(os.path.isfile(f'chunk_{i}.txt'))
+            self.temp_files.append(f'chunk_{i}.txt')
+        # size of chunks is adjusted by the duration of substeps
+        executor = Base_Step_Executor(None)
+        executor._substeps = [None] * 4000
+        env.config['max_procs'] = 4
+        executor._substep_duration = 0
+        executor._n_timed_substeps = 0
+        executor.adjust_substep_chunk_size(1)
+        self.assertEqual(executor._substep_chunk_size, 1)
+        executor.adjust_substep_chunk_size(0.001)
+        executor.adjust_substep_chunk_size(0.001)
+        executor.adjust_substep_chunk_size(0.001)
+        self.assertEqual(executor._substep_chunk_size, 1)
+        for i in range(1000):
+            executor.adjust_substep_chunk_size(0.001)
+        self.assertEqual(executor._substep_chunk_size, 250)
+        # but all workers should have chunks to work on
+        executor._substeps = [None] * 400
+        executor.adjust_substep_chunk_size(0.001)
+        self.assertEqual(executor._substep_chunk_size, 100)
+
+    def testSubstepContext(self):
+        '''Test passing step variables to concurrent substeps as a step context'''
+        script = SoS_Script('''
+[10]
+values = [1, 2, 3]
+input: for_each={'i': range(6)}, concurrent=True
+output: f'context_{i}.txt'
+values.append(i)
+with open(_output, 'w') as out:
+    out.write(f'{i} {len(values)}')
+''')
+        wf = script.workflow()
+        executor = Base_Executor(wf, config={'max_procs': 2, 'sig_mode': 'ignore'})
+        executor.run()
+        for i in range(6):
+            self.temp_files.append(f'context_{i}.txt')
+            # each substep gets its own copy of variables in the context
+            with open(f'context_{i}.txt') as res:
+                self.assertEqual(res.read(), f'{i} 4')
+        # contexts are released after the completion of steps
+        self.assertEqual(executor.controller._step_contexts, {})
+
+    def testChangedSubstepContext(self):
+        '''Test passing step variables changed in place between substeps'''
+        script = SoS_Script('''
+[10]
+values = [1, 2, 3]
+input: for_each={'i': range(6)}, concurrent=True
+output: f'changed_context_{i}.txt' if values.append(i) is None else ''
+with open(_output, 'w') as out:
+    out.write(str(len(values)))
+''')
+        wf = script.workflow()
+        Base_Executor(wf, config={'max_procs': 2, 'sig_mode': 'ignore'}).run()
+        for i in range(6):
+            self.temp_files.append(f'changed_context_{i}.txt')
+            # substeps see the variable as it is when they are submitted
+            with open(f'changed_context_{i}.txt') as res:
+                self.assertEqual(res.read(), str(i + 4))
+
+    def testSubstepGlobals(self):
+        '''Test that substeps do not see globals changed by previous substeps'''
+        script = SoS_Script('''
+[global]
+values = []
+def add(x):
+    values.append(x)
+    return len(values)
+
+[10]
+input: for_each={'i': range(10)}, concurrent=True
+output: f'globals_{i}.txt'
+with open(_output, 'w') as out:
+    out.write(str(add(i)))
+''')
+        wf = script.workflow()
+        Base_Executor(wf, config={'max_procs': 2, 'sig_mode': 'ignore'}).run()
+        for i in range(10):
+            self.temp_files.append(f'globals_{i}.txt')
+            with open(f'globals_{i}.txt') as res:
+                self.assertEqual(res.read(), '1')
+
+    def testMissingSubstepContext(self):
+        '''Test substeps with a step context that cannot be retrieved'''
+        import zmq
+        from threading import Event
+        from sos.controller import Controller, connect_controllers, disconnect_controllers
+        from sos.substep_executor import execute_substeps
+        env.config['master_id'] = 'context_test'
+        ready = Event()
+        controller = Controller(ready)
+        controller.start()
+        ready.wait()
+        env.zmq_context = connect_controllers(zmq.Context())
+        result_socket = env.zmq_context.socket(zmq.PULL)
+        port = result_socket.bind_to_random_port('tcp://127.0.0.1')
+        try:
+            # a context is kept until it is released by all steps
+            for i in range(2):
+                env.controller_req_socket.send_pyobj(['step_context', 'ctx', b'context'])
+                env.controller_req_socket.recv_pyobj()
+            for i in range(2):
+                env.controller_req_socket.send_pyobj(['step_context', 'ctx'])
+                self.assertEqual(env.controller_req_socket.recv_pyobj(), b'context')
+                env.controller_req_socket.send_pyobj(['step_context', 'ctx', None])
+                env.controller_req_socket.recv_pyobj()
+            self.assertEqual(controller._step_contexts, {})
+            # all substeps fail without waiting for the step
+            execute_substeps(stmt='pass', context_id='ctx',
+                substeps=[{'_index': 0}, {'_index': 1}],
+                config={'sockets': dict(env.config['sockets'], result_push_socket=port)})
+            for i in range(2):
+                self.assertTrue(result_socket.poll(10000))
+                res = result_socket.recv_pyobj()
+                self.assertEqual(res['index'], i)
+                self.assertEqual(res['ret_code'], 1)
+                self.assertTrue(isinstance(res['exception'], RuntimeError))
+        finally:
+            result_socket.close(linger=0)
+            env.controller_req_socket.send_pyobj(['done', True])
+            env.controller_req_socket.recv_pyobj()
+            disconnect_controllers(env.zmq_context)
+            controller.join()
+
+    def testWarmSubstepWorkers(self):
+        '''Test keeping a warm pool of substep workers'''
+        from sos.controller import Controller
+        for i in range(4):
+            if os.path.isfile(f'warm_{i}.txt'):
+                os.remove(f'warm_{i}.txt')
+        script = SoS_Script('''
+input: for_each={'i': range(4)}, concurrent=True
+output: f'warm_{i}.txt'
+_output.touch()
+''')
+        wf = script.workflow()
+        # record the number of workers when the first substep is received
+        n_workers = []
+        handle_substep_frontend_msg = Controller.handle_substep_frontend_msg
+
+        def record_workers(self, msg):
+            n_workers.append(self._n_working_workers)
+            handle_substep_frontend_msg(self, msg)
+
+        Controller.handle_substep_frontend_msg = record_workers
+        try:
+            Base_Executor(wf, config={'min_substep_workers': 2, 'max_procs': 4}).run()
+            for i in range(4):
+                self.assertTrue(os.path.isfile(f'warm_{i}.txt'))
+                os.remove(f'warm_{i}.txt')
+            # workers are started before the first substep
+            self.assertEqual(n_workers[0], 2)
+            # option sos.min_substep_workers of the config file
+            with open('warm.yml', 'w') as cfg:
+                cfg.write('sos:\n  min_substep_workers: 3\n')
+            self.temp_files.append('warm.yml')
+            n_workers.clear()
+            Base_Executor(wf, config={'config_file': 'warm.yml',
+                'min_substep_workers': None, 'max_procs': 4}).run()
+            self.assertEqual(n_workers[0], 3)
+        finally:
+            Controller.handle_substep_frontend_msg = handle_substep_frontend_msg
+        for i in range(4):
+            self.assertTrue(os.path.isfile(f'warm_{i}.txt'))
+            self.temp_files.append(f'warm_{i}.txt')
+        # idle workers are killed but at least min_substep_workers are kept
+        class BackendSocket:
+            def __init__(self):
+                self.sent = []
+
+            def send_pyobj(self, obj):
+                self.sent.append(obj)
+
+        controller = Controller(None)
+        controller.substep_backend_socket = BackendSocket()
+        controller._min_substep_workers = 2
+        controller._n_working_workers = 3
+        controller._worker_pending_time = [100, 100, 100]
+        controller.kill_idle_substep_workers(110)
+        self.assertEqual(controller.substep_backend_socket.sent, [])
+        controller.kill_idle_substep_workers(200)
+        self.assertEqual(controller.substep_backend_socket.sent, [None])
+        self.assertEqual(controller._n_working_workers, 2)
+        self.assertEqual(controller._worker_pending_time, [200, 200])
+        controller.kill_idle_substep_workers(300)
+        self.assertEqual(controller._n_working_workers, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,7 +4,10 @@
 # Distributed under the terms of the 3-clause BSD License.
 
 import os
+import shutil
 import subprocess
+import sys
+import time
 import unittest
 
 from sos.hosts import Host
@@ -79,6 +82,179 @@ run:
             self.assertTrue('something' in content, 'Got {}'.format(content))
             self.assertTrue('adf' in content, 'Got {}'.format(content))
 
+    @unittest.skipIf(sys.platform == 'win32', 'ssh connection sharing is not supported under windows')
+    def testSharedSSHConnection(self):
+        '''Test options and stale sockets of shared ssh connections'''
+        import tempfile
+        import threading
+        from sos.hosts import RemoteHost
+        host = RemoteHost({'alias': 'nohost', 'address': 'user@nohost.invalid', 'port': 2222})
+        if os.path.exists(host.control_path):
+            os.remove(host.control_path)
+        # a fake ssh that logs its arguments, and if commands are executed
+        # with an existing socket. "-O check" returns after a while with
+        # the content of ssh_check_status.
+        bin_dir = tempfile.mkdtemp()
+        ssh_log = os.path.join(bin_dir, 'ssh.log')
+        check_status = os.path.join(bin_dir, 'ssh_check_status')
+        with open(check_status, 'w') as st:
+            st.write('0')
+        with open(os.path.join(bin_dir, 'ssh'), 'w') as ssh:
+            ssh.write(f'''#!/bin/sh
+echo "$@" >> {ssh_log}
+case " $* " in
+  *" -O check "*) sleep 0.5; exit `cat {check_status}` ;;
+esac
+[ -e {host.control_path} ] && echo "existing socket" >> {ssh_log}
+echo remote output
+''')
+        os.chmod(os.path.join(bin_dir, 'ssh'), 0o755)
+
+        def ssh_calls():
+            if not os.path.isfile(ssh_log):
+                return []
+            with open(ssh_log) as log:
+                return log.read().splitlines()
+
+        old_path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + os.pathsep + old_path
+
+        def run_in_threads(n=8):
+            threads = [threading.Thread(target=host.check_output, args=('ls',))
+                for i in range(n)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        try:
+            # options are passed to ssh
+            self.assertEqual(host.check_output('ls').strip(), 'remote output')
+            calls = ssh_calls()
+            self.assertEqual(len(calls), 1)
+            self.assertIn('-o ControlMaster=auto', calls[0])
+            self.assertIn(f'-o ControlPath={host.control_path}', calls[0])
+            self.assertIn('-o ControlPersist=600', calls[0])
+            self.assertIn('-q user@nohost.invalid -p 2222', calls[0])
+            self.assertIn('{ssh_opts}', host._get_send_cmd())
+            # an existing master connection is checked only once a minute,
+            # even if commands are executed from multiple threads
+            with open(host.control_path, 'w') as sock:
+                sock.write('')
+            host._last_control_check = 0
+            run_in_threads()
+            host.check_output('ls')
+            checks = [x for x in ssh_calls() if '-O check' in x]
+            self.assertEqual(len(checks), 1)
+            self.assertIn(f'-o ControlPath={host.control_path}', checks[0])
+            self.assertIn('-p 2222 user@nohost.invalid', checks[0])
+            self.assertTrue(os.path.exists(host.control_path))
+            # socket of a lost master connection is removed before any
+            # command is executed with it
+            with open(check_status, 'w') as st:
+                st.write('255')
+            host._last_control_check = time.time() - 61
+            with open(ssh_log, 'w'):
+                pass
+            run_in_threads()
+            self.assertEqual(len([x for x in ssh_calls() if '-O check' in x]), 1)
+            self.assertNotIn('existing socket', ssh_calls())
+            self.assertFalse(os.path.exists(host.control_path))
+            self.assertIn(f'-o ControlPath={host.control_path}', ssh_calls()[-1])
+        finally:
+            os.environ['PATH'] = old_path
+            if os.path.exists(host.control_path):
+                os.remove(host.control_path)
+            shutil.rmtree(bin_dir)
+        # hosts with different ports do not share connections
+        self.assertNotEqual(RemoteHost({'alias': 'nohost', 'address': 'user@nohost.invalid',
+            'port': 22}).control_path, host.control_path)
+        self.assertEqual(os.path.dirname(host.control_path),
+            os.path.join(os.path.expanduser('~'), '.sos', 'ssh'))
+        self.assertEqual(RemoteHost({'alias': 'nohost', 'address': 'nohost.invalid',
+            'control_persist': 0})._get_ssh_opts(), '')
+        # plain ssh options are used if ssh cannot be executed
+        with open(host.control_path, 'w') as sock:
+            sock.write('')
+        host._last_control_check = 0
+        os.environ['PATH'] = ''
+        try:
+            self.assertEqual(host._get_ssh_opts(), '')
+        finally:
+            os.environ['PATH'] = old_path
+            os.remove(host.control_path)
+
+    def testBatchedTransfer(self):
+        '''Test grouping of files sent to and received from remote host'''
+        from sos.hosts import RemoteHost
+        host = RemoteHost({'alias': 'nohost', 'address': 'nohost.invalid',
+            'control_persist': 0, 'path_map': f'{os.getcwd()} -> /remote/dir'})
+        cmds = []
+        file_lists = []
+
+        def run_cmds(transfer_cmds):
+            cmds.extend(transfer_cmds)
+            for cmd in transfer_cmds:
+                if '--files-from=' in cmd:
+                    with open(cmd.split('--files-from=')[1].split()[0]) as lst:
+                        file_lists.append(sorted(lst.read().split()))
+            return []
+        host._run_transfer_cmds = run_cmds
+        for f in ('batch_a.txt', 'batch_b.txt', 'batch_c.txt'):
+            with open(f, 'w') as tmp:
+                tmp.write('test')
+            self.temp_files.append(f)
+        sent = host.send_to_host(['batch_a.txt', 'batch_b.txt', 'batch_c.txt'])
+        self.assertEqual(sent['batch_a.txt'], '/remote/dir/batch_a.txt')
+        # one command to create directories and one to send all files
+        self.assertEqual(len(cmds), 2)
+        self.assertIn('mkdir -p /remote/dir', cmds[0])
+        self.assertEqual(file_lists, [['batch_a.txt', 'batch_b.txt', 'batch_c.txt']])
+        #
+        cmds.clear()
+        file_lists.clear()
+        received = host.receive_from_host(['batch_a.txt', 'batch_b.txt'])
+        self.assertEqual(sorted(received.keys()), ['batch_a.txt', 'batch_b.txt'])
+        self.assertEqual(len(cmds), 1)
+        self.assertIn('nohost.invalid:/remote/dir', cmds[0])
+        self.assertEqual(file_lists, [['batch_a.txt', 'batch_b.txt']])
+
+    @unittest.skipIf(sys.platform == 'win32', 'No shell script on windows')
+    def testReceiveTaskArchive(self):
+        '''Test retrieving task files of multiple tasks in one tar stream'''
+        import stat
+        import tempfile
+        from sos.hosts import RemoteHost
+        host = RemoteHost({'alias': 'nohost', 'address': 'nohost.invalid',
+            'control_persist': 0})
+        with tempfile.TemporaryDirectory() as tmp:
+            # a fake ssh that executes the remote command under a fake home
+            remote_dir = os.path.join(tmp, 'remote', '.sos', 'tasks')
+            os.makedirs(remote_dir)
+            for name in ('bulk_t1.task', 'bulk_t1.pulse', 'bulk_t2.task', 'bulk_t4.task'):
+                with open(os.path.join(remote_dir, name), 'w') as tf:
+                    tf.write(name)
+            ssh = os.path.join(tmp, 'ssh')
+            with open(ssh, 'w') as script:
+                script.write('#!/bin/sh\nfor cmd; do :; done\ncd {} && eval "$cmd"\n'.format(
+                    os.path.join(tmp, 'remote')))
+            os.chmod(ssh, stat.S_IRWXU)
+            old_path = os.environ['PATH']
+            os.environ['PATH'] = tmp + os.pathsep + old_path
+            try:
+                received = host._receive_task_archive(['bulk_t1', 'bulk_t2', 'bulk_t3'])
+            finally:
+                os.environ['PATH'] = old_path
+        task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        try:
+            self.assertEqual(received, ['bulk_t1', 'bulk_t2'])
+            for name in ('bulk_t1.task', 'bulk_t1.pulse', 'bulk_t2.task'):
+                with open(os.path.join(task_dir, name)) as tf:
+                    self.assertEqual(tf.read(), name)
+            self.assertFalse(os.path.exists(os.path.join(task_dir, 'bulk_t4.task')))
+            self.assertFalse([x for x in os.listdir(task_dir) if x.startswith('.receiving_')])
+        finally:
+            host._remove_local_task_files(['bulk_t1', 'bulk_t2'])
+
 
 if __name__ == '__main__':
     unittest.main()
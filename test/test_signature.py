@@ -12,7 +12,7 @@ import shutil
 
 from sos.hosts import Host
 from sos.parser import SoS_Script
-from sos.targets import file_target, sos_targets
+from sos.targets import executable, file_target, sos_targets
 from sos.utils import env
 from sos.workflow_executor import Base_Executor
 
@@ -633,6 +633,234 @@ sh: expand=True
         Base_Executor(wf).run()
         env.config['sig_mode'] = 'default'
 
+    def testSignaturePolicy(self):
+        '''Test hash algorithm and strategy of step signatures'''
+        for policy in ('stat', 'blake2b:full', 'md5:sampled'):
+            script = SoS_Script(f'''
+[A: signature='{policy}']
+input: for_each={{'i': range(2)}}
+output: f'temp/policy_{{i}}.txt'
+sh: expand=True
+  echo {{i}} > {{_output}}
+''')
+            wf = script.workflow()
+            res = Base_Executor(wf).run()
+            self.assertEqual(res['__completed__']['__substep_completed__'], 2)
+            res = Base_Executor(wf).run()
+            self.assertEqual(res['__completed__']['__substep_completed__'], 0)
+            # signature created with a different policy is still valid
+            script = SoS_Script(f'''
+[A]
+input: for_each={{'i': range(2)}}
+output: f'temp/policy_{{i}}.txt'
+sh: expand=True
+  echo {{i}} > {{_output}}
+''')
+            wf = script.workflow()
+            res = Base_Executor(wf).run()
+            self.assertEqual(res['__completed__']['__substep_completed__'], 0)
+            for i in range(2):
+                file_target(f'temp/policy_{i}.txt').unlink()
+
+    def testGetManySignatures(self):
+        '''Test retrieving signatures of multiple substeps'''
+        from sos.signatures import StepSignatures
+        sigs = StepSignatures()
+        for i in range(5):
+            sigs.set(f'test_substep_{i}', {'index': i})
+        self.assertEqual(sigs.get_many([f'test_substep_{i}' for i in range(10)]),
+            {f'test_substep_{i}': {'index': i} for i in range(5)})
+        sigs.remove_many([f'test_substep_{i}' for i in range(5)])
+        self.assertEqual(sigs.get_many([f'test_substep_{i}' for i in range(5)]), {})
+        sigs.close()
+
+    def testConcurrentSubstepSignatures(self):
+        '''Test skipping chunks of concurrent substeps with saved signatures'''
+        script = SoS_Script('''
+input: for_each={'i': range(20)}, concurrent=True
+output: f'temp/concurrent_sig_{i}.txt'
+_output.touch()
+''')
+        wf = script.workflow()
+        res = Base_Executor(wf, config={'max_procs': 3}).run()
+        self.assertEqual(res['__completed__']['__substep_completed__'], 20)
+        res = Base_Executor(wf, config={'max_procs': 3}).run()
+        self.assertEqual(res['__completed__']['__substep_skipped__'], 20)
+        for i in range(20):
+            file_target(f'temp/concurrent_sig_{i}.txt').unlink()
+
+    def testSequentialSubstepSignatures(self):
+        '''Test retrieving signatures of sequentially executed substeps in one request'''
+        from sos.controller import SignatureWorker
+        script = SoS_Script('''
+input: for_each={'i': range(20)}, concurrent=False
+output: f'temp/sequential_sig_{i}.txt'
+_output.touch()
+''')
+        wf = script.workflow()
+        res = Base_Executor(wf).run()
+        self.assertEqual(res['__completed__']['__substep_completed__'], 20)
+        # record requests handled by the signature worker
+        requests = []
+        handle_sig_req_msg = SignatureWorker.handle_sig_req_msg
+
+        def record_request(self, msg):
+            requests.append(msg[:2])
+            handle_sig_req_msg(self, msg)
+
+        SignatureWorker.handle_sig_req_msg = record_request
+        try:
+            res = Base_Executor(wf).run()
+        finally:
+            SignatureWorker.handle_sig_req_msg = handle_sig_req_msg
+        self.assertEqual(res['__completed__']['__substep_skipped__'], 20)
+        self.assertEqual([x for x in requests if x[0] == 'step'], [['step', 'get_many']])
+        # substeps with changed signatures query their signatures
+        file_target('temp/sequential_sig_3.txt').unlink()
+        res = Base_Executor(wf).run()
+        self.assertEqual(res['__completed__']['__substep_skipped__'], 19)
+        self.assertEqual(res['__completed__']['__substep_completed__'], 1)
+        for i in range(20):
+            file_target(f'temp/sequential_sig_{i}.txt').unlink()
+
+    def testSignatureEncoding(self):
+        '''Test encoding of step signatures and reading of lzma signatures'''
+        import lzma
+        import pickle
+        import zlib
+        from sos.signatures import decode_signature, encode_signature
+        input_files = sos_targets(sos_targets('a.txt', 'b.txt', _source='in'),
+            sos_targets('c.txt', _source='ref'), group_by=1)
+        input_files._groups[0].set(name='a')
+        output_files = sos_targets('a.out', executable('ls'))
+        output_files[0].set(sample='A')
+        sig = {
+            'input': {'a.txt': (1.0, 10, 'aaa'), 'b.txt': (2.0, 20, 'bbb'), 'c.txt': (3.0, 30, 'ccc')},
+            'input_obj': input_files,
+            'output': {'a.out': (3.0, 30, 'ccc'), "executable('ls')": 'ls'},
+            'output_obj': output_files,
+            'depends': {},
+            'depends_obj': sos_targets(),
+            'init_context_sig': {'a': 'ddd'},
+            'end_context': {'b': 1}
+        }
+        for blob in (encode_signature(sig), lzma.compress(pickle.dumps(sig))):
+            decoded = decode_signature(blob)
+            for key in ('input', 'output', 'depends', 'init_context_sig', 'end_context'):
+                self.assertEqual(decoded[key], sig[key])
+            self.assertEqual(decoded['input_obj'], input_files)
+            self.assertEqual(decoded['input_obj'].labels, ['in', 'in', 'ref'])
+            self.assertEqual(len(decoded['input_obj'].groups), 3)
+            self.assertEqual(decoded['input_obj'].groups[0].name, 'a')
+            self.assertEqual(decoded['output_obj'], output_files)
+            self.assertEqual(decoded['output_obj'][0].sample, 'A')
+        # file targets are saved as paths in the compact schema
+        blob = encode_signature(sig)
+        if blob[:1] == b'\x03':
+            self.assertNotIn(b'file_target', zlib.decompress(blob[1:]))
+        # other signatures are saved as they are
+        self.assertEqual(decode_signature(encode_signature({'index': 1})), {'index': 1})
+
+    def testWorkflowSignatures(self):
+        '''Test upgrade, JSON records and removal of workflow signatures'''
+        import sqlite3
+        import time
+        from sos.signatures import WorkflowSignatures
+        self.resetDir('temp/.sos')
+        env.exec_dir = os.path.abspath('temp')
+        try:
+            # database created by previous versions of sos
+            conn = sqlite3.connect(os.path.join('temp', '.sos', 'workflow_signatures.db'))
+            conn.execute('''CREATE TABLE workflows (master_id text, entry_type text,
+                id text, item text)''')
+            conn.executemany('INSERT INTO workflows VALUES (?, ?, ?, ?)', [
+                ('old', 'workflow', 'old', repr({'start_time': 1.0, 'name': 'default'})),
+                ('old', 'tracked_files', 'sig', repr({'input_files': ['a.txt']})),
+                ('old', 'placeholder', 'file_target', 'a.txt')])
+            conn.commit()
+            conn.close()
+            #
+            sigs = WorkflowSignatures()
+            self.assertEqual(sorted(sigs.records('old')), sorted([
+                ('workflow', 'old', {'start_time': 1.0, 'name': 'default'}),
+                ('tracked_files', 'sig', {'input_files': ['a.txt']}),
+                ('placeholder', 'file_target', 'a.txt')]))
+            self.assertEqual(sigs.files(), [('sig', {'input_files': ['a.txt']})])
+            self.assertEqual(sigs.placeholders('old'), ['a.txt'])
+            #
+            env.config['master_id'] = 'new'
+            sigs.write('task', 't1', {'creation_time': time.time()})
+            sigs.write('placeholder', 'file_target', 'b.txt')
+            self.assertEqual(sigs.tasks(), ['t1'])
+            self.assertEqual(sorted(sigs.placeholders()), ['a.txt', 'b.txt'])
+            self.assertEqual(sorted(sigs.workflows()), ['new', 'old'])
+            # only the workflow written at upgrade time is older than 1 second
+            sigs.conn.execute('UPDATE workflows SET time = 0 WHERE master_id = ?', ('old',))
+            sigs.conn.commit()
+            self.assertEqual(sigs.remove_workflows(1), 1)
+            self.assertEqual(sigs.workflows(), ['new'])
+            self.assertEqual(sigs.remove_workflows(), 1)
+            self.assertEqual(sigs.workflows(), [])
+            sigs.close()
+        finally:
+            env.exec_dir = os.getcwd()
+
+    def testSignatureWorker(self):
+        '''Test handling of signatures by a separate thread of the controller'''
+        import zmq
+        from threading import Event
+        from sos.controller import Controller, connect_controllers, disconnect_controllers
+        from sos.messages import send_message
+        from sos.signatures import WorkflowSignatures
+        self.resetDir('temp/.sos')
+        env.exec_dir = os.path.abspath('temp')
+        env.verbosity = 0
+        env.config['master_id'] = 'worker_test'
+        ready = Event()
+        controller = Controller(ready)
+        controller.start()
+        ready.wait()
+        self.assertIsNone(controller.error)
+        # another controller can be started in the same process
+        sockets = dict(env.config['sockets'])
+        ready2 = Event()
+        controller2 = Controller(ready2)
+        controller2.start()
+        self.assertTrue(ready2.wait(60))
+        self.assertIsNone(controller2.error)
+        context2 = zmq.Context()
+        connect_controllers(context2)
+        env.controller_req_socket.send_pyobj(['done', True])
+        env.controller_req_socket.recv_pyobj()
+        disconnect_controllers(context2)
+        controller2.join()
+        self.assertFalse(controller2.signature_worker.is_alive())
+        env.config['sockets'] = sockets
+        context = zmq.Context()
+        connect_controllers(context)
+        try:
+            send_message(env.signature_push_socket,
+                ['workflow', 'placeholder', 'file_target', 'a.txt'])
+            # signature requests see signatures pushed before them
+            env.signature_req_socket.send_pyobj(['workflow', 'placeholders', 'worker_test'])
+            self.assertEqual(env.signature_req_socket.recv_pyobj(), ['a.txt'])
+            # controller requests are handled by the controller thread
+            env.controller_req_socket.send_pyobj(['nprocs'])
+            self.assertEqual(env.controller_req_socket.recv_pyobj(), 0)
+            send_message(env.signature_push_socket,
+                ['workflow', 'placeholder', 'file_target', 'b.txt'])
+            # signatures are saved before the controller stops
+            env.controller_req_socket.send_pyobj(['done', True])
+            env.controller_req_socket.recv_pyobj()
+            disconnect_controllers(context)
+            controller.join()
+            self.assertFalse(controller.signature_worker.is_alive())
+            sigs = WorkflowSignatures()
+            self.assertEqual(sorted(sigs.placeholders('worker_test')), ['a.txt', 'b.txt'])
+            sigs.close()
+        finally:
+            env.exec_dir = os.getcwd()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -144,6 +144,261 @@ class TestTask(unittest.TestCase):
         a.add_result({'ret_code': 5})
         self.assertEqual(a.result['ret_code'], 5)
 
+    def testReadTaskHeaders(self):
+        '''Test reading headers of multiple task files'''
+        params = TaskParams(name='fffffffffffffffe',
+                            global_def={}, task='b=a', sos_dict={'a': 1},
+                            tags=['b', 'a'])
+        a = TaskFile('fffffffffffffffe')
+        if a.exists():
+            os.remove(a.task_file)
+        a.save(params)
+        a.status = 'running'
+        headers = TaskFile.read_headers(['fffffffffffffffe', 'fffffffffffffff0'])
+        self.assertIsNone(headers['fffffffffffffff0'])
+        self.assertEqual(headers['fffffffffffffffe'], a.info)
+        self.assertEqual(headers['fffffffffffffffe'].tags.decode().strip(), 'a b')
+        self.assertEqual(a.tags_created_start_and_duration(header=headers['fffffffffffffffe'])[0], 'a b')
+        a.status = 'completed'
+
+    def testSubmitTaskWithTemplate(self):
+        '''Test that tasks are submitted without changing shared states'''
+        from sos.hosts import LocalHost
+        from sos.task_engines import BackgroundProcess_TaskEngine
+        params = TaskParams(name='fffffffffffffffc',
+                            global_def={}, task='b=a',
+                            sos_dict={'a': 1, '_runtime': {'cores': 3}},
+                            tags=[])
+        a = TaskFile('fffffffffffffffc')
+        if a.exists():
+            os.remove(a.task_file)
+        a.save(params)
+        agent = LocalHost({'alias': 'template_host', 'submission_workers': 3,
+            'job_template': 'echo {task} {nodes} {cores}'})
+        engine = BackgroundProcess_TaskEngine(agent)
+        self.assertEqual(engine.submission_workers, 3)
+        self.assertTrue(engine._submit_task_with_template(['fffffffffffffffc']))
+        with open(os.path.join(os.path.expanduser('~'), '.sos', 'tasks',
+            'fffffffffffffffc.sh')) as job:
+            self.assertEqual(job.read().strip(), 'echo fffffffffffffffc 1 3')
+        for key in ('task', 'cores', 'nodes', 'cur_dir'):
+            self.assertNotIn(key, agent.config)
+
+    @unittest.skipIf(sys.platform == 'win32', 'No shell script on windows')
+    def testArrayJob(self):
+        '''Test submission of tasks as array jobs with fake Slurm commands'''
+        import stat
+        import tempfile
+        from sos.hosts import LocalHost
+        from sos.task_engines import ArrayJob_TaskEngine
+        task_ids = ['fffffffffffffff7', 'fffffffffffffff8']
+        for idx, task_id in enumerate(task_ids):
+            params = TaskParams(name=task_id, global_def={}, task='b=a',
+                sos_dict={'a': 1, '_runtime': {'cores': idx + 1}}, tags=[])
+            tf = TaskFile(task_id)
+            if tf.exists():
+                os.remove(tf.task_file)
+            tf.save(params)
+        with tempfile.TemporaryDirectory() as tmp:
+            log = os.path.join(tmp, 'log')
+            for cmd, text in [('sbatch', 'echo "$@" >> {log}; echo Submitted batch job 42'),
+                ('squeue', 'echo "$@" >> {log}; echo 42_1 PENDING'),
+                ('scancel', 'echo scancel "$@" >> {log}')]:
+                with open(os.path.join(tmp, cmd), 'w') as script:
+                    script.write('#!/bin/sh\n' + text.format(log=log) + '\n')
+                os.chmod(os.path.join(tmp, cmd), stat.S_IRWXU)
+            old_path = os.environ['PATH']
+            os.environ['PATH'] = tmp + os.pathsep + old_path
+            try:
+                agent = LocalHost({'alias': 'array_host',
+                    'job_template': '#SBATCH --array=0-{num_tasks - 1} -c {cores}\nTASKS=({tasks})'})
+                engine = ArrayJob_TaskEngine(agent)
+                engine.engine_ready.set()
+                self.assertTrue(engine.execute_tasks(task_ids))
+                job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks',
+                    'fffffffffffffff7-fffffffffffffff8.sh')
+                with open(job_file) as job:
+                    self.assertEqual(job.read(),
+                        '#SBATCH --array=0-1 -c 2\nTASKS=(fffffffffffffff7 fffffffffffffff8)')
+                self.assertEqual(engine._array_elements['fffffffffffffff8'], ('42', '42_1'))
+                # the first task is no longer known to the scheduler
+                status = dict(line.split('\t') for line in
+                    engine.query_tasks(task_ids).strip().splitlines())
+                self.assertEqual(status, {'fffffffffffffff7': 'aborted',
+                    'fffffffffffffff8': 'pending'})
+                engine.kill_tasks(['fffffffffffffff8'])
+                with open(log) as lf:
+                    calls = lf.read().splitlines()
+                self.assertIn('-h -r -o %i %T -j 42', calls)
+                self.assertEqual(calls[-1], 'scancel 42_1')
+                # array elements of tasks are removed when the tasks stop
+                engine.update_task_status('fffffffffffffff7', 'aborted')
+                self.assertEqual(list(engine._array_elements.keys()), ['fffffffffffffff8'])
+                engine.update_task_status('fffffffffffffff8', 'running')
+                self.assertIn('fffffffffffffff8', engine._array_elements)
+                engine.update_task_status('fffffffffffffff8', 'completed')
+                self.assertEqual(engine._array_elements, {})
+            finally:
+                os.environ['PATH'] = old_path
+
+    def testAdaptiveStatusCheck(self):
+        '''Test adaptive status check interval and chunked status queries'''
+        from sos.hosts import LocalHost
+        from sos.task_engines import BackgroundProcess_TaskEngine
+        agent = LocalHost({'alias': 'adaptive_host', 'status_check_interval': 2,
+            'status_query_size': 3})
+        engine = BackgroundProcess_TaskEngine(agent)
+        self.assertEqual(engine.max_status_check_interval, 16)
+        self.assertEqual(engine._next_status_check_interval(), 2)
+        # back off if there is no change
+        engine._status_check_interval = 16
+        self.assertEqual(engine._next_status_check_interval(), 16)
+        # but check sooner if a task is expected to complete soon
+        engine._task_durations.extend([10, 10, 100])
+        engine.running_tasks = ['t1', 't2']
+        engine.task_info['t1']['date'] = [None, time.time() - 5, None]
+        engine.task_info['t2']['date'] = [None, time.time() - 50, None]
+        self.assertLessEqual(engine._next_status_check_interval(), 5)
+        self.assertGreaterEqual(engine._next_status_check_interval(), 2)
+        # status queries are chunked
+        cmds = []
+        agent.check_output = lambda cmd: cmds.append(cmd) or 'out\n'
+        self.assertEqual(engine.query_tasks(['a', 'b', 'c', 'd', 'e']), 'out\nout')
+        self.assertEqual(len(cmds), 2)
+        self.assertTrue(cmds[1].startswith('sos status d e -v 1'))
+
+    def testTaskStatusIndex(self):
+        '''Test index of task status'''
+        import pickle
+        from sos.tasks import TaskStatusIndex, check_tasks, task_status_index
+        if os.path.isfile('task_status.db'):
+            os.remove('task_status.db')
+        index = TaskStatusIndex('task_status.db')
+        index.update({'t1': {'status': 'completed', 'files': {'t1.task': 1.0}},
+                      't2': {'status': 'running', 'files': {}}})
+        self.assertEqual(index.get(['t1', 't3']),
+                         {'t1': {'status': 'completed', 'files': {'t1.task': 1.0}}})
+        # the index does not use WAL, which is unsafe on network filesystems
+        self.assertEqual(sqlite3.connect('task_status.db').execute(
+            'PRAGMA journal_mode').fetchone()[0], 'delete')
+        index.remove(['t1'])
+        self.assertEqual(list(index.get(['t1', 't2']).keys()), ['t2'])
+        index.remove(keep=['t1'])
+        self.assertEqual(index.get(['t1', 't2']), {})
+        # status cache of previous versions of sos is imported and removed
+        with open('status_cache.pickle', 'wb') as cache:
+            pickle.dump({'t3': {'status': 'failed', 'files': {'t3.task': 2.0}}}, cache)
+        index.migrate_status_cache('status_cache.pickle')
+        self.assertFalse(os.path.isfile('status_cache.pickle'))
+        self.assertEqual(index.get(['t3']), {'t3': {'status': 'failed', 'files': {'t3.task': 2.0}}})
+        # status changes are written to task files only, and are recorded
+        # to the index when the status of tasks are checked
+        params = TaskParams(name='fffffffffffffffd',
+                            global_def={}, task='b=a', sos_dict={'a': 1},
+                            tags=['b', 'a'])
+        a = TaskFile('fffffffffffffffd')
+        if a.exists():
+            os.remove(a.task_file)
+        a.save(params)
+        task_status_index().remove(['fffffffffffffffd'])
+        a.status = 'completed'
+        self.assertEqual(task_status_index().get(['fffffffffffffffd']), {})
+        self.assertEqual(check_tasks(['fffffffffffffffd'], False)['fffffffffffffffd']['status'],
+                         'completed')
+        self.assertEqual(task_status_index().get(['fffffffffffffffd'])['fffffffffffffffd']['status'],
+                         'completed')
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), 'inotify is only available under linux')
+    def testTaskStatusWatcher(self):
+        '''Test watching changes to task files'''
+        import queue
+        from sos.task_engines import TaskStatusWatcher
+        if os.path.isdir('temp_watcher'):
+            shutil.rmtree('temp_watcher')
+        os.mkdir('temp_watcher')
+        changed = queue.Queue()
+        watcher = TaskStatusWatcher.create(changed.put, 'temp_watcher')
+        self.assertIsNotNone(watcher)
+        watcher.start()
+        with open(os.path.join('temp_watcher', 'a.sh'), 'w') as sh:
+            sh.write('a')
+        with open(os.path.join('temp_watcher', 'b.pulse'), 'w') as pulse:
+            pulse.write('b')
+        self.assertEqual(changed.get(timeout=5), {'b'})
+        # the inotify file descriptor is closed after the watcher is stopped
+        fd = watcher._fd
+        watcher.stop()
+        watcher.join(5)
+        self.assertFalse(watcher.is_alive())
+        self.assertRaises(OSError, os.fstat, fd)
+        shutil.rmtree('temp_watcher')
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), 'inotify is only available under linux')
+    def testStopTaskEngine(self):
+        '''Test stopping task engine and its status watcher'''
+        from sos.hosts import LocalHost
+        from sos.task_engines import BackgroundProcess_TaskEngine
+        agent = LocalHost({'alias': 'stopped_host', 'watch_task_files': True})
+        engine = BackgroundProcess_TaskEngine(agent)
+        engine.start()
+        engine.engine_ready.wait()
+        watcher = engine._status_watcher
+        self.assertIsNotNone(watcher)
+        engine.stop()
+        engine.join(10)
+        self.assertFalse(engine.is_alive())
+        watcher.join(10)
+        self.assertFalse(watcher.is_alive())
+
+    def testWakeupTaskEngine(self):
+        '''Test if task engine responds to tasks without waiting for status check'''
+        from sos.hosts import LocalHost
+        from sos.task_engines import BackgroundProcess_TaskEngine
+
+        class Recording_TaskEngine(BackgroundProcess_TaskEngine):
+            def __init__(self, agent):
+                super(Recording_TaskEngine, self).__init__(agent)
+                self.executed = []
+
+            def execute_tasks(self, task_ids):
+                self.executed.extend(task_ids)
+                return True
+
+            def query_tasks(self, tasks=None, check_all=False, **kwargs):
+                return ''
+
+        def wait_for(cond, timeout=5):
+            start = time.time()
+            while not cond() and time.time() - start < timeout:
+                time.sleep(0.01)
+            return cond()
+
+        env.config['max_running_jobs'] = None
+        agent = LocalHost({'alias': 'wakeup_host', 'watch_task_files': False,
+            'status_check_interval': 100, 'max_running_jobs': 1, 'batch_size': 1})
+        engine = Recording_TaskEngine(agent)
+        engine.start()
+        engine.engine_ready.wait()
+        try:
+            # a submitted task is submitted and becomes running right away
+            engine.submit_task('wakeup_t1')
+            self.assertTrue(wait_for(lambda: 'wakeup_t1' in engine.running_tasks))
+            # the second task waits for the first task to complete
+            engine.submit_task('wakeup_t2')
+            time.sleep(0.5)
+            self.assertEqual(engine.executed, ['wakeup_t1'])
+            # completion of the first task, e.g. reported by the status
+            # watcher, triggers the submission of the second task
+            engine.update_task_status('wakeup_t1', 'completed')
+            self.assertTrue(wait_for(lambda: 'wakeup_t2' in engine.running_tasks))
+            self.assertEqual(engine.executed, ['wakeup_t1', 'wakeup_t2'])
+        finally:
+            start = time.time()
+            engine.stop()
+            engine.join(10)
+        self.assertFalse(engine.is_alive())
+        self.assertLess(time.time() - start, 2)
+
     def testWorkdir(self):
         '''Test workdir option for runtime environment'''
         import tempfile
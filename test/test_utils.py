@@ -269,6 +269,121 @@ input: something_unknown, sos_groups(output_from(['C1', 'C2']), by=2), group_by=
             ts.write('bac')
         self.assertFalse(a.validate())
 
+    def testFilesMD5(self):
+        '''test concurrent calculation of md5 of multiple files'''
+        from sos.targets import fileMD5, filesMD5
+        files = []
+        for i, size in enumerate((0, 100, 2**20 + 1, 2**24 + 100)):
+            files.append(f'test_md5_{i}.txt')
+            with open(files[-1], 'wb') as md5:
+                md5.write(os.urandom(size))
+        self.assertEqual(filesMD5(files), [fileMD5(x) for x in files])
+        self.assertEqual(filesMD5(files, partial=False),
+            [fileMD5(x, partial=False) for x in files])
+        self.assertNotEqual(fileMD5(files[-1]), fileMD5(files[-1], partial=False))
+        for f in files:
+            os.remove(f)
+
+    def testHashCache(self):
+        '''test caching of md5 by stat identity of files'''
+        from types import SimpleNamespace
+        from sos.targets import fileMD5, default_hash_algorithm
+        from sos.signatures import HashCache, hash_cache
+        with open('test_hash_cache.txt', 'w') as hc:
+            hc.write('hash cache')
+        md5 = fileMD5('test_hash_cache.txt')
+        st = os.stat('test_hash_cache.txt')
+        self.assertEqual(hash_cache().get(st, f'{default_hash_algorithm}-partial'), md5)
+        # modified file has a new entry
+        with open('test_hash_cache.txt', 'w') as hc:
+            hc.write('hash cache modified')
+        self.assertNotEqual(fileMD5('test_hash_cache.txt'), md5)
+        os.remove('test_hash_cache.txt')
+        # least recently used entries are evicted
+        cache = HashCache(os.path.join(env.exec_dir, '.sos', 'test_hash_cache.db'), max_size=10)
+        stats = [SimpleNamespace(st_dev=0, st_ino=i, st_mtime_ns=i, st_size=10)
+            for i in range(20)]
+        for i, st in enumerate(stats):
+            cache.set(st, 'test', str(i))
+        # recently read entries are kept
+        self.assertEqual(cache.get(stats[0], 'test'), '0')
+        cache.evict()
+        self.assertEqual(cache.get(stats[0], 'test'), '0')
+        self.assertIsNone(cache.get(stats[1], 'test'))
+        self.assertEqual(cache.get(stats[19], 'test'), '19')
+
+    def testFileSigs(self):
+        '''test batched writing and migration of file signatures'''
+        from sos.targets import textMD5
+        from sos.signatures import file_signatures
+        for name in ('test_sig1.txt', 'test_sig2.txt'):
+            with open(name, 'w') as ts:
+                ts.write(name)
+        sos_targets('test_sig1.txt', 'test_sig2.txt').write_sig()
+        sigs = file_signatures().get_many(
+            [os.path.abspath(x) for x in ('test_sig1.txt', 'test_sig2.txt')])
+        self.assertEqual(len(sigs), 2)
+        self.assertTrue(file_target('test_sig2.txt').validate())
+        # signature saved in .file_info by previous versions of sos
+        with open('test_sig3.txt', 'w') as ts:
+            ts.write('legacy')
+        a = file_target('test_sig3.txt')
+        file_signatures().remove_many([str(a.resolve())])
+        sig_file = os.path.join(env.exec_dir, '.sos',
+            f'{textMD5(str(a.resolve()))}.file_info')
+        with open(sig_file, 'w') as sig:
+            sig.write('\t'.join(str(x) for x in a.target_signature()))
+        self.assertTrue(a.validate())
+        self.assertFalse(os.path.isfile(sig_file))
+        self.assertTrue(a.validate())
+
+    def testMessageEncoding(self):
+        '''Test encoding of messages passed to the controller'''
+        import pickle
+        import zmq
+        from sos.messages import decode_msg, decode_tags, encode_msg, recv_message, send_message
+        for msg in [['progress', 'substep_completed', 'abc'], ['nprocs', 3],
+                    ['step', 'id', b'sig', None], [True, False, 1.5, -12], [], [''], ['a\x1fb', 'c'],
+                    ['workflow', 'task', 'id', {'ret_code': 0, 'output': sos_targets('a.txt')}],
+                    'ok', None, ('a', 1), {'a': [1, 2]}, sos_targets('a.txt', 'b.txt'),
+                    ['large', b'x' * 100000, 'y' * 100000]]:
+            self.assertEqual(decode_msg(encode_msg(msg)), msg)
+        # tags are not pickled
+        self.assertEqual(encode_msg(['progress', 'substep_completed', 'abc']),
+            [b'T\x03progress\x1fsubstep_completed\x1fabc'])
+        self.assertEqual(encode_msg(['progress', 'step_completed', -1, 'step_id', None]),
+            [b'L\x02progress\x1fstep_completed', pickle.dumps(['progress', 'step_completed', -1, 'step_id', None], pickle.HIGHEST_PROTOCOL)])
+        # messages can be routed by tags
+        self.assertEqual(decode_tags(encode_msg(['workflow', 'task', 'id', {'ret_code': 0}])[0]),
+            ['workflow', 'task', 'id'])
+        # through zmq sockets
+        context = zmq.Context()
+        pull = context.socket(zmq.PULL)
+        port = pull.bind_to_random_port('tcp://127.0.0.1')
+        push = context.socket(zmq.PUSH)
+        push.connect(f'tcp://127.0.0.1:{port}')
+        try:
+            send_message(push, ['workflow', 'tracked_files', 'id', {'input_files': ['a']}])
+            send_message(push, ['large', b'x' * 100000])
+            self.assertEqual(recv_message(pull),
+                ['workflow', 'tracked_files', 'id', {'input_files': ['a']}])
+            self.assertEqual(recv_message(pull), ['large', b'x' * 100000])
+            # messages sent by send_pyobj are received in order
+            push.send_pyobj(['step', 'get_many', ['a', 'b']])
+            send_message(push, ['progress', 'substep_completed', 'abc'])
+            push.send_pyobj(None)
+            send_message(push, ['nprocs', 3])
+            push.send_pyobj('ok')
+            self.assertEqual(recv_message(pull), ['step', 'get_many', ['a', 'b']])
+            self.assertEqual(recv_message(pull), ['progress', 'substep_completed', 'abc'])
+            self.assertEqual(recv_message(pull), None)
+            self.assertEqual(recv_message(pull), ['nprocs', 3])
+            self.assertEqual(recv_message(pull), 'ok')
+        finally:
+            push.close(linger=0)
+            pull.close(linger=0)
+            context.term()
+
 
 if __name__ == '__main__':
     unittest.main()